@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+إحصاءات الإعارة من ملخصات يومية تُحدث تزايدياً (مهمة دورية)
+
+كل يوم مكتمل يُلخص مرة واحدة في loan_daily و loan_rollups، والتقارير تقرأ الملخصات فقط
+مهما كبر borrowed_books. المستعيرون المختلفون يُحفظون كمسودة HyperLogLog لكل يوم،
+ودمج المسودات (أكبر قيمة لكل سجل) يعطي العدد التقريبي لأي نطاق بدون قراءة الإعارات.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+import numpy as np
+from dotenv import load_dotenv
+
+import backends
+from library_base import LOAN_ARCHIVE_AGE_DAYS, month_start
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 2^12 سجل: خطأ معياري ~1.6% و 4 KB لكل يوم قبل الضغط
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+# أيام تُلخص في transaction واحدة
+ANALYTICS_WINDOW_DAYS = int(os.getenv('ANALYTICS_WINDOW_DAYS', 7))
+# آخر أيام مكتملة يُعاد تلخيصها في كل تشغيل: إعارة بدأت قبل منتصف الليل قد تُثبت بعده
+ANALYTICS_REROLL_DAYS = int(os.getenv('ANALYTICS_REROLL_DAYS', 1))
+STATE = 'analytics_rolled_through'
+INTERVALS = ('day', 'week', 'month')
+
+
+def borrower_hashes(user_ids, labels=()):
+    """hash بـ 64 بت لكل مستعير: splitmix64 لأرقام المستخدمين، و blake2b لنص borrower في السجلات القديمة"""
+    z = np.asarray(user_ids, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    if not labels:
+        return z
+    named = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(label.encode(), digest_size=8).digest(), 'little') for label in labels),
+        dtype=np.uint64, count=len(labels)
+    )
+    return np.concatenate([z, named])
+
+
+def hll_registers(hashes):
+    """مسودة HyperLogLog: أول HLL_PRECISION بت تختار السجل، وكل سجل يحفظ أطول بادئة أصفار + 1"""
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    if len(hashes):
+        index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+        rest = hashes << np.uint64(HLL_PRECISION)
+        # طول rest بالبتات من أس frexp؛ الصفر يعطي 0 فيأخذ أقصى قيمة
+        bits = np.frexp(rest.astype(np.float64))[1]
+        rank = np.clip(65 - bits, 1, 65 - HLL_PRECISION).astype(np.uint8)
+        np.maximum.at(registers, index, rank)
+    return registers
+
+
+def hll_estimate(registers):
+    """العدد التقريبي من السجلات، مع linear counting للأعداد الصغيرة"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = m - np.count_nonzero(registers)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def hll_dump(registers):
+    return zlib.compress(registers.tobytes())
+
+
+def hll_load(blob):
+    return np.frombuffer(zlib.decompress(bytes(blob)), dtype=np.uint8)
+
+
+def summarize(activity):
+    """تجميعات get_loan_activity -> (صفوف loan_daily، صفوف الأبعاد)"""
+    loans = Counter()
+    dimensions = {'author': Counter(), 'role': Counter()}
+    for dimension, key in (('author', 'authors'), ('role', 'roles')):
+        for row in activity[key]:
+            # الكتاب المحذوف أو المستخدم المحذوف: القيمة الفارغة
+            dimensions[dimension][row['day'], row['value'] or ''] += row['loans']
+    for (day, _), count in dimensions['author'].items():
+        loans[day] += count
+
+    user_ids, labels = defaultdict(set), defaultdict(set)
+    for row in activity['borrowers']:
+        if row['user_id'] is not None:
+            user_ids[row['day']].add(row['user_id'])
+        elif row['borrower']:
+            labels[row['day']].add(row['borrower'])
+
+    returns, loan_days = Counter(), Counter()
+    for row in activity['returns']:
+        returns[row['day']] += row['loans']
+        # السجلات القديمة بدون borrow_date تُعامل كإرجاع في نفس اليوم، كما في الأرشيف
+        loan_days[row['day']] += (row['day'] - (row['borrow_date'] or row['day'])).days * row['loans']
+
+    daily = []
+    for day in sorted(set(loans) | set(returns)):
+        day_users, day_labels = user_ids.get(day, ()), labels.get(day, ())
+        blob = None
+        if day_users or day_labels:
+            blob = hll_dump(hll_registers(borrower_hashes(sorted(day_users), sorted(day_labels))))
+        daily.append((day, loans[day], returns[day], loan_days[day], len(day_users) + len(day_labels), blob))
+    return daily, {
+        dimension: [(day, value, count) for (day, value), count in sorted(counts.items())]
+        for dimension, counts in dimensions.items()
+    }
+
+
+def rolled_through(lib):
+    """آخر يوم ملخص (None قبل أول تشغيل)"""
+    with lib.get_cursor() as cursor:
+        ordinal = lib.get_job_state(cursor, STATE)
+    return date.fromordinal(ordinal) if ordinal else None
+
+
+def run(lib, full=False, through=None, window_days=ANALYTICS_WINDOW_DAYS, should_stop=None):
+    """تلخيص الأيام المكتملة بعد آخر يوم ملخص، نافذة أيام لكل transaction مع تقدم المؤشر معها"""
+    started = time.time()
+    today = date.today()
+    through = through or today - timedelta(days=1)
+    last = None if full else rolled_through(lib)
+    if last is None:
+        start = lib.get_first_loan_date()
+        if start is None:
+            logger.info("✅ Analytics: no loans to summarize")
+            return {'days': 0}
+    else:
+        start = min(last + timedelta(days=1), through - timedelta(days=ANALYTICS_REROLL_DAYS - 1))
+    # الأرشيف يحوي إعارات أُرجعت قبل LOAN_ARCHIVE_AGE_DAYS فقط، فالأيام الأحدث في الجدول الساخن وحده
+    archive_before = today - timedelta(days=LOAN_ARCHIVE_AGE_DAYS)
+
+    day = start
+    days = loans = 0
+    while day <= through:
+        end = min(day + timedelta(days=window_days), through + timedelta(days=1))
+        with lib.get_cursor() as cursor:
+            daily, dimensions = summarize(lib.get_loan_activity(cursor, day, end, archive=day < archive_before))
+            lib.save_loan_rollups(cursor, day, end, daily, dimensions)
+            lib.set_job_state(cursor, STATE, (end - timedelta(days=1)).toordinal())
+        days += (end - day).days
+        loans += sum(row[1] for row in daily)
+        day = end
+        if should_stop and should_stop() and day <= through:
+            logger.warning(f"⚠️  Analytics stopped early at {day}; the next run continues from there")
+            return {'days': days, 'loans': loans, 'stopped': True}
+
+    if days:
+        logger.info(f"✅ Analytics: {days:,} day(s) through {through} summarized ({loans:,} loan(s)) "
+                    f"in {time.time() - started:.1f}s")
+    return {'days': days, 'loans': loans}
+
+
+def _bucket(day, interval):
+    if interval == 'month':
+        return month_start(day)
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def report(lib, start, end, interval='day', top=10):
+    """إحصاءات الأيام [start, end] (شاملة) من الملخصات وحدها"""
+    stop = end + timedelta(days=1)
+    rows = lib.get_loan_daily(start, stop)
+
+    # كل فترات النطاق، بما فيها الفترات بدون إعارات
+    buckets = {}
+    day = start
+    while day <= end:
+        buckets.setdefault(_bucket(day, interval), {'loans': 0, 'returns': 0, 'loan_days': 0, 'borrowers': 0,
+                                                     'hll': None})
+        day += timedelta(days=1)
+    overall = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    for row in rows:
+        bucket = buckets[_bucket(row['day'], interval)]
+        bucket['loans'] += row['loans']
+        bucket['returns'] += row['returns']
+        bucket['loan_days'] += row['loan_days']
+        bucket['borrowers'] += row['borrowers']
+        if row['borrowers_hll'] is not None:
+            registers = hll_load(row['borrowers_hll'])
+            np.maximum(overall, registers, out=overall)
+            if interval != 'day':
+                bucket['hll'] = registers.copy() if bucket['hll'] is None else np.maximum(bucket['hll'], registers)
+
+    def average(loan_days, returns):
+        return round(loan_days / returns, 2) if returns else None
+
+    series = []
+    for period, bucket in buckets.items():
+        if interval != 'day':
+            # مجموع الأعداد اليومية يكرر المستعير النشط في أكثر من يوم
+            bucket['borrowers'] = hll_estimate(bucket['hll']) if bucket['hll'] is not None else 0
+        series.append({
+            'period': period.isoformat(),
+            'loans': int(bucket['loans']),
+            'returns': int(bucket['returns']),
+            'average_loan_days': average(bucket['loan_days'], bucket['returns']),
+            'borrowers': int(bucket['borrowers']),
+        })
+
+    total_returns = sum(int(row['returns']) for row in rows)
+    through = rolled_through(lib)
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'through': through.isoformat() if through else None,
+        'interval': interval,
+        'totals': {
+            'loans': sum(int(row['loans']) for row in rows),
+            'returns': total_returns,
+            'average_loan_days': average(sum(int(row['loan_days']) for row in rows), total_returns),
+            'active_borrowers': hll_estimate(overall) if overall.any() else 0,
+        },
+        'series': series,
+        'authors': [{'author': row['value'] or None, 'loans': int(row['total'])}
+                    for row in lib.get_loan_rollup_totals('author', start, stop, top)],
+        'roles': [{'role': row['value'] or None, 'loans': int(row['total'])}
+                  for row in lib.get_loan_rollup_totals('role', start, stop)],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize loans into daily rollups and print circulation reports")
+    parser.add_argument('--database-url', help="database to use (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--full', action='store_true',
+                        help="re-summarize every day from the first loan (after bulk loads or migrations)")
+    parser.add_argument('--report', nargs=2, metavar=('FROM', 'TO'), type=date.fromisoformat,
+                        help="print the report for this inclusive date range instead of updating")
+    parser.add_argument('--interval', choices=INTERVALS, default='month')
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    lib.init_db()
+    if args.report:
+        print(json.dumps(report(lib, args.report[0], args.report[1], args.interval), indent=2))
+    else:
+        run(lib, full=args.full)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import (Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify,
+                   stream_with_context, stream_template, get_flashed_messages)
 from functools import wraps
-import library_mysql as library
+import itertools
+import backends
+from library_base import USER_SEARCH_FIELDS
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import date, datetime, timedelta
 import logging
 from dotenv import load_dotenv
 
@@ -49,18 +54,369 @@ CREDENTIALS = load_credentials_from_kms()
 # تعيين secret key من .env
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
 
-# تهيئة النظام مع credentials
-lib_system = library.LibraryManagementSystem(credentials=CREDENTIALS)
+# تهيئة النظام مع credentials، والمحرك من DB_BACKEND أو DATABASE_URL
+lib_system = backends.create_library_system(credentials=CREDENTIALS)
 
-# تهيئة قاعدة البيانات عند بدء التشغيل
+# القراءات المتطابقة المتزامنة (الصفحة الرئيسية وقوائم الكتب في وقت الذروة) تشترك في استعلام واحد
+if os.getenv('COALESCE_ENABLED', 'true').lower() == 'true':
+    from singleflight import SingleFlight
+    lib_system.single_flight = SingleFlight()
+
+# انقطاع القاعدة: رفض فوري بدل انتظار مهلة الاتصال في كل طلب، وآخر نتيجة صالحة لقراءات الكتالوج
+if os.getenv('BREAKER_ENABLED', 'true').lower() == 'true':
+    from circuit import CircuitBreaker, StaleResults
+    lib_system.circuit_breaker = CircuitBreaker()
+    lib_system.stale_results = StaleResults()
+
+@app.before_request
+def begin_stale_tracking():
+    if lib_system.stale_results is not None:
+        lib_system.stale_results.begin()
+
+def stale_since():
+    """وقت أقدم نتيجة قديمة عُرضت في هذا الطلب (أثناء انقطاع القاعدة)، أو None"""
+    stale = lib_system.stale_results
+    return stale.served_since() if stale is not None else None
+
+@app.context_processor
+def stale_context():
+    since = stale_since()
+    return {'stale_minutes': max(1, round((time.time() - since) / 60)) if since is not None else None}
+
+@app.after_request
+def mark_stale_response(response):
+    since = stale_since()
+    if since is not None:
+        response.headers['X-Data-Stale-Seconds'] = str(int(time.time() - since))
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# تهيئة قاعدة البيانات عند بدء التشغيل، نسخة واحدة في كل مرة حتى لا يتزامن DDL بين النسخ
 with app.app_context():
     logger.info("Initializing database...")
-    success = lib_system.init_db()
+    with lib_system.exclusive('init_db', timeout=60) as locked:
+        if not locked:
+            logger.warning("⚠️  Could not take the init_db lock, initializing anyway")
+        success = lib_system.init_db()
     if success:
         logger.info("Database initialized successfully")
     else:
         logger.error("Failed to initialize database")
 
+# فهرس الإكمال التلقائي: يُحمل من اللقطة أو يُبنى في الخلفية حتى لا يؤخر بدء التطبيق
+suggest_index = None
+_suggest_building = threading.Lock()
+_suggest_syncing = threading.Lock()
+
+def load_suggest_index(rebuild=False):
+    """تحميل/بناء الفهرس واستبداله؛ بناء واحد فقط في نفس الوقت"""
+    global suggest_index
+    from suggest import SuggestIndex
+
+    if not _suggest_building.acquire(blocking=False):
+        return suggest_index
+    try:
+        if rebuild:
+            index = SuggestIndex.build(lib_system)
+            index.save()
+        else:
+            index = SuggestIndex.load_or_build(lib_system)
+        suggest_index = index
+        return index
+    except Exception as e:
+        logger.error(f"❌ Suggest index could not be built: {e}")
+        return suggest_index
+    finally:
+        _suggest_building.release()
+
+def sync_suggest_index(index):
+    """تطبيق سجل التغييرات على الفهرس (والدمج) في خيط خلفي، حتى لا يدفع طلب الإكمال ثمنه"""
+    try:
+        if not index.sync(lib_system):
+            # سجل التغييرات حُذف بعد آخر مزامنة: الفهرس الحالي يخدم الطلبات حتى ينتهي البناء
+            load_suggest_index(rebuild=True)
+    except Exception as e:
+        logger.error(f"❌ Suggest index sync failed: {e}")
+    finally:
+        _suggest_syncing.release()
+
+if os.getenv('SUGGEST_ENABLED', 'true').lower() == 'true':
+    threading.Thread(target=load_suggest_index, name='suggest-index', daemon=True).start()
+
+# فهرس "كتب مشابهة": ملفات mmap مشتركة بين العمليات، يُفتح فوراً أو يُبنى في الخلفية
+similar_index = None
+_similar_building = threading.Lock()
+
+def load_similar_index(rebuild=False):
+    global similar_index
+    from similar import SimilarIndex
+
+    if not _similar_building.acquire(blocking=False):
+        return similar_index
+    try:
+        index = None if rebuild else SimilarIndex.open()
+        if index is None:
+            index = SimilarIndex.build(lib_system)
+        similar_index = index
+        return index
+    except Exception as e:
+        logger.error(f"❌ Similar-books index could not be built: {e}")
+        return similar_index
+    finally:
+        _similar_building.release()
+
+def similar_books(book_ids, limit=10):
+    """{book_id: [(كتاب، الدرجة), ...]} من الفهرس الحالي، أو قوائم فارغة قبل جاهزيته"""
+    global similar_index
+    index = similar_index
+    if index is None:
+        return {book_id: [] for book_id in book_ids}
+    if not index.refresh():
+        # عملية أخرى بنت نسخة أحدث
+        from similar import SimilarIndex
+        index = similar_index = SimilarIndex.open() or index
+    results = index.similar_many(book_ids, limit)
+    others = {other for items in results.values() for other, _ in items}
+    snapshot = current_catalog()
+    books = snapshot.get_books(others) if snapshot is not None else lib_system.get_books(others)
+    return {
+        book_id: [(books[other], score) for other, score in items if other in books]
+        for book_id, items in results.items()
+    }
+
+if os.getenv('SIMILAR_ENABLED', 'true').lower() == 'true':
+    threading.Thread(target=load_similar_index, name='similar-index', daemon=True).start()
+
+# لقطة الكتالوج: ملف mmap واحد لكل pod تقرأ منه كل العمليات بدون نسخة لكل عملية
+catalog = None
+_catalog_checked = 0.0
+# منذ متى تتأخر اللقطة عن سجل التغييرات (None إذا كانت محدثة)
+_catalog_behind_since = None
+# مؤشر السجل بعد آخر تغيير كتبته هذه العملية: لا تُعرض لقطة أقدم منه
+_catalog_needed = 0
+_catalog_publishing = threading.Lock()
+CATALOG_SNAPSHOT_CHECK_SECONDS = float(os.getenv('CATALOG_SNAPSHOT_CHECK_SECONDS', 1))
+# أقصى تأخر عن تغييرات العمليات الأخرى قبل القراءة من القاعدة
+CATALOG_SNAPSHOT_MAX_LAG_SECONDS = float(os.getenv('CATALOG_SNAPSHOT_MAX_LAG_SECONDS', 30))
+
+def load_catalog_snapshot():
+    """ربط النسخة المنشورة، أو بناء أول نسخة إذا لم توجد"""
+    global catalog
+    from catalog_snapshot import CatalogSnapshot, publish
+
+    try:
+        if CatalogSnapshot.current_version() is None:
+            publish(lib_system)
+        catalog = CatalogSnapshot.open() or catalog
+    except Exception as e:
+        logger.error(f"❌ Catalog snapshot could not be loaded: {e}")
+    return catalog
+
+def _publish_catalog():
+    """نشر نسخة تلحق بالسجل ثم ربطها (في خيط؛ قفل الملف يمنع النشر المتزامن بين العمليات)"""
+    global _catalog_checked
+    try:
+        import catalog_snapshot
+        catalog_snapshot.publish(lib_system)
+        load_catalog_snapshot()
+        _catalog_checked = 0.0
+    except Exception as e:
+        logger.error(f"❌ Catalog snapshot could not be published: {e}")
+    finally:
+        _catalog_publishing.release()
+
+def _catalog_written(changes):
+    """مستمع LibraryBackend: ما كتبته هذه العملية يُقرأ من القاعدة حتى تلحق به اللقطة"""
+    global _catalog_needed, _catalog_checked
+    if catalog is not None:
+        _catalog_needed = max(_catalog_needed, max(change_id for _, _, change_id in changes))
+        _catalog_checked = 0.0
+
+def current_catalog():
+    """اللقطة إذا لم تتأخر عن الكتالوج أكثر من المسموح، وإلا None فتُقرأ البيانات من القاعدة
+
+    التأخر يُفحص مرة كل CATALOG_SNAPSHOT_CHECK_SECONDS، وعند التأخر تنشر هذه العملية نسخة جديدة
+    في الخلفية دون انتظار مهمة المجدول.
+    """
+    global catalog, _catalog_checked, _catalog_behind_since
+    snapshot = catalog
+    if snapshot is None:
+        return None
+    now = time.monotonic()
+    if now - _catalog_checked >= CATALOG_SNAPSHOT_CHECK_SECONDS:
+        _catalog_checked = now
+        if not snapshot.refresh():
+            # عملية أخرى نشرت نسخة أحدث
+            from catalog_snapshot import CatalogSnapshot
+            snapshot = catalog = CatalogSnapshot.open() or snapshot
+        # مؤشر سجل التغييرات استعلام واحد على المفتاح الأساسي بدل قراءة الكتب نفسها
+        if snapshot.cursor < max(_catalog_needed, lib_system.get_change_cursor()):
+            if _catalog_behind_since is None:
+                _catalog_behind_since = now
+            if _catalog_publishing.acquire(blocking=False):
+                threading.Thread(target=_publish_catalog, name='catalog-publish', daemon=True).start()
+        else:
+            _catalog_behind_since = None
+    if snapshot.cursor < _catalog_needed:
+        return None
+    if _catalog_behind_since is not None and now - _catalog_behind_since > CATALOG_SNAPSHOT_MAX_LAG_SECONDS:
+        return None
+    return snapshot
+
+# إتاحة الكتب في الذاكرة لكل عملية: تُحدث بعد commit الإعارة والإرجاع هنا، ومن سجل التغييرات لما عداها
+availability = None
+
+def load_availability():
+    global availability
+    from availability import AvailabilityBitmap
+
+    bitmap = AvailabilityBitmap()
+    # قبل التحميل حتى لا يضيع تغيير أثناءه (ما يفوته يصل من السجل بعد مؤشر التحميل)
+    lib_system.add_availability_listener(bitmap.update)
+    try:
+        bitmap.load(lib_system)
+        availability = bitmap
+    except Exception as e:
+        logger.error(f"❌ Availability bitmap could not be loaded: {e}")
+    return availability
+
+def current_availability():
+    """الـ bitmap بعد متابعة سجل التغييرات (مرة كل AVAILABILITY_SYNC_SECONDS على الأكثر)، أو None قبل تحميله"""
+    bitmap = availability
+    if bitmap is not None:
+        try:
+            bitmap.sync(lib_system)
+        except lib_system.Error as e:
+            logger.error(f"❌ Availability bitmap sync failed: {e}")
+    return bitmap
+
+if os.getenv('AVAILABILITY_BITMAP_ENABLED', 'true').lower() == 'true':
+    threading.Thread(target=load_availability, name='availability-bitmap', daemon=True).start()
+
+def catalog_stats():
+    """أعداد الكتب من bitmap الإتاحة أو من اللقطة، أو من القاعدة إذا لم يكن أي منهما جاهزاً"""
+    bitmap = current_availability()
+    if bitmap is not None:
+        return bitmap.counts()
+    snapshot = current_catalog()
+    if snapshot is not None:
+        return snapshot.counts()
+    return {
+        'total_books': lib_system.get_total_books(),
+        'available_books': lib_system.get_available_books_count(),
+        'borrowed_books': lib_system.get_borrowed_books_count(),
+    }
+
+if os.getenv('CATALOG_SNAPSHOT_ENABLED', 'true').lower() == 'true':
+    lib_system.add_availability_listener(_catalog_written)
+    threading.Thread(target=load_catalog_snapshot, name='catalog-snapshot', daemon=True).start()
+
+# المهام الدورية: كل مهمة تعمل في نسخة واحدة فقط من النسخ عبر قفل على قاعدة البيانات
+scheduler = None
+
+def start_scheduler():
+    """تسجيل المهام الدورية وتشغيل المجدول"""
+    global scheduler
+    from scheduler import Scheduler
+
+    scheduler = Scheduler(lib_system, workers=int(os.getenv('SCHEDULER_WORKERS', 2)))
+    scheduler.add_job(
+        'reconcile_availability',
+        lambda ctx: lib_system.reconcile_availability(),
+        interval=int(os.getenv('RECONCILE_INTERVAL', 900)), jitter=60, timeout=120
+    )
+    scheduler.add_job(
+        'expire_holds',
+        lambda ctx: lib_system.expire_holds(should_stop=ctx.expired),
+        interval=int(os.getenv('HOLD_EXPIRY_INTERVAL', 300)), jitter=30, timeout=120
+    )
+    scheduler.add_job(
+        'archive_loans',
+        lambda ctx: lib_system.archive_closed_loans(should_stop=ctx.expired),
+        cron=os.getenv('ARCHIVE_CRON', '30 2 * * *'), jitter=300, timeout=3600
+    )
+
+    scheduler.add_job(
+        'compact_changes',
+        lambda ctx: lib_system.compact_changes(should_stop=ctx.expired),
+        interval=int(os.getenv('CHANGE_COMPACT_INTERVAL', 3600)), jitter=300, timeout=600
+    )
+
+    def rebuild_suggest(ctx):
+        load_suggest_index(rebuild=True)
+
+    # كل نسخة تحتفظ بفهرسها في الذاكرة، فالمهمة غير حصرية
+    scheduler.add_job('rebuild_suggest', rebuild_suggest,
+                      cron=os.getenv('SUGGEST_REBUILD_CRON', '15 4 * * *'), jitter=600, timeout=1800,
+                      exclusive=False)
+
+    scheduler.add_job(
+        'rebuild_facets',
+        lambda ctx: lib_system.rebuild_facets(),
+        cron=os.getenv('FACETS_CRON', '45 3 * * *'), jitter=300, timeout=1800
+    )
+
+    def recommendations(ctx):
+        import recommend
+        return recommend.run(lib_system, should_stop=ctx.expired)
+
+    scheduler.add_job('recommendations', recommendations,
+                      cron=os.getenv('RECOMMEND_CRON', '30 4 * * *'), jitter=300, timeout=3600)
+
+    def rebuild_similar(ctx):
+        load_similar_index(rebuild=True)
+
+    def update_similar(ctx):
+        if similar_index is not None:
+            return similar_index.update(lib_system)
+
+    # الفهرس ملفات على كل نسخة، فالمهمتان غير حصريتين
+    scheduler.add_job('rebuild_similar', rebuild_similar,
+                      cron=os.getenv('SIMILAR_REBUILD_CRON', '0 5 * * *'), jitter=600, timeout=1800,
+                      exclusive=False)
+    scheduler.add_job('update_similar', update_similar,
+                      interval=int(os.getenv('SIMILAR_UPDATE_INTERVAL', 300)), jitter=30, timeout=300,
+                      exclusive=False)
+
+    def analytics(ctx):
+        import analytics
+        return analytics.run(lib_system, should_stop=ctx.expired)
+
+    scheduler.add_job('analytics', analytics,
+                      interval=int(os.getenv('ANALYTICS_INTERVAL', 3600)), jitter=300, timeout=3600)
+
+    def publish_catalog(ctx):
+        import catalog_snapshot
+        result = catalog_snapshot.publish(lib_system)
+        if result is not None and catalog is None:
+            load_catalog_snapshot()
+        return result
+
+    # الملف على كل pod وقفل الملف يمنع النشر المتزامن بين عملياته، فالمهمة غير حصرية
+    scheduler.add_job('catalog_snapshot', publish_catalog,
+                      interval=int(os.getenv('CATALOG_SNAPSHOT_INTERVAL', 10)), jitter=2, timeout=600,
+                      exclusive=False)
+
+    def reconcile_bitmap(ctx):
+        if availability is not None:
+            return availability.reconcile(lib_system)
+
+    # كل نسخة تحتفظ بـ bitmap في الذاكرة، فالمهمة غير حصرية
+    scheduler.add_job('reconcile_bitmap', reconcile_bitmap,
+                      interval=int(os.getenv('AVAILABILITY_RECONCILE_INTERVAL', 900)), jitter=60, timeout=300,
+                      exclusive=False)
+
+    def compute_fines(ctx):
+        import fines
+        return fines.run(lib_system, should_stop=ctx.expired)
+
+    scheduler.add_job('compute_fines', compute_fines,
+                      cron=os.getenv('FINES_CRON', '0 3 * * *'), jitter=300, timeout=3600)
+    scheduler.start()
+
+if os.getenv('SCHEDULER_ENABLED', 'false').lower() == 'true':
+    start_scheduler()
+
 # الديكوراتورات كما هي...
 def login_required(f):
     @wraps(f)
@@ -101,16 +457,15 @@ def index():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    stats = {
-        'total_books': lib_system.get_total_books(),
-        'available_books': lib_system.get_available_books_count(),
-        'borrowed_books': lib_system.get_borrowed_books_count(),
-    }
+    stats = catalog_stats()
     
     # الحصول على الكتب الجديدة المضافة
     try:
-        all_books = lib_system.get_all_books()
-        recent_books = all_books[:5] if len(all_books) > 5 else all_books
+        snapshot = current_catalog()
+        if snapshot is not None:
+            recent_books = list(itertools.islice(snapshot.iter_books(batch_size=5), 5))
+        else:
+            recent_books = lib_system.get_all_books()[:5]
     except:
         recent_books = []
     
@@ -125,27 +480,57 @@ def index():
 @login_required
 def dashboard():
     """لوحة التحكم"""
-    stats = {
-        'total_books': lib_system.get_total_books(),
-        'available_books': lib_system.get_available_books_count(),
-        'borrowed_books': lib_system.get_borrowed_books_count(),
-    }
+    stats = catalog_stats()
+    
+    stats['overdue_loans'] = lib_system.get_overdue_loans_count()
     
     borrowed_books = lib_system.get_borrowed_books()
+    overdue_loans = lib_system.get_overdue_loans()
     
     return render_template("dashboard.html",
                          stats=stats,
                          borrowed_books=borrowed_books,
+                         overdue_loans=overdue_loans,
                          username=session.get('username'),
                          role=session.get('role'))
 
+BROWSE_PAGE_SIZE = 50
+
+def _browse_filters():
+    """فلاتر التصفح من query string: author و decade و available"""
+    available = request.args.get('available')
+    return {
+        'author': request.args.get('author') or None,
+        'decade': request.args.get('decade', type=int),
+        'available': None if available in (None, '') else available.lower() in ('1', 'true', 'yes'),
+    }
+
 @app.route("/books")
 @login_required
 def books():
-    """صفحة عرض جميع الكتب"""
-    all_books = lib_system.get_all_books()
-    return render_template("books.html", 
-                         books=all_books,
+    """تصفح الكتب مع فلاتر المؤلف والعقد والإتاحة، صفحة بعد صفحة"""
+    filters = _browse_filters()
+    page, next_after = lib_system.browse_books(after=request.args.get('after', type=int),
+                                               limit=BROWSE_PAGE_SIZE, **filters)
+    return render_template("books.html",
+                         books=page,
+                         facets=lib_system.get_facets(),
+                         filters=filters,
+                         next_after=next_after,
+                         role=session.get('role'))
+
+@app.route("/books/<int:book_id>")
+@login_required
+def book_detail(book_id):
+    """صفحة كتاب واحد مع الكتب التي استُعيرت معه"""
+    snapshot = current_catalog()
+    book = snapshot.get_book(book_id) if snapshot is not None else lib_system.get_book(book_id)
+    if not book:
+        return render_template('404.html'), 404
+    return render_template("book.html",
+                         book=book,
+                         neighbours=lib_system.get_book_neighbours(book_id),
+                         similar=similar_books([book_id])[book_id],
                          role=session.get('role'))
 
 @app.route("/books/add", methods=["GET", "POST"])
@@ -195,24 +580,74 @@ def search_books():
                          query=query,
                          role=session.get('role'))
 
+# القوائم الطويلة تُرسل أثناء قراءتها من القاعدة: أول بايت وذاكرة الطلب ثابتان مهما كان عدد الصفوف
+STREAM_CHUNK_BYTES = int(os.getenv('STREAM_CHUNK_BYTES', 16384))
+
+class RowStream:
+    """صفوف مولد من طبقة البيانات لقالب متدفق
+
+    خطأ القاعدة أثناء الإرسال لا يمكن تحويله لصفحة خطأ (الحالة 200 أُرسلت): يُسجل، ويُغلق المؤشر،
+    وتكتمل الصفحة بما وصل مع تنبيه (failed). انقطاع الاتصال يغلق المولد والمؤشر أيضاً.
+    """
+
+    def __init__(self, rows, what):
+        self.rows = rows
+        self.what = what
+        self.count = 0
+        self.failed = False
+
+    def __iter__(self):
+        try:
+            for row in self.rows:
+                self.count += 1
+                yield row
+        except lib_system.Error as e:
+            self.failed = True
+            logger.error(f"❌ Streaming {self.what} failed after {self.count:,} row(s): {e}")
+        finally:
+            self.rows.close()
+
+def render_stream(template, **context):
+    """stream_template مع تجميع الأجزاء الصغيرة في كتل بحجم STREAM_CHUNK_BYTES"""
+    # الرسائل تُقرأ قبل إرسال الترويسات حتى يُحفظ حذفها في cookie الجلسة
+    get_flashed_messages(with_categories=True)
+    chunks = stream_template(template, **context)
+
+    def generate():
+        buffer, size = [], 0
+        try:
+            for chunk in chunks:
+                buffer.append(chunk)
+                size += len(chunk)
+                if size >= STREAM_CHUNK_BYTES:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+            if buffer:
+                yield ''.join(buffer)
+        finally:
+            # انقطاع الاتصال: إغلاق القالب يغلق RowStream ومؤشر القاعدة معه
+            chunks.close()
+
+    return Response(generate(), mimetype='text/html')
+
 @app.route("/books/borrow", methods=["GET", "POST"])
 @login_required
 def borrow_book():
     """استعارة كتاب"""
     if request.method == "POST":
         book_id = request.form.get("book_id")
-        borrower_name = f"{session.get('full_name')} ({session.get('username')})"
         
         if book_id:
-            success = lib_system.borrow_book(int(book_id), borrower_name)
+            success = lib_system.borrow_book(int(book_id), session['user_id'])
             if success:
                 flash("Book borrowed successfully!", "success")
             else:
                 flash("Book is already borrowed or not found", "error")
     
-    available_books = lib_system.get_available_books()
-    return render_template("borrow.html", 
-                         books=available_books,
+    snapshot = current_catalog()
+    books = snapshot.iter_books(available=True) if snapshot is not None else lib_system.iter_available_books()
+    return render_stream("borrow.html",
+                         books=RowStream(books, "available books"),
                          username=session.get('username'))
 
 @app.route("/books/return", methods=["GET", "POST"])
@@ -228,15 +663,70 @@ def return_book():
             else:
                 flash("Book is not currently borrowed", "error")
     
-    borrowed_books = lib_system.get_borrowed_books()
-    return render_template("return.html", books=borrowed_books)
+    return render_stream("return.html", books=RowStream(lib_system.iter_borrowed_books(), "borrowed books"))
+
+@app.route("/my/loans")
+@login_required
+def my_loans():
+    """الكتب المستعارة حالياً للمستخدم الحالي"""
+    loans = lib_system.get_user_loans(session['user_id'])
+    holds = lib_system.get_user_holds(session['user_id'])
+    return render_template("my_loans.html", loans=loans, holds=holds)
+
+@app.route("/books/hold", methods=["POST"])
+@login_required
+def place_hold():
+    """حجز كتاب مُعار: يصبح محجوزاً للمستخدم عند إرجاعه بدلاً من تحديث الصفحة مراراً"""
+    book_id = request.form.get("book_id", type=int)
+    if book_id and lib_system.place_hold(book_id, session['user_id']):
+        flash("Hold placed! The book will be reserved for you when it comes back.", "success")
+    else:
+        flash("Could not place a hold (the book may be available now, or you already hold or have it)", "error")
+    return redirect(url_for("my_loans"))
+
+@app.route("/holds/<int:hold_id>/cancel", methods=["POST"])
+@login_required
+def cancel_hold(hold_id):
+    """إلغاء حجز"""
+    if lib_system.cancel_hold(hold_id, session['user_id']):
+        flash("Hold cancelled", "success")
+    else:
+        flash("Hold not found or no longer active", "error")
+    return redirect(url_for("my_loans"))
+
+USERS_PAGE_SIZE = 50
+USER_ROLES = ['admin', 'librarian', 'user']
+# المجموع لكل دور يحتاج مسح فهرس كامل، فيُحسب مرة كل USER_SUMMARY_TTL ثانية
+USER_SUMMARY_TTL = int(os.getenv('USER_SUMMARY_TTL', 300))
+_role_counts = {'expires': 0.0, 'counts': {}}
+_role_counts_lock = threading.Lock()
+
+def user_role_counts():
+    with _role_counts_lock:
+        if time.monotonic() >= _role_counts['expires']:
+            _role_counts['counts'] = lib_system.get_user_role_counts()
+            _role_counts['expires'] = time.monotonic() + USER_SUMMARY_TTL
+        return _role_counts['counts']
+
+def invalidate_user_role_counts():
+    _role_counts['expires'] = 0.0
 
 @app.route("/users")
 @admin_required
 def users():
-    """إدارة المستخدمين"""
-    all_users = lib_system.get_all_users()
-    return render_template("users.html", users=all_users)
+    """دليل المستخدمين: فلتر الدور، بحث بالبادئة، وصفحة بعد صفحة"""
+    role = request.args.get('role') or None
+    field = request.args.get('field', 'username')
+    filters = {
+        'role': role if role in USER_ROLES else None,
+        'q': request.args.get('q', '').strip(),
+        'field': field if field in USER_SEARCH_FIELDS else 'username',
+    }
+    page, next_after = lib_system.browse_users(filters['role'], filters['q'] or None, filters['field'],
+                                               after=request.args.get('after', type=int), limit=USERS_PAGE_SIZE)
+    counts = user_role_counts()
+    return render_template("users.html", users=page, next_after=next_after, filters=filters,
+                           role_counts=counts, total_users=sum(counts.values()), roles=USER_ROLES)
 
 @app.route("/users/add", methods=["GET", "POST"])
 @admin_required
@@ -258,12 +748,13 @@ def add_user():
             flash("Passwords do not match!", "error")
             return render_template("add_user.html")
         
-        if role not in ['admin', 'librarian', 'user']:
+        if role not in USER_ROLES:
             flash("Invalid role selected", "error")
             return render_template("add_user.html")
         
         success = lib_system.create_user(username, password, role, full_name, email)
         if success:
+            invalidate_user_role_counts()
             flash(f"User '{username}' created successfully!", "success")
             return redirect(url_for("users"))
         else:
@@ -271,6 +762,48 @@ def add_user():
     
     return render_template("add_user.html")
 
+@app.route("/users/import", methods=["GET", "POST"])
+@admin_required
+def import_users():
+    """إنشاء حسابات من ملف CSV؛ النتيجة لكل سطر تُرسل كملف CSV أثناء المعالجة"""
+    import csv
+    import io
+    import provision_users
+
+    if request.method == "GET":
+        return render_template("import_users.html", roles=provision_users.ROLES)
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Choose a CSV file to import", "error")
+        return redirect(url_for("import_users"))
+    default_role = request.form.get("default_role", "user")
+    if default_role not in provision_users.ROLES:
+        default_role = "user"
+
+    # التجزئة داخل عملية الويب افتراضياً؛ PROVISION_WORKERS > 1 يستخدم مجموعة عمليات
+    provisioner = provision_users.Provisioner(
+        lib_system, workers=int(os.getenv('PROVISION_WORKERS', 1)), default_role=default_role
+    )
+    source = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    admin = session.get('username')
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(provision_users.RESULT_COLUMNS)
+        for result in provisioner.run(csv.DictReader(source)):
+            writer.writerow(result)
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+        invalidate_user_role_counts()
+        logger.info(f"✅ {admin} imported users: {provisioner.summary()}")
+
+    return Response(stream_with_context(generate()), mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=provisioning-results.csv"})
+
 @app.route("/profile")
 @login_required
 def profile():
@@ -331,6 +864,8 @@ def health_check():
         return jsonify({
             "status": "healthy",
             "database": "connected",
+            "backend": lib_system.backend_name,
+            "circuit": lib_system.circuit_breaker.state if lib_system.circuit_breaker is not None else None,
             "total_books": total_books,
             "timestamp": datetime.now().isoformat(),
             "credentials_source": "KMS" if 'DB_PASSWORD' in CREDENTIALS and CREDENTIALS['DB_PASSWORD'] else "ENV"
@@ -348,12 +883,269 @@ def health_check():
 @login_required
 def api_stats():
     """API للحصول على الإحصائيات"""
-    stats = {
-        'total_books': lib_system.get_total_books(),
-        'available_books': lib_system.get_available_books_count(),
-        'borrowed_books': lib_system.get_borrowed_books_count(),
+    return jsonify(catalog_stats())
+
+@app.route("/api/v1/books/availability")
+@login_required
+def api_books_availability():
+    """إتاحة حتى 500 كتاب (ids=1,2,3)؛ null لكتاب غير موجود"""
+    ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip().isdigit()][:500]
+    bitmap = current_availability()
+    if bitmap is not None:
+        return jsonify({
+            "books": {str(book_id): available for book_id, available in bitmap.availability(ids).items()},
+            "source": "memory",
+        })
+    snapshot = current_catalog()
+    books = snapshot.get_books(ids) if snapshot is not None else lib_system.get_books(ids)
+    return jsonify({
+        "books": {str(book_id): bool(books[book_id]['available']) if book_id in books else None for book_id in ids},
+        "source": snapshot.version if snapshot is not None else "database",
+    })
+
+@app.route("/api/v1/my/loans")
+@login_required
+def api_my_loans():
+    """API لإعارات المستخدم الحالي المفتوحة"""
+    loans = lib_system.get_user_loans(session['user_id'])
+    return jsonify([
+        {
+            'loan_id': loan['loan_id'],
+            'book_id': loan['id'],
+            'title': loan['title'],
+            'author': loan['author'],
+            'year': loan['year'],
+            'borrow_date': loan['borrow_date'].isoformat() if loan['borrow_date'] else None,
+            'due_date': loan['due_date'].isoformat() if loan['due_date'] else None,
+            'overdue_days': loan['overdue_days'] or 0,
+            'fine_amount': '%.2f' % (loan['fine_amount'] or 0),
+        }
+        for loan in loans
+    ])
+
+@app.route("/api/v1/jobs")
+@admin_required
+def api_jobs():
+    """حالة المهام الدورية: القيادة، آخر تشغيل، المدد، والسجل"""
+    if scheduler is None:
+        return jsonify({"enabled": False, "jobs": []})
+    return jsonify({"enabled": True, "jobs": scheduler.stats()})
+
+@app.route("/api/v1/db")
+@admin_required
+def api_db():
+    """عدادات طبقة البيانات في هذه العملية: دمج القراءات المتزامنة والـ circuit breaker والنتائج القديمة"""
+    flight, breaker, stale = lib_system.single_flight, lib_system.circuit_breaker, lib_system.stale_results
+    return jsonify({
+        "backend": lib_system.backend_name,
+        "coalescing": flight.stats() if flight is not None else None,
+        "circuit": breaker.stats() if breaker is not None else None,
+        "stale": stale.stats() if stale is not None else None,
+    })
+
+def _hold_json(hold):
+    return {
+        'hold_id': hold['id'],
+        'book_id': hold['book_id'],
+        'title': hold['title'],
+        'author': hold['author'],
+        'status': hold['status'],
+        'position': hold['position'] if hold['status'] == 'waiting' else 0,
+        'placed_at': hold['placed_at'].isoformat() if hold['placed_at'] else None,
+        'expires_at': hold['expires_at'].isoformat() if hold['expires_at'] else None,
     }
-    return jsonify(stats)
+
+@app.route("/api/v1/holds", methods=["GET", "POST"])
+@login_required
+def api_holds():
+    """قائمة حجوزات المستخدم، أو إضافة حجز جديد"""
+    if request.method == "POST":
+        data = request.get_json(silent=True) or request.form
+        try:
+            book_id = int(data.get("book_id"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "book_id is required"}), 400
+        hold_id = lib_system.place_hold(book_id, session['user_id'])
+        if not hold_id:
+            return jsonify({"error": "book is available, not found, or already held or borrowed by you"}), 409
+        return jsonify({"hold_id": hold_id}), 201
+    return jsonify([_hold_json(hold) for hold in lib_system.get_user_holds(session['user_id'])])
+
+@app.route("/api/v1/holds/<int:hold_id>", methods=["DELETE"])
+@login_required
+def api_cancel_hold(hold_id):
+    """إلغاء حجز"""
+    if not lib_system.cancel_hold(hold_id, session['user_id']):
+        return jsonify({"error": "hold not found or no longer active"}), 404
+    return jsonify({"cancelled": hold_id})
+
+SUGGEST_MAX_LIMIT = 20
+
+@app.route("/api/v1/suggest")
+@login_required
+def api_suggest():
+    """إكمال تلقائي للعناوين والمؤلفين من فهرس البادئات في الذاكرة"""
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), SUGGEST_MAX_LIMIT))
+    index = suggest_index
+    if index is None:
+        return jsonify({"error": "suggest index is still loading"}), 503
+    if index.sync_due() and _suggest_syncing.acquire(blocking=False):
+        threading.Thread(target=sync_suggest_index, args=(index,), name='suggest-sync', daemon=True).start()
+    return jsonify({"query": query, "suggestions": index.suggest(query, limit)})
+
+@app.route("/api/v1/books")
+@login_required
+def api_books():
+    """تصفح الكتب بالفلاتر والترقيم بالمفتاح: next يُمرر كـ after للصفحة التالية"""
+    filters = _browse_filters()
+    limit = max(1, min(request.args.get('limit', BROWSE_PAGE_SIZE, type=int), 500))
+    page, next_after = lib_system.browse_books(after=request.args.get('after', type=int), limit=limit, **filters)
+    return jsonify({
+        "books": [
+            {'id': book['id'], 'title': book['title'], 'author': book['author'],
+             'year': book['year'], 'available': bool(book['available'])}
+            for book in page
+        ],
+        "next": next_after,
+    })
+
+@app.route("/api/v1/books/<int:book_id>/recommendations")
+@login_required
+def api_book_recommendations(book_id):
+    """"استُعير معه": الجيران المحسوبون مسبقاً من تكرار الاستعارة المشترك"""
+    if not lib_system.get_book(book_id):
+        return jsonify({"error": "book not found"}), 404
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify({
+        "book_id": book_id,
+        "borrowed_together": [
+            {'id': book['id'], 'title': book['title'], 'author': book['author'], 'year': book['year'],
+             'available': bool(book['available']), 'score': book['score'], 'together': book['together']}
+            for book in lib_system.get_book_neighbours(book_id, limit)
+        ],
+    })
+
+def _similar_json(items):
+    return [
+        {'id': book['id'], 'title': book['title'], 'author': book['author'], 'year': book['year'],
+         'available': bool(book['available']), 'score': score}
+        for book, score in items
+    ]
+
+@app.route("/api/v1/books/<int:book_id>/similar")
+@login_required
+def api_similar_book(book_id):
+    """كتب مشابهة في العنوان والمؤلف، تعمل أيضاً للكتب الجديدة بدون إعارات"""
+    if not lib_system.get_book(book_id):
+        return jsonify({"error": "book not found"}), 404
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify({"book_id": book_id, "similar": _similar_json(similar_books([book_id], limit)[book_id])})
+
+@app.route("/api/v1/similar")
+@login_required
+def api_similar_many():
+    """نفس /books/<id>/similar لعدة كتب في طلب واحد: ?ids=1,2,3"""
+    try:
+        book_ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()][:50]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma separated list of book ids"}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    results = similar_books(book_ids, limit)
+    return jsonify({"results": [{"book_id": book_id, "similar": _similar_json(results[book_id])} for book_id in book_ids]})
+
+@app.route("/api/v1/facets")
+@login_required
+def api_facets():
+    """عدد الكتب (والمتاح منها) لكل مؤلف وعقد، من العدادات المحسوبة مسبقاً"""
+    facets = lib_system.get_facets(limit=max(1, min(request.args.get('limit', 20, type=int), 200)))
+    return jsonify({
+        "authors": [{'author': row['value'], 'total': row['total'], 'available': row['available']}
+                    for row in facets['author']],
+        "decades": [{'decade': int(row['value']), 'total': row['total'], 'available': row['available']}
+                    for row in facets['decade']],
+        "availability": facets['availability'],
+    })
+
+ANALYTICS_DEFAULT_DAYS = 30
+
+@app.route("/api/v1/analytics")
+@librarian_required
+def api_analytics():
+    """اتجاهات الإعارة لنطاق أيام (from/to شاملة) من الملخصات اليومية فقط: ?from=&to=&interval=day|week|month"""
+    import analytics
+    try:
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today() - timedelta(days=1)
+        start = (date.fromisoformat(request.args['from']) if request.args.get('from')
+                 else end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1))
+    except ValueError:
+        return jsonify({"error": "from and to must be YYYY-MM-DD dates"}), 400
+    if start > end:
+        return jsonify({"error": "from must not be after to"}), 400
+    interval = request.args.get('interval', 'day')
+    if interval not in analytics.INTERVALS:
+        return jsonify({"error": f"interval must be one of {', '.join(analytics.INTERVALS)}"}), 400
+    top = max(1, min(request.args.get('top', 10, type=int), 100))
+    return jsonify(analytics.report(lib_system, start, end, interval, top))
+
+CHANGES_MAX_LIMIT = 1000
+# الثواني التي ينتظرها العميل قبل الطلب التالي إذا لم توجد تغييرات
+CHANGES_POLL_SECONDS = 5
+
+def _change_json(change):
+    if change['op'] == 'delete':
+        return {'cursor': change['id'], 'op': 'delete', 'id': change['book_id']}
+    return {
+        'cursor': change['id'],
+        'op': change['op'],
+        'id': change['book_id'],
+        'title': change['title'],
+        'author': change['author'],
+        'year': change['year'],
+        'available': bool(change['available']),
+    }
+
+@app.route("/api/v1/changes")
+@login_required
+def api_changes():
+    """تغييرات الكتالوج بعد المؤشر since للمزامنة التزايدية
+
+    الرد فوري دائماً: بعد آخر صفحة يُعاد retry_after (و Retry-After) بدل حجز worker بالانتظار.
+    بدون since أو بمؤشر أقدم من السجل تُعاد نسخة كاملة مع reset=true، صفحة بعد صفحة حسب id:
+    الأولى فيها cursor، والتالية تُطلب بـ after=next_after حتى يصبح None، ثم since=cursor.
+    """
+    since = request.args.get('since', type=int)
+    after = request.args.get('after', type=int)
+    limit = max(1, min(request.args.get('limit', 500, type=int), CHANGES_MAX_LIMIT))
+
+    result = lib_system.get_changes(since, limit) if since is not None and after is None else None
+
+    if result is None:
+        books, cursor = lib_system.get_catalog_snapshot(after or 0, limit)
+        page = {
+            "reset": True,
+            "books": [
+                {'id': book['id'], 'title': book['title'], 'author': book['author'],
+                 'year': book['year'], 'available': bool(book['available'])}
+                for book in books
+            ],
+            "next_after": books[-1]['id'] if len(books) == limit else None,
+        }
+        if after is None:
+            # مؤشر الصفحات التالية أحدث من بدايتها؛ المزامنة تبدأ من مؤشر الصفحة الأولى
+            page["cursor"] = cursor
+        return jsonify(page)
+
+    changes, cursor, more = result
+    response = jsonify({
+        "cursor": cursor,
+        "more": more,
+        "changes": [_change_json(change) for change in changes],
+        "retry_after": 0 if more else CHANGES_POLL_SECONDS,
+    })
+    if not more:
+        response.headers['Retry-After'] = str(CHANGES_POLL_SECONDS)
+    return response
 
 # معالجة الأخطاء
 @app.errorhandler(404)
@@ -378,6 +1170,7 @@ if __name__ == "__main__":
     logger.info(f"📦 Version: {APP_VERSION}")
     logger.info(f"🌐 Host: {host} | Port: {port}")
     logger.info(f"🔐 Credentials Source: {'KMS' if 'DB_PASSWORD' in CREDENTIALS and CREDENTIALS['DB_PASSWORD'] else 'ENV'}")
+    logger.info(f"🗄️  Database Backend: {lib_system.backend_name}")
     logger.info("======================================")
 
     print("======================================")
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+نقل الإعارات المغلقة القديمة من borrowed_books إلى borrowed_books_archive
+"""
+
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+import backends
+from library_base import LOAN_ARCHIVE_AGE_DAYS
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move closed loans older than --max-age-days into the archive table")
+    parser.add_argument('--database-url', help="database to archive (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--max-age-days', type=int, default=LOAN_ARCHIVE_AGE_DAYS,
+                        help="archive loans returned more than this many days ago")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="loans moved per transaction")
+    parser.add_argument('--pause', type=float, default=0.1, help="seconds to sleep between chunks")
+    parser.add_argument('--max-chunks', type=int, help="stop after this many chunks (default: until done)")
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    lib.init_db()
+    archived = lib.archive_closed_loans(args.max_age_days, args.chunk_size, args.pause, args.max_chunks)
+    print(f"✅ Archived {archived:,} loan(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
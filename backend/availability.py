@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+إتاحة الكتب في الذاكرة: bitmap بت واحد لكل رقم كتاب
+
+بتان لكل id: "موجود" و "متاح"، فمليون كتاب ~250 KB. الأعداد تُحدث مع كل تغيير فتُقرأ بدون حساب،
+وتُعد بجدول popcount للبايتات عند التحميل والمطابقة. التحميل قراءة تدفقية واحدة لـ (id، available)،
+والتحديث من نفس transactions الإعارة والإرجاع (add_availability_listener) بعد commit،
+ومن سجل التغييرات لما تكتبه العمليات الأخرى، والمطابقة الدورية تعيد البناء من القاعدة وتسجل الفرق.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+import backends
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# متابعة سجل التغييرات مرة كل هذه المدة على الأكثر عند القراءة
+AVAILABILITY_SYNC_SECONDS = float(os.getenv('AVAILABILITY_SYNC_SECONDS', 1))
+# عدد البتات المضبوطة في كل بايت
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+# بايتات تُفك في كل خطوة من iter_available
+ITER_CHUNK_BYTES = 8192
+
+
+def popcount(bits):
+    return int(POPCOUNT[bits].sum(dtype=np.int64))
+
+
+def _set_bits(bits, ids):
+    """ضبط بتات مجموعة أرقام دفعة واحدة"""
+    np.bitwise_or.at(bits, ids >> 3, (1 << (ids & 7)).astype(np.uint8))
+
+
+class AvailabilityBitmap:
+    """bitmap الإتاحة لعملية واحدة؛ الكتابة تحت قفل، والقراءة بدونه"""
+
+    def __init__(self, sync_seconds=AVAILABILITY_SYNC_SECONDS):
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()
+        self.known = np.zeros(0, dtype=np.uint8)
+        self.available = np.zeros(0, dtype=np.uint8)
+        self.total = 0
+        self.available_count = 0
+        # مؤشر سجل التغييرات الذي تعكسه البتات؛ None قبل التحميل
+        self.cursor = None
+        # {book_id: change_id} لتحديثات المستمع الأحدث من المؤشر: صفوف السجل الأقدم منها لكتبها تُتجاهل
+        self._ahead = {}
+        self.loaded_at = None
+        self._synced = 0.0
+        self._syncing = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.cursor is not None
+
+    @staticmethod
+    def _read(lib):
+        """(known، available، المؤشر) من قراءة تدفقية واحدة لجدول الكتب"""
+        # المؤشر قبل القراءة: ما يتغير أثناءها يُعاد تطبيقه من السجل
+        cursor = lib.get_change_cursor()
+        known = np.zeros(0, dtype=np.uint8)
+        available = np.zeros(0, dtype=np.uint8)
+        for rows in lib.iter_availability():
+            batch = np.array(rows, dtype=np.int64).reshape(-1, 2)
+            ids = batch[:, 0]
+            size = int(ids.max()) // 8 + 1
+            if size > len(known):
+                size = max(size, len(known) * 3 // 2)
+                known = np.concatenate([known, np.zeros(size - len(known), dtype=np.uint8)])
+                available = np.concatenate([available, np.zeros(size - len(available), dtype=np.uint8)])
+            _set_bits(known, ids)
+            _set_bits(available, ids[batch[:, 1] != 0])
+        return known, available, cursor
+
+    def load(self, lib):
+        """بناء البتات من القاعدة ثم متابعة السجل؛ يعيد عدد الكتب"""
+        started = time.time()
+        known, available, cursor = self._read(lib)
+        with self._lock:
+            self._swap(known, available, cursor)
+        self.sync(lib, force=True)
+        logger.info(f"✅ Availability bitmap loaded: {self.total:,} book(s), {self.available_count:,} available, "
+                    f"{self.known.nbytes + self.available.nbytes:,} bytes in {time.time() - started:.2f}s")
+        return self.total
+
+    def _swap(self, known, available, cursor):
+        self.known, self.available = known, available
+        self.total, self.available_count = popcount(known), popcount(available)
+        self.cursor = cursor
+        self.loaded_at = time.time()
+
+    def _grow(self, book_id):
+        size = book_id // 8 + 1
+        if size > len(self.known):
+            size = max(size, len(self.known) * 3 // 2)
+            self.known = np.concatenate([self.known, np.zeros(size - len(self.known), dtype=np.uint8)])
+            self.available = np.concatenate([self.available, np.zeros(size - len(self.available), dtype=np.uint8)])
+
+    def _set(self, book_id, available):
+        """تغيير بت واحد مع العدادات؛ available=None لكتاب محذوف (تحت القفل)"""
+        index, mask = book_id >> 3, 1 << (book_id & 7)
+        if available is None:
+            if index >= len(self.known) or not self.known[index] & mask:
+                return
+            self.known[index] &= ~mask & 0xFF
+            self.total -= 1
+            if self.available[index] & mask:
+                self.available[index] &= ~mask & 0xFF
+                self.available_count -= 1
+            return
+        self._grow(book_id)
+        if not self.known[index] & mask:
+            self.known[index] |= mask
+            self.total += 1
+        was_available = bool(self.available[index] & mask)
+        if available and not was_available:
+            self.available[index] |= mask
+            self.available_count += 1
+        elif not available and was_available:
+            self.available[index] &= ~mask & 0xFF
+            self.available_count -= 1
+
+    def update(self, changes):
+        """مستمع LibraryBackend: [(book_id، available أو None، change_id)] بعد commit في هذه العملية
+
+        التغيير الذي وصل من السجل (change_id <= المؤشر) طُبق هو أو ما بعده فلا يُعاد.
+        """
+        with self._lock:
+            for book_id, available, change_id in changes:
+                if self.cursor is not None and change_id <= self.cursor:
+                    continue
+                self._set(book_id, available)
+                self._ahead[book_id] = max(change_id, self._ahead.get(book_id, 0))
+
+    def sync(self, lib, force=False):
+        """تطبيق تغييرات السجل بعد المؤشر (ما كتبته العمليات الأخرى)؛ يعيد عدد التغييرات"""
+        now = time.monotonic()
+        if not self.ready or (not force and now - self._synced < self.sync_seconds):
+            return 0
+        if not self._syncing.acquire(blocking=False):
+            return 0
+        try:
+            self._synced = now
+            applied = 0
+            while True:
+                result = lib.get_changes(self.cursor, limit=1000)
+                if result is None:
+                    # المؤشر أقدم من السجل المحفوظ بعد compact_changes
+                    logger.warning("⚠️  Availability bitmap fell behind the change log; reloading")
+                    known, available, cursor = self._read(lib)
+                    with self._lock:
+                        self._swap(known, available, cursor)
+                    continue
+                rows, cursor, more = result
+                with self._lock:
+                    ahead = self._ahead
+                    for row in rows:
+                        # تحديث المستمع لنفس الكتاب أحدث من هذا الصف
+                        if row['id'] < ahead.get(row['book_id'], 0):
+                            continue
+                        self._set(row['book_id'], None if row['op'] == 'delete' else bool(row['available']))
+                    self.cursor = cursor
+                    if ahead:
+                        self._ahead = {book_id: change_id for book_id, change_id in ahead.items() if change_id > cursor}
+                applied += len(rows)
+                if not more:
+                    return applied
+        finally:
+            self._syncing.release()
+
+    def reconcile(self, lib):
+        """إعادة البناء من القاعدة واستبدال البتات؛ يعيد عدد البتات التي اختلفت"""
+        fresh = AvailabilityBitmap(self.sync_seconds)
+        fresh._swap(*self._read(lib))
+        # النسختان على نفس المؤشر تقريباً حتى لا تُحسب تغييرات أثناء القراءة كفرق
+        fresh.sync(lib, force=True)
+        self.sync(lib, force=True)
+        with self._lock:
+            size = max(len(fresh.known), len(self.known))
+            drift = sum(
+                popcount(np.pad(old, (0, size - len(old))) ^ np.pad(new, (0, size - len(new))))
+                for old, new in ((self.known, fresh.known), (self.available, fresh.available))
+            )
+            self._swap(fresh.known, fresh.available, fresh.cursor)
+        self.sync(lib, force=True)
+        if drift:
+            logger.warning(f"⚠️  Availability bitmap drift fixed: {drift} bit(s) differed from the database")
+        return drift
+
+    def is_available(self, book_id):
+        """True / False، أو None لكتاب غير موجود"""
+        index, mask = book_id >> 3, 1 << (book_id & 7)
+        if book_id < 0 or index >= len(self.known) or not self.known[index] & mask:
+            return None
+        return bool(self.available[index] & mask)
+
+    def availability(self, book_ids):
+        return {book_id: self.is_available(book_id) for book_id in book_ids}
+
+    def counts(self):
+        """نفس مفاتيح catalog_stats()"""
+        total, available = self.total, self.available_count
+        return {'total_books': total, 'available_books': available, 'borrowed_books': total - available}
+
+    def iter_available(self, after=0):
+        """أرقام الكتب المتاحة تصاعدياً بعد after، بفك البايتات على أجزاء"""
+        bits = self.available
+        start = max(0, (after + 1) >> 3)
+        for offset in range(start, len(bits), ITER_CHUNK_BYTES):
+            chunk = bits[offset:offset + ITER_CHUNK_BYTES]
+            if not chunk.any():
+                continue
+            for book_id in (np.flatnonzero(np.unpackbits(chunk, bitorder='little')) + offset * 8).tolist():
+                if book_id > after:
+                    yield book_id
+
+    def stats(self):
+        return {
+            **self.counts(),
+            'cursor': self.cursor,
+            'bytes': self.known.nbytes + self.available.nbytes,
+            'loaded_at': self.loaded_at,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the availability bitmap and compare it with the database")
+    parser.add_argument('--database-url', help="database to use (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--book', type=int, action='append', default=[], help="print the availability of this book id")
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    bitmap = AvailabilityBitmap()
+    bitmap.load(lib)
+    stats = bitmap.stats()
+    stats['books'] = bitmap.availability(args.book)
+    stats['database'] = {
+        'total_books': lib.get_total_books(),
+        'available_books': lib.get_available_books_count(),
+        'borrowed_books': lib.get_borrowed_books_count(),
+    }
+    print(json.dumps(stats, indent=2, default=str))
+    return 0 if stats['database'] == bitmap.counts() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
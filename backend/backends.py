@@ -0,0 +1,72 @@
+import importlib
+import os
+import logging
+from urllib.parse import urlparse, unquote
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# اسم المحرك -> الموديول الذي يحتوي LibraryManagementSystem الخاص به
+DRIVERS = {
+    'mysql': 'library_mysql',
+    'postgresql': 'library_postgres',
+    'sqlite': 'library_sqlite',
+}
+
+SCHEME_ALIASES = {
+    'mysql': 'mysql',
+    'mysql+pymysql': 'mysql',
+    'postgres': 'postgresql',
+    'postgresql': 'postgresql',
+    'postgresql+psycopg2': 'postgresql',
+    'sqlite': 'sqlite',
+}
+
+
+def parse_database_url(url):
+    """تحويل DATABASE_URL إلى (اسم المحرك، credentials)"""
+    parsed = urlparse(url)
+    backend = SCHEME_ALIASES.get(parsed.scheme.lower())
+    if backend is None:
+        raise ValueError(f"Unsupported database URL scheme: {parsed.scheme}")
+
+    if backend == 'sqlite':
+        # sqlite:///relative.db أو sqlite:////absolute/path.db أو sqlite:///:memory:
+        path = unquote(parsed.path[1:] if parsed.path.startswith('/') else parsed.path)
+        return backend, {'DB_PATH': path or ':memory:'}
+
+    credentials = {
+        'DB_HOST': parsed.hostname or 'localhost',
+        'DB_USER': unquote(parsed.username or ''),
+        'DB_PASSWORD': unquote(parsed.password or ''),
+        'DB_NAME': unquote(parsed.path.lstrip('/')) or 'library_db',
+    }
+    if parsed.port:
+        credentials['DB_PORT'] = str(parsed.port)
+    return backend, credentials
+
+
+def load_driver(backend):
+    """استيراد موديول المحرك عند الحاجة فقط حتى لا يلزم تثبيت كل الـ drivers"""
+    if backend not in DRIVERS:
+        raise ValueError(f"Unknown database backend: {backend} (expected one of {', '.join(DRIVERS)})")
+    return importlib.import_module(DRIVERS[backend])
+
+
+def create_library_system(credentials=None, database_url=None, backend=None):
+    """إنشاء نظام المكتبة بالمحرك المحدد في الإعدادات
+
+    الأولوية: المعامل backend أو DB_BACKEND، ثم DATABASE_URL، ثم MySQL مع credentials.
+    """
+    backend = backend or os.getenv('DB_BACKEND')
+    database_url = database_url or os.getenv('DATABASE_URL')
+
+    if database_url:
+        url_backend, url_credentials = parse_database_url(database_url)
+        if backend is None or backend == url_backend:
+            logger.info(f"Database backend '{url_backend}' selected from DATABASE_URL")
+            return load_driver(url_backend).LibraryManagementSystem(credentials=url_credentials)
+
+    backend = backend or 'mysql'
+    logger.info(f"Database backend '{backend}' selected from configuration")
+    return load_driver(backend).LibraryManagementSystem(credentials=credentials)
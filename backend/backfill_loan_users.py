@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+ربط سجلات الإعارة القديمة بالمستخدمين عبر user_id بدلاً من نص borrower
+"""
+
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+import backends
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill borrowed_books.user_id from the legacy 'Full Name (username)' borrower text")
+    parser.add_argument('--database-url', help="database to backfill (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="loans updated per transaction")
+    parser.add_argument('--pause', type=float, default=0.05, help="seconds to sleep between chunks")
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    # يضيف العمود والفهرس لقواعد البيانات القديمة
+    lib.init_db()
+    linked = lib.backfill_loan_users(args.chunk_size, args.pause)
+    print(f"✅ Linked {linked:,} loan(s) to users")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
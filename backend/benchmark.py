@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+قياس أداء دوال LibraryManagementSystem ومقارنتها بخط أساس محفوظ
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pymysql
+from dotenv import load_dotenv
+
+import backends
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+BENCH_PASSWORD = 'bench123'
+INSERT_BATCH = 1000
+
+
+class CountingCursor:
+    """cursor يحسب عدد الاستعلامات والصفوف المنقولة"""
+
+    def __init__(self, cursor, counters):
+        self._cursor = cursor
+        self._counters = counters
+
+    def execute(self, query, args=None):
+        self._counters['queries'] += 1
+        return self._cursor.execute(query, args)
+
+    def executemany(self, query, args):
+        self._counters['queries'] += 1
+        return self._cursor.executemany(query, args)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._counters['rows'] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._cursor.fetchmany(size) if size else self._cursor.fetchmany()
+        self._counters['rows'] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._counters['rows'] += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._counters['rows'] += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedMixin:
+    """يضاف إلى أي محرك ليسجل الاستعلامات والصفوف لكل عملية"""
+
+    counters = None
+
+    def reset_counters(self):
+        self.counters = {'queries': 0, 'rows': 0}
+
+    @contextmanager
+    def get_cursor(self, tuples=False):
+        with super().get_cursor(tuples=tuples) as cursor:
+            yield CountingCursor(cursor, self.counters)
+
+
+def instrumented_library(backend, credentials):
+    """إنشاء نسخة مُقاسة من محرك قاعدة البيانات"""
+    driver = backends.load_driver(backend).LibraryManagementSystem
+    cls = type(f"Instrumented{driver.__name__}", (InstrumentedMixin, driver), {})
+    lib = cls(credentials=credentials)
+    lib.reset_counters()
+    return lib
+
+
+def scratch_credentials(backend, db_name):
+    """إعدادات الاتصال بقاعدة البيانات المؤقتة للقياس"""
+    if backend == 'sqlite':
+        return {'DB_PATH': f"{db_name}.sqlite3"}
+    return {
+        'DB_HOST': os.getenv('BENCH_DB_HOST', os.getenv('DB_HOST', 'localhost')),
+        'DB_USER': os.getenv('BENCH_DB_USER', os.getenv('DB_USER', 'admin')),
+        'DB_PASSWORD': os.getenv('BENCH_DB_PASSWORD', os.getenv('DB_PASSWORD', '')),
+        'DB_PORT': os.getenv('BENCH_DB_PORT', os.getenv('DB_PORT', '3306' if backend == 'mysql' else '5432')),
+        'DB_NAME': db_name,
+    }
+
+
+# الجداول المحذوفة عند إعادة التهيئة، الجداول التابعة أولاً
+SCRATCH_TABLES = ('loan_rollups', 'loan_daily', 'book_neighbours', 'book_facets', 'job_state', 'catalog_changes', 'holds', 'borrowed_books_archive', 'borrowed_books', 'books', 'users')
+
+
+def reset_scratch_database(lib):
+    """حذف بيانات القاعدة المؤقتة وإعادة إنشاء الجداول"""
+    if lib.backend_name == 'sqlite':
+        with lib.get_cursor() as cursor:
+            for table in SCRATCH_TABLES:
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    elif lib.backend_name == 'mysql':
+        db_name = lib.db_config['database']
+        temp_config = lib.db_config.copy()
+        temp_config.pop('database', None)
+        connection = pymysql.connect(**temp_config)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP DATABASE IF EXISTS {db_name}")
+            connection.commit()
+        finally:
+            connection.close()
+    else:
+        with lib.get_cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {', '.join(SCRATCH_TABLES)} CASCADE")
+    lib.init_db()
+
+
+def seed_catalog(lib, size, seed=42):
+    """تعبئة قاعدة البيانات المؤقتة بعدد size من الكتب"""
+    rng = random.Random(seed)
+    authors = [f"Author {i}" for i in range(max(1, size // 20))]
+    user_count = max(10, size // 10)
+
+    with lib.get_cursor() as cursor:
+        for start in range(0, user_count, INSERT_BATCH):
+            rows = [
+                (f"bench_user_{i}", lib.hash_password(BENCH_PASSWORD), 'user', f"Bench User {i}", f"bench{i}@library.com")
+                for i in range(start, min(start + INSERT_BATCH, user_count))
+            ]
+            cursor.executemany(
+                lib.insert_ignore_sql('users', ('username', 'password_hash', 'role', 'full_name', 'email')),
+                rows
+            )
+
+        for start in range(0, size, INSERT_BATCH):
+            rows = [
+                (f"Book Title {i:07d}", rng.choice(authors), rng.randint(1800, 2024), rng.random() > 0.2)
+                for i in range(start, min(start + INSERT_BATCH, size))
+            ]
+            cursor.executemany("INSERT INTO books (title, author, year, available) VALUES (%s, %s, %s, %s)", rows)
+
+        # إضافة سجلات استعارة مفتوحة للكتب غير المتاحة
+        cursor.execute("SELECT id, username FROM users")
+        user_ids = {row['username']: row['id'] for row in cursor.fetchall()}
+        cursor.execute("SELECT id FROM books WHERE available = FALSE")
+        borrowed_ids = [row['id'] for row in cursor.fetchall()]
+        for start in range(0, len(borrowed_ids), INSERT_BATCH):
+            rows = [
+                (book_id, user_ids.get(f"bench_user_{book_id % user_count}"),
+                 f"Bench User {book_id % user_count} (bench_user_{book_id % user_count})")
+                for book_id in borrowed_ids[start:start + INSERT_BATCH]
+            ]
+            cursor.executemany("INSERT INTO borrowed_books (book_id, user_id, borrower) VALUES (%s, %s, %s)", rows)
+
+    # التحميل المباشر يتجاوز عدادات التصفح
+    lib.rebuild_facets()
+
+
+def percentile(samples, pct):
+    """حساب المئين من عينات مرتبة"""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+    return samples[index]
+
+
+def measure(lib, operation, min_iterations, time_budget):
+    """تشغيل عملية عدة مرات وقياس زمن الاستجابة والاستعلامات والصفوف"""
+    operation()  # إحماء
+
+    latencies = []
+    queries = rows = 0
+    deadline = time.perf_counter() + time_budget
+    while len(latencies) < min_iterations or time.perf_counter() < deadline:
+        lib.reset_counters()
+        started = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - started)
+        queries += lib.counters['queries']
+        rows += lib.counters['rows']
+        if len(latencies) >= min_iterations * 100:
+            break
+
+    latencies.sort()
+    iterations = len(latencies)
+    total = sum(latencies)
+    return {
+        'iterations': iterations,
+        'ops_per_sec': round(iterations / total, 2) if total else 0.0,
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'queries_per_op': round(queries / iterations, 2),
+        'rows_per_op': round(rows / iterations, 2),
+    }
+
+
+def build_operations(lib, size, seed=42):
+    """تجهيز العمليات المراد قياسها لكل دالة عامة"""
+    rng = random.Random(seed)
+    user_count = max(10, size // 10)
+    authors = [f"Author {i}" for i in range(max(1, size // 20))]
+
+    with lib.get_cursor() as cursor:
+        cursor.execute("SELECT id FROM books WHERE available = TRUE LIMIT 1000")
+        available_ids = [row['id'] for row in cursor.fetchall()]
+        cursor.execute("SELECT id FROM users ORDER BY id LIMIT 1000")
+        user_ids = [row['id'] for row in cursor.fetchall()]
+
+    def borrow_and_return():
+        book_id = rng.choice(available_ids)
+        lib.borrow_book(book_id, rng.choice(user_ids))
+        lib.return_book(book_id)
+
+    return {
+        'authenticate_user': lambda: lib.authenticate_user(f"bench_user_{rng.randrange(user_count)}", BENCH_PASSWORD),
+        'get_all_books': lib.get_all_books,
+        'get_available_books': lib.get_available_books,
+        'get_borrowed_books': lib.get_borrowed_books,
+        'get_user_loans': lambda: lib.get_user_loans(rng.choice(user_ids)),
+        'search_books': lambda: lib.search_books(f"Title {rng.randrange(size):07d}"[:-2]),
+        'borrow_return': borrow_and_return,
+        'get_total_books': lib.get_total_books,
+        'get_available_books_count': lib.get_available_books_count,
+        'get_borrowed_books_count': lib.get_borrowed_books_count,
+        'get_all_users': lib.get_all_users,
+        'browse_books': lambda: lib.browse_books(author=rng.choice(authors)),
+        'browse_books_decade': lambda: lib.browse_books(decade=rng.randrange(1800, 2030, 10), available=True),
+        'get_facets': lib.get_facets,
+    }
+
+
+# القوائم الكبيرة المقاسة في --row-footprint
+FOOTPRINT_METHODS = ('get_all_books', 'get_borrowed_books', 'get_all_users')
+
+
+def _retained_bytes(call):
+    """الذاكرة التي تبقى محجوزة لنتيجة الاستدعاء (بعد تحرير ما هو مؤقت)"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = call()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def _best_seconds(call, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def row_footprint(lib, operations, methods=FOOTPRINT_METHODS, repeat=5):
+    """ذاكرة وزمن القوائم الكبيرة: نفس الاستعلامات بصفوف dict (المسار السابق) مقابل السجلات التي تعيدها الدالة"""
+    from plan_check import capture_queries
+
+    report = {}
+    for method in methods:
+        operation = operations[method]
+        statements = capture_queries(lib, operation)
+
+        def dict_rows():
+            rows = None
+            with lib.get_cursor() as cursor:
+                for query, args in statements:
+                    cursor.execute(query, args)
+                    rows = cursor.fetchall()
+            return rows
+
+        rows, dict_bytes = _retained_bytes(dict_rows)
+        records, record_bytes = _retained_bytes(operation)
+        count = len(records)
+        if not count or len(rows) != count:
+            continue
+        dict_seconds = _best_seconds(dict_rows, repeat)
+        record_seconds = _best_seconds(operation, repeat)
+        per_100k = 100000 / count
+        report[method] = {
+            'rows': count,
+            'dict_bytes_per_row': round(dict_bytes / count),
+            'record_bytes_per_row': round(record_bytes / count),
+            'mib_saved_per_100k': round((dict_bytes - record_bytes) * per_100k / 2 ** 20, 1),
+            'dict_ms_per_100k': round(dict_seconds * per_100k * 1000, 1),
+            'record_ms_per_100k': round(record_seconds * per_100k * 1000, 1),
+        }
+    return report
+
+
+def print_footprint(report):
+    print(f"\n   {'row footprint':<28}{'rows':>10}{'dict B':>9}{'rec B':>8}{'MiB saved':>11}"
+          f"{'dict ms':>10}{'rec ms':>9}   (per row / per 100k rows)")
+    for method, m in report.items():
+        print(f"   {method:<28}{m['rows']:>10,}{m['dict_bytes_per_row']:>9}{m['record_bytes_per_row']:>8}"
+              f"{m['mib_saved_per_100k']:>11}{m['dict_ms_per_100k']:>10}{m['record_ms_per_100k']:>9}")
+
+
+def compare(results, baseline, threshold):
+    """مقارنة النتائج بخط الأساس وإرجاع قائمة التراجعات"""
+    regressions = []
+    for size, methods in results.items():
+        for method, current in methods.items():
+            previous = baseline.get(size, {}).get(method)
+            if not previous:
+                continue
+            if current['p50_ms'] > previous['p50_ms'] * (1 + threshold):
+                regressions.append(f"{method}@{size}: p50 {previous['p50_ms']}ms -> {current['p50_ms']}ms")
+            if current['ops_per_sec'] < previous['ops_per_sec'] * (1 - threshold):
+                regressions.append(f"{method}@{size}: ops/sec {previous['ops_per_sec']} -> {current['ops_per_sec']}")
+            # عدد الاستعلامات والصفوف حتمي، فأي زيادة تعني تغيراً في السلوك
+            if current['queries_per_op'] > previous['queries_per_op']:
+                regressions.append(f"{method}@{size}: queries/op {previous['queries_per_op']} -> {current['queries_per_op']}")
+            if current['rows_per_op'] > previous['rows_per_op'] * (1 + threshold):
+                regressions.append(f"{method}@{size}: rows/op {previous['rows_per_op']} -> {current['rows_per_op']}")
+    return regressions
+
+
+def print_report(size, methods):
+    print(f"\n📊 Catalog size: {size:,}")
+    print(f"   {'method':<28}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'q/op':>7}{'rows/op':>11}")
+    for method, m in methods.items():
+        print(f"   {method:<28}{m['ops_per_sec']:>10}{m['p50_ms']:>10}{m['p95_ms']:>10}{m['p99_ms']:>10}"
+              f"{m['queries_per_op']:>7}{m['rows_per_op']:>11}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark LibraryManagementSystem methods against a scratch database")
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help="comma separated catalog sizes (default: 1000,100000,1000000)")
+    parser.add_argument('--backend', choices=sorted(backends.DRIVERS), default=os.getenv('DB_BACKEND', 'mysql'),
+                        help="database engine to benchmark (sqlite runs fully in-process)")
+    parser.add_argument('--db-name', default=os.getenv('BENCH_DB_NAME', 'library_bench'),
+                        help="scratch database name, dropped and recreated for every size")
+    parser.add_argument('--min-iterations', type=int, default=5)
+    parser.add_argument('--time-budget', type=float, default=2.0, help="seconds spent on each method")
+    parser.add_argument('--only', help="comma separated subset of methods to run")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed regression ratio (default: 0.25)")
+    parser.add_argument('--update-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--output', help="write the raw results as JSON to this file")
+    parser.add_argument('--row-footprint', action='store_true',
+                        help="also compare memory and time per 100k rows of dict rows and record rows")
+    args = parser.parse_args(argv)
+
+    if args.db_name == os.getenv('DB_NAME', 'library_db'):
+        print(f"❌ Refusing to benchmark against the application database '{args.db_name}'")
+        return 2
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    only = set(args.only.split(',')) if args.only else None
+
+    lib = instrumented_library(args.backend, scratch_credentials(args.backend, args.db_name))
+    results = {}
+    for size in sizes:
+        print(f"\n🔧 Preparing scratch database '{args.db_name}' with {size:,} books...")
+        reset_scratch_database(lib)
+        seed_catalog(lib, size)
+
+        methods = {}
+        operations = build_operations(lib, size)
+        for name, operation in operations.items():
+            if only and name not in only:
+                continue
+            methods[name] = measure(lib, operation, args.min_iterations, args.time_budget)
+        results[f"{args.backend}:{size}"] = methods
+        print_report(size, methods)
+        if args.row_footprint:
+            print_footprint(row_footprint(lib, operations, [m for m in FOOTPRINT_METHODS if not only or m in only]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        # دمج حسب الحجم والدالة: --sizes و --only لا يحذفان ما لم يُقس في هذا التشغيل
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+        for size, methods in results.items():
+            baseline.setdefault(size, {}).update(methods)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\n✅ Baseline updated in {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nℹ️  No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"   - {regression}")
+        return 1
+
+    print("\n✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
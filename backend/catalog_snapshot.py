@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+لقطة الكتالوج المشتركة بين العمليات: ملف واحد للقراءة فقط يُفتح بـ mmap
+
+كل أعمدة الكتب في مخزن واحد متصل: ids و available و year، وإزاحات العنوان والمؤلف مع نصوصهما
+UTF-8، وفهرس مرتب حسب id للبحث. كل العمليات على نفس الـ pod تربط نفس الملف فتتشارك صفحاته
+في ذاكرة النظام بدل نسخة لكل عملية، والقراءة من المصفوفات مباشرة بدون نسخ.
+
+النشر بنسخ: ملف جديد لكل نسخة ثم استبدال CURRENT ذرياً، ومن فتح نسخة قديمة يكمل عليها.
+تغييرات الإتاحة وحدها (استعارة / إرجاع) تُطبق على نسخة من الملف السابق، وأي تغيير آخر يعيد البناء.
+"""
+
+import argparse
+import fcntl
+import json
+import logging
+import mmap
+import os
+import shutil
+import sys
+import time
+from array import array
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+
+import backends
+from library_base import Book
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT_DIR = os.getenv('CATALOG_SNAPSHOT_DIR', 'catalog_snapshot')
+# أكثر من هذا العدد من التغييرات منذ آخر نسخة: إعادة بناء بدل التطبيق على النسخة السابقة
+CATALOG_SNAPSHOT_PATCH_LIMIT = int(os.getenv('CATALOG_SNAPSHOT_PATCH_LIMIT', 5000))
+KEEP_VERSIONS = 2
+
+MAGIC = b'LIBSNAP1'
+FORMAT = 1
+# المقدمة: MAGIC ثم طول JSON (4 بايت) ثم JSON بالأقسام، ومساحتها ثابتة حتى يُعاد كتابتها في مكانها
+HEADER_SIZE = 4096
+ALIGN = 64
+NO_YEAR = np.iinfo(np.int32).min
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _header_bytes(header):
+    payload = json.dumps(header, sort_keys=True).encode()
+    if len(MAGIC) + 4 + len(payload) > HEADER_SIZE:
+        raise ValueError("snapshot header does not fit in HEADER_SIZE")
+    data = MAGIC + len(payload).to_bytes(4, 'little') + payload
+    return data + b'\0' * (HEADER_SIZE - len(data))
+
+
+def _read_header(buffer):
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError("not a catalog snapshot")
+    length = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 4], 'little')
+    header = json.loads(bytes(buffer[len(MAGIC) + 4:len(MAGIC) + 4 + length]))
+    if header['format'] != FORMAT:
+        raise ValueError(f"unsupported snapshot format {header['format']}")
+    return header
+
+
+class CatalogSnapshot:
+    """نسخة مربوطة بـ mmap للقراءة فقط؛ كل المصفوفات views على الملف نفسه"""
+
+    def __init__(self, path, version, mapping):
+        self.path = path
+        self.version = version
+        self._mapping = mapping
+        self._buffer = memoryview(mapping)
+        header = _read_header(self._buffer)
+        self.count = header['count']
+        self.cursor = header['cursor']
+        self.built_at = header['built_at']
+        self.sections = header['sections']
+        # أعمدة بترتيب العنوان
+        self.ids = self._array('ids')
+        self.available = self._array('available')
+        self.years = self._array('years')
+        self.title_offsets = self._array('title_offsets')
+        self.author_offsets = self._array('author_offsets')
+        self.titles = self._bytes('titles')
+        self.authors = self._bytes('authors')
+        # البحث حسب id: ids مرتبة وموضع كل منها في الأعمدة
+        self.sorted_ids = self._array('sorted_ids')
+        self.id_positions = self._array('id_positions')
+
+    def _array(self, name):
+        offset, dtype, length = self.sections[name]
+        return np.frombuffer(self._mapping, dtype=np.dtype(dtype), count=length, offset=offset)
+
+    def _bytes(self, name):
+        offset, _, length = self.sections[name]
+        return self._buffer[offset:offset + length]
+
+    # الفتح والتحديث
+
+    @classmethod
+    def current_version(cls, path=CATALOG_SNAPSHOT_DIR):
+        try:
+            with open(os.path.join(path, 'CURRENT')) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    @classmethod
+    def open(cls, path=CATALOG_SNAPSHOT_DIR, version=None):
+        """ربط نسخة (الحالية افتراضياً)، أو None إذا لم تُنشر أي نسخة بعد"""
+        version = version or cls.current_version(path)
+        if version is None:
+            return None
+        with open(os.path.join(path, f"{version}.snap"), 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(path, version, mapping)
+
+    def refresh(self):
+        """False إذا نُشرت نسخة أحدث ويجب فتحها"""
+        return self.current_version(self.path) == self.version
+
+    # القراءة
+
+    def position(self, book_id):
+        """موضع الكتاب في الأعمدة أو None"""
+        index = int(np.searchsorted(self.sorted_ids, book_id))
+        if index < self.count and self.sorted_ids[index] == book_id:
+            return int(self.id_positions[index])
+        return None
+
+    def is_available(self, book_id):
+        """True / False، أو None لكتاب غير موجود"""
+        position = self.position(book_id)
+        return None if position is None else bool(self.available[position])
+
+    def _book(self, position):
+        start, end = int(self.title_offsets[position]), int(self.title_offsets[position + 1])
+        title = str(self.titles[start:end], 'utf-8')
+        start, end = int(self.author_offsets[position]), int(self.author_offsets[position + 1])
+        author = str(self.authors[start:end], 'utf-8')
+        year = int(self.years[position])
+        return Book(int(self.ids[position]), title, author, None if year == NO_YEAR else year,
+                    bool(self.available[position]))
+
+    def get_book(self, book_id):
+        position = self.position(book_id)
+        return None if position is None else self._book(position)
+
+    def get_books(self, book_ids):
+        """{id: كتاب} مثل LibraryBackend.get_books"""
+        books = {}
+        for book_id in book_ids:
+            position = self.position(book_id)
+            if position is not None:
+                books[book_id] = self._book(position)
+        return books
+
+    def iter_books(self, available=None, batch_size=1024):
+        """الكتب بترتيب العنوان (كل الكتب، أو المتاحة / المستعارة فقط)، دفعة من الأعمدة في كل مرة"""
+        for start in range(0, self.count, batch_size):
+            stop = min(self.count, start + batch_size)
+            if available is None:
+                positions = range(stop - start)
+            else:
+                positions = np.flatnonzero(self.available[start:stop] == (1 if available else 0)).tolist()
+                if not positions:
+                    continue
+            ids = self.ids[start:stop].tolist()
+            years = self.years[start:stop].tolist()
+            flags = self.available[start:stop].tolist()
+            title_offsets = self.title_offsets[start:stop + 1].tolist()
+            author_offsets = self.author_offsets[start:stop + 1].tolist()
+            for i in positions:
+                yield Book(
+                    ids[i],
+                    str(self.titles[title_offsets[i]:title_offsets[i + 1]], 'utf-8'),
+                    str(self.authors[author_offsets[i]:author_offsets[i + 1]], 'utf-8'),
+                    None if years[i] == NO_YEAR else years[i],
+                    bool(flags[i]),
+                )
+
+    def counts(self):
+        available = int(np.count_nonzero(self.available))
+        return {'total_books': self.count, 'available_books': available, 'borrowed_books': self.count - available}
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'books': self.count,
+            'cursor': self.cursor,
+            'built_at': self.built_at,
+            'bytes': len(self._mapping),
+        }
+
+
+# البناء والنشر
+
+def _new_version(path):
+    version = f"v{int(time.time() * 1000)}"
+    while os.path.exists(os.path.join(path, f"{version}.snap")):
+        version = f"v{int(version[1:]) + 1}"
+    return version
+
+
+def _write(path, columns, cursor):
+    """كتابة كل الأقسام في ملف نسخة جديد، ويعيد (اسم النسخة، المسار المؤقت)"""
+    version = _new_version(path)
+    tmp = os.path.join(path, f"{version}.snap.tmp")
+    sections, offset = {}, HEADER_SIZE
+    for name, data in columns.items():
+        data = np.ascontiguousarray(data)
+        offset = _aligned(offset)
+        sections[name] = [offset, data.dtype.str, len(data)]
+        offset += data.nbytes
+    header = {'format': FORMAT, 'count': len(columns['ids']), 'cursor': cursor,
+              'built_at': datetime.now().isoformat(timespec='seconds'), 'sections': sections}
+    with open(tmp, 'wb') as f:
+        f.write(_header_bytes(header))
+        for name, data in columns.items():
+            f.seek(sections[name][0])
+            f.write(np.ascontiguousarray(data).data)
+        f.truncate(_aligned(offset))
+    return version, tmp
+
+
+def _publish(path, version, tmp):
+    """النسخة تصبح مرئية بإعادة تسمية الملف ثم استبدال CURRENT، وحذف النسخ الأقدم"""
+    os.replace(tmp, os.path.join(path, f"{version}.snap"))
+    current = os.path.join(path, 'CURRENT.tmp')
+    with open(current, 'w') as f:
+        f.write(version)
+    os.replace(current, os.path.join(path, 'CURRENT'))
+
+    # الملف المحذوف يبقى صالحاً لمن ربطه حتى يغلقه
+    versions = sorted(name for name in os.listdir(path) if name.startswith('v') and name.endswith('.snap'))
+    for old in versions[:-KEEP_VERSIONS]:
+        try:
+            os.remove(os.path.join(path, old))
+        except OSError:
+            pass
+
+
+def build(lib, path=CATALOG_SNAPSHOT_DIR):
+    """قراءة كل الكتب تدفقياً بترتيب العنوان إلى مصفوفات مضغوطة ونشر نسخة جديدة"""
+    started = time.time()
+    # المؤشر أولاً: التغييرات بعده قد تتكرر في اللقطة، وتطبيقها مرة أخرى لا يضر
+    cursor = lib.get_change_cursor()
+    ids, flags, years = array('q'), array('B'), array('i')
+    title_offsets, author_offsets = array('Q', [0]), array('Q', [0])
+    titles, authors = bytearray(), bytearray()
+    for book in lib.iter_all_books():
+        ids.append(book.id)
+        flags.append(1 if book.available else 0)
+        years.append(NO_YEAR if book.year is None else book.year)
+        titles += (book.title or '').encode('utf-8')
+        title_offsets.append(len(titles))
+        authors += (book.author or '').encode('utf-8')
+        author_offsets.append(len(authors))
+
+    ids = np.frombuffer(ids, dtype=np.int64)
+    order = np.argsort(ids, kind='stable')
+    offset_dtype = np.uint32 if max(len(titles), len(authors)) <= np.iinfo(np.uint32).max else np.uint64
+    columns = {
+        'ids': ids,
+        'available': np.frombuffer(flags, dtype=np.uint8),
+        'years': np.frombuffer(years, dtype=np.int32),
+        'title_offsets': np.frombuffer(title_offsets, dtype=np.uint64).astype(offset_dtype),
+        'author_offsets': np.frombuffer(author_offsets, dtype=np.uint64).astype(offset_dtype),
+        'sorted_ids': ids[order],
+        'id_positions': order.astype(np.int32),
+        'titles': np.frombuffer(titles, dtype=np.uint8),
+        'authors': np.frombuffer(authors, dtype=np.uint8),
+    }
+    version, tmp = _write(path, columns, cursor)
+    _publish(path, version, tmp)
+    logger.info(f"✅ Catalog snapshot {version} built: {len(ids):,} book(s), "
+                f"{os.path.getsize(os.path.join(path, f'{version}.snap')) / 2 ** 20:.1f} MiB "
+                f"in {time.time() - started:.1f}s")
+    return version
+
+
+def _patch(path, current, changes, cursor):
+    """نسخة من الملف الحالي بحالة إتاحة جديدة؛ None إذا غيرت التغييرات شيئاً غير الإتاحة"""
+    positions, flags = [], []
+    for change in changes:
+        position = current.position(change['book_id']) if change['op'] == 'upsert' else None
+        if position is None:
+            return None
+        book = current._book(position)
+        if (book.title, book.author, book.year) != (change['title'], change['author'], change['year']):
+            return None
+        positions.append(position)
+        flags.append(1 if change['available'] else 0)
+
+    version = _new_version(path)
+    tmp = os.path.join(path, f"{version}.snap.tmp")
+    shutil.copyfile(os.path.join(path, f"{current.version}.snap"), tmp)
+    with open(tmp, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mapping:
+        header = _read_header(mapping)
+        offset, dtype, length = header['sections']['available']
+        available = np.frombuffer(mapping, dtype=np.dtype(dtype), count=length, offset=offset)
+        # بترتيب السجل: آخر تغيير لنفس الكتاب هو حالته الحالية
+        for position, flag in zip(positions, flags):
+            available[position] = flag
+        del available
+        header['cursor'] = cursor
+        header['built_at'] = datetime.now().isoformat(timespec='seconds')
+        mapping[:HEADER_SIZE] = _header_bytes(header)
+        mapping.flush()
+    _publish(path, version, tmp)
+    return version
+
+
+def publish(lib, path=CATALOG_SNAPSHOT_DIR, rebuild=False):
+    """نشر نسخة تعكس آخر تغيير في الكتالوج إذا تأخرت الحالية؛ عملية واحدة فقط تنشر في نفس الوقت
+
+    يعيد {'version', 'mode': 'patch' / 'build'} أو None إذا لم يكن هناك ما يُنشر.
+    """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'LOCK'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # عملية أخرى على نفس الـ pod تنشر الآن
+            return None
+        current = None if rebuild else CatalogSnapshot.open(path)
+        if current is not None:
+            last = lib.get_change_cursor()
+            if current.cursor >= last:
+                return None
+            feed = lib.get_changes(current.cursor, limit=CATALOG_SNAPSHOT_PATCH_LIMIT)
+            # None: المؤشر أقدم من السجل المحفوظ أو من قاعدة أخرى
+            if feed is not None and feed[0] and not feed[2]:
+                changes, cursor, _ = feed
+                version = _patch(path, current, changes, cursor)
+                if version is not None:
+                    logger.info(f"✅ Catalog snapshot {version}: {len(changes):,} availability change(s) applied")
+                    return {'version': version, 'mode': 'patch'}
+        return {'version': build(lib, path), 'mode': 'build'}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or update the shared, memory-mapped catalog snapshot")
+    parser.add_argument('--database-url', help="database to read (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--path', default=CATALOG_SNAPSHOT_DIR, help="snapshot directory")
+    parser.add_argument('--rebuild', action='store_true', help="build from scratch instead of applying changes")
+    parser.add_argument('--book', type=int, help="print this book from the published snapshot")
+    args = parser.parse_args(argv)
+
+    if args.book is None:
+        lib = backends.create_library_system(database_url=args.database_url)
+        publish(lib, args.path, rebuild=args.rebuild)
+    snapshot = CatalogSnapshot.open(args.path)
+    if snapshot is None:
+        print("❌ No catalog snapshot has been published")
+        return 1
+    print(json.dumps({**snapshot.stats(), **snapshot.counts()}, indent=2))
+    if args.book is not None:
+        book = snapshot.get_book(args.book)
+        print(book._asdict() if book else f"Book {args.book} is not in the snapshot")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+حماية الطلبات من انقطاع قاعدة البيانات: circuit breaker وآخر نتيجة صالحة
+
+CircuitBreaker يتتبع نسبة الفشل في نافذة زمنية؛ إذا تجاوزت الحد يُفتح ويُرفض كل اتصال فوراً
+بدل انتظار مهلة الاتصال، ثم بعد مدة يسمح باتصال تجريبي واحد في كل مرة (half-open)
+ويُغلق بعد عدد من النجاحات المتتالية أو يُفتح من جديد عند أول فشل.
+StaleResults يحتفظ بآخر نتيجة صالحة لقراءات الكتالوج ويعيدها أثناء الانقطاع لمدة محدودة،
+مع عمر أقدم نتيجة قديمة استُخدمت في الطلب الحالي حتى تُعلَم الصفحة بذلك.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', 0.5))
+# أقل عدد من الاستخدامات في النافذة قبل الحكم على النسبة
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 10))
+BREAKER_WINDOW_SECONDS = float(os.getenv('BREAKER_WINDOW_SECONDS', 30))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', 15))
+# نجاحات تجريبية متتالية قبل الإغلاق
+BREAKER_PROBES = int(os.getenv('BREAKER_PROBES', 3))
+
+# أقصى عمر لنتيجة تُعرض أثناء الانقطاع
+STALE_MAX_SECONDS = float(os.getenv('STALE_MAX_SECONDS', 600))
+STALE_MAX_ENTRIES = int(os.getenv('STALE_MAX_ENTRIES', 128))
+# النتائج الأطول لا تُحفظ: الذاكرة في الـ pod محدودة
+STALE_MAX_ROWS = int(os.getenv('STALE_MAX_ROWS', 10000))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """رفض فوري لأن الـ breaker مفتوح؛ LibraryBackend يرفعه كصنف فرعي من Error المحرك"""
+
+
+_open_errors = {}
+
+
+def circuit_open_error(base):
+    """صنف CircuitOpenError و Error المحرك معاً، حتى تعالجه except self.Error الحالية"""
+    cls = _open_errors.get(base)
+    if cls is None:
+        cls = _open_errors[base] = type('CircuitOpenError', (CircuitOpenError, base), {})
+    return cls
+
+
+class CircuitBreaker:
+    """حالة الاتصال بقاعدة البيانات في هذه العملية"""
+
+    def __init__(self, failure_rate=BREAKER_FAILURE_RATE, min_calls=BREAKER_MIN_CALLS,
+                 window=BREAKER_WINDOW_SECONDS, open_seconds=BREAKER_OPEN_SECONDS, probes=BREAKER_PROBES):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        # (الوقت، نجح) لكل استخدام في النافذة
+        self._outcomes = deque()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._probe_successes = 0
+        self._counters = Counter()
+
+    def acquire(self):
+        """'call' أو 'probe' إذا سُمح بالاتصال، و None للرفض الفوري"""
+        with self._lock:
+            if self.state == CLOSED:
+                return 'call'
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self._counters['rejected'] += 1
+                    return None
+                self.state = HALF_OPEN
+                self._probe_successes = 0
+                logger.info("🔌 Database circuit half-open, probing")
+            if self._probing:
+                self._counters['rejected'] += 1
+                return None
+            self._probing = True
+            return 'probe'
+
+    def release(self, ticket, ok):
+        """نتيجة استخدام سُمح به؛ ok=False لخطأ انقطاع فقط (لا لخطأ في الاستعلام نفسه)"""
+        with self._lock:
+            now = time.monotonic()
+            if ticket == 'probe':
+                self._probing = False
+                if not ok:
+                    self._open(now)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.probes:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    self._failures = 0
+                    logger.info("✅ Database circuit closed")
+                return
+            if self.state != CLOSED:
+                # بدأ قبل الفتح
+                return
+            self._outcomes.append((now, ok))
+            self._failures += not ok
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._failures -= not self._outcomes.popleft()[1]
+            calls = len(self._outcomes)
+            if not ok and calls >= self.min_calls and self._failures / calls >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._counters['trips'] += 1
+        logger.error(f"🔌 Database circuit open: failing fast for {self.open_seconds:.0f}s")
+
+    def retry_in(self):
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'failure_rate': round(self._failures / calls, 3) if calls else 0.0,
+                'retry_in': round(self.retry_in(), 1),
+                'trips': self._counters['trips'],
+                'rejected': self._counters['rejected'],
+            }
+
+
+class BreakerTicket:
+    """استخدام واحد سمح به الـ breaker؛ النتيجة تُسجل مرة واحدة، وقد تُسجل قبل نهاية الاستخدام
+
+    القراءة التدفقية تسجل النجاح بعد تنفيذ الاستعلام حتى لا يبقى الاتصال التجريبي محجوزاً
+    طوال إرسال الاستجابة؛ انقطاع بعد ذلك يُحسب كاستخدام عادي.
+    """
+
+    __slots__ = ('breaker', 'kind')
+
+    def __init__(self, breaker, kind):
+        self.breaker = breaker
+        self.kind = kind
+
+    def release(self, ok):
+        if self.kind is None:
+            if not ok:
+                self.breaker.release('call', False)
+            return
+        kind, self.kind = self.kind, None
+        self.breaker.release(kind, ok)
+
+
+class StaleResults:
+    """آخر نتيجة صالحة لكل قراءة (LRU محدود)، تُعاد عند فشل القاعدة إذا لم تتجاوز max_age"""
+
+    def __init__(self, max_age=STALE_MAX_SECONDS, max_entries=STALE_MAX_ENTRIES, max_rows=STALE_MAX_ROWS):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._request = threading.local()
+        self._counters = Counter()
+
+    def remember(self, key, result):
+        if hasattr(result, '__len__') and len(result) > self.max_rows:
+            return
+        with self._lock:
+            self._results[key] = (time.time(), result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def recall(self, key, default):
+        """آخر نتيجة صالحة ضمن max_age، أو default؛ ويُسجل عمرها للطلب الحالي"""
+        with self._lock:
+            saved = self._results.get(key)
+            fresh = saved is not None and time.time() - saved[0] <= self.max_age
+            self._counters['served' if fresh else 'misses'] += 1
+        if not fresh:
+            return default
+        oldest = getattr(self._request, 'since', None)
+        self._request.since = saved[0] if oldest is None else min(oldest, saved[0])
+        return saved[1]
+
+    def begin(self):
+        """بداية طلب جديد في هذا الخيط"""
+        self._request.since = None
+
+    def served_since(self):
+        """وقت أقدم نتيجة قديمة عُرضت في الطلب الحالي، أو None"""
+        return getattr(self._request, 'since', None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._results), 'served': self._counters['served'], 'misses': self._counters['misses']}
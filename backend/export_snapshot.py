@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+تصدير لقطة عمودية من books و users و الإعارات لتحليلها بعيداً عن قاعدة الإنتاج
+
+كل جدول يُكتب كمجموعات صفوف بحجم ثابت، كل مجموعة ملف .npz مضغوط فيه مصفوفة NumPy لكل عمود،
+و manifest.json يصف الأعمدة والملفات. النصوص المتكررة (author، role، borrower) تُرمز بقاموس
+مشترك يُضاف إليه فقط، فتبقى الرموز في الملفات القديمة صالحة بين اللقطات.
+
+الإعارات المغلقة مقسمة حسب شهر الإعارة، واللقطة التزايدية تعيد كتابة الأشهر التي أُرجعت فيها
+إعارات منذ اللقطة السابقة فقط. الإعارات المفتوحة (open_loans) والكتب والمستخدمون تُكتب كاملة كل مرة.
+حذف كتاب يحذف إعاراته من الجدول الساخن ولا يظهر في الأشهر القديمة إلا بعد --full.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+from dotenv import load_dotenv
+
+import backends
+from library_base import month_start, next_month
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'library_snapshot')
+ROW_GROUP_SIZE = int(os.getenv('EXPORT_ROW_GROUP_SIZE', 50000))
+FORMAT_VERSION = 1
+
+LOAN_COLUMNS = [('id', 'int'), ('book_id', 'int'), ('user_id', 'int'), ('borrower', 'dict'),
+                ('borrow_date', 'date'), ('return_date', 'date'), ('due_date', 'date'),
+                ('overdue_days', 'int'), ('fine_amount', 'decimal')]
+
+# الأعمدة المصدرة وأنواعها؛ password_hash و email لا تخرج من القاعدة
+DATASETS = {
+    'books': [('id', 'int'), ('title', 'text'), ('author', 'dict'), ('year', 'int'), ('decade', 'int'),
+              ('available', 'bool'), ('added_date', 'timestamp')],
+    'users': [('id', 'int'), ('username', 'text'), ('role', 'dict'), ('full_name', 'text'),
+              ('created_date', 'timestamp')],
+    'loans': LOAN_COLUMNS,
+    'open_loans': LOAN_COLUMNS,
+}
+
+# القسم الخاص بالسجلات القديمة بدون borrow_date
+UNKNOWN_MONTH = 'unknown'
+
+
+class Dictionary:
+    """قيم نصية -> رموز int32 ثابتة، -1 لـ NULL"""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def encode(self, values):
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            if value is None:
+                codes[i] = -1
+                continue
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            codes[i] = code
+        return codes
+
+
+def encode_column(name, kind, values, dictionaries):
+    """عمود واحد من مجموعة صفوف -> مصفوفات باسم العمود (و name.valid للأعمدة الرقمية التي فيها NULL)"""
+    if kind == 'dict':
+        return {name: dictionaries.setdefault(name, Dictionary()).encode(values)}
+    if kind == 'text':
+        # نفس تمثيل suggest.Segment: بايتات UTF-8 متتالية ومواضع البداية
+        encoded = [value.encode('utf-8') if value is not None else b'' for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        arrays = {f'{name}.data': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                  f'{name}.offsets': offsets}
+    elif kind == 'date':
+        return {name: np.array(values, dtype='datetime64[D]')}
+    elif kind == 'timestamp':
+        return {name: np.array(values, dtype='datetime64[s]')}
+    elif kind == 'bool':
+        return {name: np.array([bool(value) for value in values], dtype=bool)}
+    elif kind == 'decimal':
+        # المبالغ بالسنتات كأعداد صحيحة، كما في fines.py
+        arrays = {name: np.fromiter((0 if value is None else int(round(value * 100)) for value in values),
+                                    dtype=np.int64, count=len(values))}
+    else:
+        arrays = {name: np.fromiter((0 if value is None else value for value in values),
+                                    dtype=np.int64, count=len(values))}
+    valid = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+    if not valid.all():
+        arrays[f'{name}.valid'] = valid
+    return arrays
+
+
+def decode_column(name, kind, arrays, dictionaries):
+    """عكس encode_column: النصوص كمصفوفة object فيها None، والأرقام التي فيها NULL كمصفوفة masked"""
+    if kind == 'dict':
+        values = np.array(dictionaries[name].values + [None], dtype=object)
+        return values[arrays[name]]
+    if kind == 'text':
+        data, offsets = arrays[f'{name}.data'].tobytes(), arrays[f'{name}.offsets']
+        column = np.array([data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)],
+                          dtype=object)
+    elif kind == 'decimal':
+        column = arrays[name] / 100
+    else:
+        column = arrays[name]
+    if f'{name}.valid' in arrays:
+        valid = arrays[f'{name}.valid']
+        if kind == 'text':
+            column[~valid] = None
+        else:
+            column = np.ma.masked_array(column, mask=~valid)
+    return column
+
+
+class SnapshotWriter:
+    """كتابة أقسام اللقطة كمجموعات صفوف من cursor تدفقي"""
+
+    def __init__(self, lib, path, run_tag, row_group_size, dictionaries):
+        self.lib = lib
+        self.path = path
+        self.run_tag = run_tag
+        self.row_group_size = row_group_size
+        self.dictionaries = dictionaries
+        self.rows = 0
+
+    def write(self, dataset, partition, queries):
+        """تنفيذ الاستعلامات بالترتيب وكتابة نتائجها كقسم واحد؛ يعيد وصف القسم للـ manifest"""
+        columns = DATASETS[dataset]
+        directory = os.path.join(dataset, partition)
+        os.makedirs(os.path.join(self.path, directory), exist_ok=True)
+        files = []
+        for query, params in queries:
+            with self.lib.get_stream_cursor() as cursor:
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(self.row_group_size)
+                    if not rows:
+                        break
+                    arrays = {}
+                    for name, kind in columns:
+                        arrays.update(encode_column(name, kind, [row[name] for row in rows], self.dictionaries))
+                    relative = os.path.join(directory, f"part-{self.run_tag}-{len(files):05d}.npz")
+                    _write_npz(os.path.join(self.path, relative), arrays)
+                    files.append({'path': relative, 'rows': len(rows)})
+        rows = sum(item['rows'] for item in files)
+        self.rows += rows
+        return {'rows': rows, 'files': files}
+
+
+def _write_npz(path, arrays):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+
+
+def _write_json(path, value):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(value, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def load_manifest(path):
+    manifest_path = os.path.join(path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_dictionaries(path, manifest):
+    dictionaries = {}
+    for name, relative in (manifest or {}).get('dictionaries', {}).items():
+        with open(os.path.join(path, relative), encoding='utf-8') as f:
+            dictionaries[name] = Dictionary(json.load(f))
+    return dictionaries
+
+
+def _select(dataset):
+    return ', '.join(name for name, _ in DATASETS[dataset])
+
+
+def loan_month_queries(month):
+    """الإعارات المغلقة لشهر إعارة واحد: الأرشيف (الأقدم) ثم الجدول الساخن"""
+    columns = _select('loans')
+    if month == UNKNOWN_MONTH:
+        # الأرشيف يحول borrow_date الناقص إلى return_date، فالجدول الساخن وحده
+        return [(f"SELECT {columns} FROM borrowed_books WHERE borrow_date IS NULL AND return_date IS NOT NULL", ())]
+    start = date.fromisoformat(f"{month}-01")
+    end = next_month(start)
+    return [
+        (f"SELECT {columns} FROM borrowed_books_archive WHERE borrow_date >= %s AND borrow_date < %s", (start, end)),
+        (f"SELECT {columns} FROM borrowed_books WHERE borrow_date >= %s AND borrow_date < %s "
+         f"AND return_date IS NOT NULL", (start, end)),
+    ]
+
+
+def returned_months(lib, since):
+    """أشهر الإعارة للإعارات التي أُرجعت في since أو بعده (الأقسام التي تغيرت)"""
+    months = set()
+    with lib.get_cursor() as cursor:
+        for table in ('borrowed_books', 'borrowed_books_archive'):
+            cursor.execute(f"SELECT DISTINCT borrow_date FROM {table} WHERE return_date >= %s", (since,))
+            for row in cursor.fetchall():
+                day = row['borrow_date']
+                months.add(day.strftime('%Y-%m') if day else UNKNOWN_MONTH)
+    return months
+
+
+def all_months(lib, through):
+    first = lib.get_first_loan_date()
+    months = {UNKNOWN_MONTH}
+    month = month_start(first) if first else None
+    while month is not None and month <= through:
+        months.add(month.strftime('%Y-%m'))
+        month = next_month(month)
+    return months
+
+
+def export(lib, path=EXPORT_DIR, full=False, row_group_size=ROW_GROUP_SIZE):
+    """كتابة لقطة جديدة أو تحديث اللقطة الموجودة في path؛ يعيد الـ manifest"""
+    started = time.time()
+    today = date.today()
+    os.makedirs(path, exist_ok=True)
+    previous = None if full else load_manifest(path)
+    if previous and previous.get('format') != FORMAT_VERSION:
+        logger.warning(f"⚠️  {path} has snapshot format {previous.get('format')}; writing a full snapshot")
+        previous = None
+    dictionaries = load_dictionaries(path, previous)
+    writer = SnapshotWriter(lib, path, datetime.now().strftime('%Y%m%d%H%M%S%f'), row_group_size, dictionaries)
+
+    datasets = {}
+    for dataset, table, where in (('books', 'books', ''), ('users', 'users', ''),
+                                  ('open_loans', 'borrowed_books', ' WHERE return_date IS NULL')):
+        partition = writer.write(dataset, 'all', [(f"SELECT {_select(dataset)} FROM {table}{where}", ())])
+        datasets[dataset] = {'columns': DATASETS[dataset], 'partitions': {'all': partition}}
+
+    if previous:
+        # نفس يوم اللقطة السابقة مشمول: إعارات أُرجعت بعد تشغيلها في ذلك اليوم
+        since = date.fromisoformat(previous['exported_through'])
+        months = returned_months(lib, since)
+        partitions = dict(previous['datasets']['loans']['partitions'])
+    else:
+        months = all_months(lib, today)
+        partitions = {}
+    for month in sorted(months):
+        partitions[month] = writer.write('loans', os.path.join('borrow_month', month), loan_month_queries(month))
+    datasets['loans'] = {'columns': DATASETS['loans'], 'partition_by': 'borrow_month',
+                         'partitions': dict(sorted(partitions.items()))}
+
+    dictionary_files = {}
+    os.makedirs(os.path.join(path, 'dictionaries'), exist_ok=True)
+    for name, dictionary in dictionaries.items():
+        relative = os.path.join('dictionaries', f"{name}.json")
+        _write_json(os.path.join(path, relative), dictionary.values)
+        dictionary_files[name] = relative
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'exported_through': today.isoformat(),
+        'row_group_size': row_group_size,
+        'dictionaries': dictionary_files,
+        'datasets': datasets,
+    }
+    _write_json(os.path.join(path, 'manifest.json'), manifest)
+    removed = remove_unreferenced(path, manifest)
+
+    logger.info(f"✅ Snapshot {'updated' if previous else 'written'} in {path}: {writer.rows:,} row(s), "
+                f"{len(months):,} loan month(s) rewritten, {removed:,} old file(s) removed "
+                f"in {time.time() - started:.1f}s")
+    return manifest
+
+
+def remove_unreferenced(path, manifest):
+    """حذف ملفات المجموعات التي لم يعد الـ manifest الجديد يشير إليها (بعد استبداله)"""
+    referenced = {
+        os.path.normpath(item['path'])
+        for dataset in manifest['datasets'].values()
+        for partition in dataset['partitions'].values()
+        for item in partition['files']
+    }
+    removed = 0
+    for dataset in DATASETS:
+        for root, _, files in os.walk(os.path.join(path, dataset)):
+            for name in files:
+                relative = os.path.normpath(os.path.relpath(os.path.join(root, name), path))
+                if name.endswith(('.npz', '.npz.tmp')) and relative not in referenced:
+                    os.remove(os.path.join(path, relative))
+                    removed += 1
+    return removed
+
+
+def read_dataset(path, dataset, columns=None, partitions=None):
+    """قراءة جدول من اللقطة إلى مصفوفات NumPy لكل عمود (للمحللين والتحقق)"""
+    manifest = load_manifest(path)
+    dictionaries = load_dictionaries(path, manifest)
+    spec = [(name, kind) for name, kind in manifest['datasets'][dataset]['columns']
+            if columns is None or name in columns]
+    parts = {name: [] for name, _ in spec}
+    for key, partition in manifest['datasets'][dataset]['partitions'].items():
+        if partitions is not None and key not in partitions:
+            continue
+        for item in partition['files']:
+            with np.load(os.path.join(path, item['path'])) as arrays:
+                for name, kind in spec:
+                    parts[name].append(decode_column(name, kind, arrays, dictionaries))
+    result = {}
+    for name, kind in spec:
+        chunks = parts[name]
+        if not chunks:
+            result[name] = np.empty(0, dtype=object if kind in ('text', 'dict') else np.int64)
+        elif any(isinstance(chunk, np.ma.MaskedArray) for chunk in chunks):
+            result[name] = np.ma.concatenate(chunks)
+        else:
+            result[name] = np.concatenate(chunks)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export books, users and loans as a columnar NumPy snapshot")
+    parser.add_argument('--database-url', help="database to export (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--output', default=EXPORT_DIR, help="snapshot directory (updated in place)")
+    parser.add_argument('--full', action='store_true', help="rewrite every loan month instead of changed ones")
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE, help="rows per file")
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    export(lib, args.output, args.full, args.row_group_size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
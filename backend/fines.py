@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+حساب التأخير والغرامات لكل الإعارات المفتوحة دفعة واحدة (مهمة ليلية)
+"""
+
+import argparse
+import logging
+import sys
+import time
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+from dotenv import load_dotenv
+
+import backends
+from library_base import DEFAULT_LOAN_PERIOD, FINE_CAP, FINE_GRACE_DAYS, FINE_PER_DAY, LOAN_PERIODS
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# الحساب بالسنتات كأعداد صحيحة حتى تطابق النتيجة loan_fine() في library_base
+FINE_PER_DAY_CENTS = int(FINE_PER_DAY * 100)
+FINE_CAP_CENTS = int(FINE_CAP * 100)
+
+ROLE_CODES = {role: code for code, role in enumerate(sorted(LOAN_PERIODS), 1)}
+# الرمز 0 لمستخدم محذوف أو دور غير معروف
+PERIODS_BY_CODE = np.array(
+    [DEFAULT_LOAN_PERIOD] + [LOAN_PERIODS[role] for role in sorted(LOAN_PERIODS)], dtype=np.int64
+)
+
+
+def to_arrays(rows):
+    """تحويل دفعة صفوف إلى أعمدة NumPy"""
+    count = len(rows)
+    ids = np.fromiter((row['id'] for row in rows), dtype=np.int64, count=count)
+    borrow = np.array([row['borrow_date'] for row in rows], dtype='datetime64[D]')
+    due = np.array([row['due_date'] for row in rows], dtype='datetime64[D]')
+    roles = np.fromiter((ROLE_CODES.get(row['role'], 0) for row in rows), dtype=np.int64, count=count)
+    # القيم السابقة: تُكتب الصفوف التي تغيرت فقط
+    old_days = np.fromiter((-1 if row['overdue_days'] is None else row['overdue_days'] for row in rows),
+                           dtype=np.int64, count=count)
+    old_cents = np.fromiter((-1 if row['fine_amount'] is None else int(round(float(row['fine_amount']) * 100))
+                             for row in rows), dtype=np.int64, count=count)
+    return ids, borrow, due, roles, old_days, old_cents
+
+
+def compute_chunk(borrow, due, roles, today):
+    """due_date الناقص من مدة الدور، ثم أيام التأخير والغرامة بالسنتات"""
+    missing_due = np.isnat(due)
+    if missing_due.any():
+        # السجلات السابقة لـ due_date: تاريخ الإعارة + مدة دور المستعير
+        borrow_filled = np.where(np.isnat(borrow), today, borrow)
+        due = np.where(missing_due, borrow_filled + PERIODS_BY_CODE[roles].astype('timedelta64[D]'), due)
+    days = np.maximum((today - due).astype(np.int64), 0)
+    cents = np.minimum(np.maximum(days - FINE_GRACE_DAYS, 0) * FINE_PER_DAY_CENTS, FINE_CAP_CENTS)
+    return due, days, cents, missing_due
+
+
+def run(lib, chunk_size=20000, today=None, should_stop=None):
+    """المرور على الإعارات المفتوحة بالترتيب حسب id وتحديث المتغير منها فقط"""
+    today = np.datetime64(today or date.today(), 'D')
+    last_id = 0
+    scanned = updated = overdue = 0
+    cents_total = 0
+    started = time.time()
+
+    while True:
+        with lib.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT bb.id, bb.borrow_date, bb.due_date, bb.overdue_days, bb.fine_amount, u.role
+                FROM borrowed_books bb
+                LEFT JOIN users u ON u.id = bb.user_id
+                WHERE bb.return_date IS NULL AND bb.id > %s
+                ORDER BY bb.id
+                LIMIT %s
+            """, (last_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            ids, borrow, due, roles, old_days, old_cents = to_arrays(rows)
+            due, days, cents, missing_due = compute_chunk(borrow, due, roles, today)
+            changed = missing_due | (days != old_days) | (cents != old_cents)
+
+            if changed.any():
+                positions = np.flatnonzero(changed)
+                due_dates = due[positions].astype(object)
+                updates = [
+                    (int(ids[i]), due_dates[n], int(days[i]), Decimal(int(cents[i])).scaleb(-2))
+                    for n, i in enumerate(positions)
+                ]
+                lib.bulk_update(cursor, 'borrowed_books', ('due_date', 'overdue_days', 'fine_amount'), updates)
+                updated += len(updates)
+
+        scanned += len(rows)
+        overdue += int(np.count_nonzero(days))
+        cents_total += int(cents.sum())
+        last_id = int(ids[-1])
+        if should_stop and should_stop():
+            logger.warning(f"⚠️  Fines run stopped early after {scanned:,} loan(s)")
+            break
+
+    elapsed = time.time() - started
+    logger.info(f"✅ Fines: {scanned:,} open loan(s), {overdue:,} overdue, {updated:,} updated, "
+                f"{Decimal(cents_total).scaleb(-2)} outstanding in {elapsed:.1f}s")
+    return {'scanned': scanned, 'overdue': overdue, 'updated': updated,
+            'outstanding': str(Decimal(cents_total).scaleb(-2))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute due dates, days overdue and fines for every open loan")
+    parser.add_argument('--database-url', help="database to update (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--chunk-size', type=int, default=20000, help="open loans per read/update batch")
+    parser.add_argument('--date', type=date.fromisoformat, help="compute as of this day (default: today)")
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    lib.init_db()
+    run(lib, args.chunk_size, args.date)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+توليد بيانات اصطناعية قابلة للتكرار لاختبار النظام على أحجام كبيرة
+"""
+
+import argparse
+import bisect
+import itertools
+import logging
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from multiprocessing import Pool
+
+import pymysql
+from dotenv import load_dotenv
+
+import library_mysql as library
+from library_base import book_decade
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FIRST_NAMES = [
+    'Ahmed', 'Mohamed', 'Sara', 'Omar', 'Fatma', 'Youssef', 'Mariam', 'Ali', 'Nour', 'Hassan',
+    'Laila', 'Khaled', 'Salma', 'Mostafa', 'Hana', 'Karim', 'Aya', 'Tarek', 'Mona', 'Ibrahim',
+    'James', 'Mary', 'John', 'Linda', 'David', 'Emma', 'Lucas', 'Olivia', 'Noah', 'Sofia',
+]
+LAST_NAMES = [
+    'Fawzi', 'Hassan', 'Mahmoud', 'Ibrahim', 'Saleh', 'Nasser', 'Farouk', 'Kamal', 'Adel', 'Samir',
+    'Smith', 'Johnson', 'Brown', 'Garcia', 'Miller', 'Davis', 'Wilson', 'Moore', 'Taylor', 'Clark',
+    'Lewis', 'Walker', 'Young', 'King', 'Wright', 'Hill', 'Scott', 'Green', 'Baker', 'Adams',
+]
+TITLE_WORDS = [
+    'the', 'of', 'and', 'a', 'in', 'night', 'river', 'house', 'war', 'love', 'city', 'garden',
+    'shadow', 'light', 'secret', 'history', 'world', 'time', 'stars', 'sea', 'king', 'queen',
+    'journey', 'silent', 'last', 'first', 'lost', 'hidden', 'golden', 'dark', 'winter', 'summer',
+    'desert', 'empire', 'memory', 'storm', 'fire', 'glass', 'iron', 'paper', 'dream', 'road',
+    'bridge', 'mountain', 'island', 'letters', 'children', 'stranger', 'promise', 'kingdom',
+    'introduction', 'principles', 'systems', 'design', 'data', 'theory', 'practice', 'guide',
+]
+ROLES = [('user', 0.97), ('librarian', 0.025), ('admin', 0.005)]
+DEFAULT_PASSWORD = 'changeme123'
+
+
+def zipf_cum_weights(n, s):
+    """أوزان تراكمية لتوزيع Zipf على n عنصر"""
+    total = 0.0
+    cum = []
+    for rank in range(1, n + 1):
+        total += 1.0 / (rank ** s)
+        cum.append(total)
+    return cum
+
+
+def zipf_sample(rng, cum_weights):
+    """سحب رتبة (تبدأ من صفر) من توزيع Zipf"""
+    return bisect.bisect_left(cum_weights, rng.random() * cum_weights[-1])
+
+
+def coprime_step(n):
+    """معامل تبديل أولي نسبياً مع n يوزع الكتب الشائعة على كامل الكتالوج"""
+    step = 2654435761
+    while n > 1 and _gcd(step, n) != 1:
+        step += 2
+    return step
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def user_identity(index):
+    """اسم المستخدم والاسم الكامل مشتقان حتمياً من رقمه"""
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    last = LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    return f"student{index:07d}", f"{first} {last}"
+
+
+def multi_row_insert(cursor, table, columns, rows):
+    """إدراج عدة صفوف في عبارة INSERT واحدة"""
+    if not rows:
+        return
+    row_placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ', '.join([row_placeholder] * len(rows))
+    cursor.execute(query, list(itertools.chain.from_iterable(rows)))
+
+
+class Generator:
+    """إعدادات التوليد المشتركة بين العمليات المتوازية"""
+
+    def __init__(self, args, offsets, password_hash):
+        self.seed = args.seed
+        self.books = args.books
+        self.users = args.users
+        self.loans = args.loans
+        self.open_share = args.open_share
+        self.history_days = args.history_days
+        self.batch_size = args.batch_size
+        self.authors = args.authors
+        self.book_offset = offsets['books']
+        self.user_offset = offsets['users']
+        self.today = date.today()
+        self.password_hash = password_hash
+        self._weights = {}
+
+    def _cum_weights(self, name, n, s):
+        # تُحسب مرة واحدة في كل عملية
+        if name not in self._weights:
+            self._weights[name] = zipf_cum_weights(n, s)
+        return self._weights[name]
+
+    def _rng(self, table, chunk):
+        # بذرة لكل جزء حتى تكون النتيجة مستقلة عن عدد العمليات
+        return random.Random(f"{self.seed}:{table}:{chunk}")
+
+    def book_rows(self, chunk, start, count):
+        rng = self._rng('books', chunk)
+        author_weights = self._cum_weights('authors', self.authors, 1.1)
+        word_weights = self._cum_weights('words', len(TITLE_WORDS), 1.0)
+        rows = []
+        for i in range(start, start + count):
+            author_rank = zipf_sample(rng, author_weights)
+            first = FIRST_NAMES[author_rank % len(FIRST_NAMES)]
+            last = LAST_NAMES[(author_rank // len(FIRST_NAMES)) % len(LAST_NAMES)]
+            author = f"{first} {last}" if author_rank < len(FIRST_NAMES) * len(LAST_NAMES) else f"{first} {last} {author_rank}"
+            words = [TITLE_WORDS[zipf_sample(rng, word_weights)] for _ in range(rng.randint(1, 5))]
+            title = ' '.join(words).capitalize()
+            # أغلب الكتب حديثة نسبياً
+            year = max(1450, min(self.today.year, int(rng.gauss(1985, 30))))
+            rows.append((self.book_offset + i + 1, title[:255], author[:100], year, book_decade(year), True))
+        return rows
+
+    def user_rows(self, chunk, start, count):
+        rng = self._rng('users', chunk)
+        rows = []
+        for i in range(start, start + count):
+            username, full_name = user_identity(self.user_offset + i)
+            role = 'user'
+            roll = rng.random()
+            for name, share in ROLES:
+                if roll < share:
+                    role = name
+                    break
+                roll -= share
+            email = f"{username}@students.library.com"
+            rows.append((self.user_offset + i + 1, username, self.password_hash, role, full_name, email))
+        return rows
+
+    def loan_rows(self, chunk, start, count):
+        """سجلات استعارة مغلقة: كتب شائعة بتوزيع قوة وتواريخ واقعية"""
+        rng = self._rng('loans', chunk)
+        book_weights = self._cum_weights('books', min(self.books, 100000), 0.9)
+        step = coprime_step(self.books)
+        rows = []
+        for _ in range(start, start + count):
+            rank = zipf_sample(rng, book_weights)
+            # ذيل طويل: جزء من الاستعارات يذهب لكتب غير شائعة عشوائياً
+            if rng.random() < 0.2:
+                rank = rng.randrange(self.books)
+            book_id = self.book_offset + (rank * step) % self.books + 1
+            user_index = self.user_offset + rng.randrange(self.users)
+            username, full_name = user_identity(user_index)
+            borrow_day = self._borrow_day(rng)
+            duration = max(1, min(120, int(rng.lognormvariate(2.6, 0.5))))
+            return_day = borrow_day + timedelta(days=duration)
+            if return_day >= self.today:
+                return_day = self.today - timedelta(days=1)
+            if return_day < borrow_day:
+                borrow_day = return_day
+            rows.append((book_id, user_index + 1, f"{full_name} ({username})", borrow_day, return_day))
+        return rows
+
+    def _borrow_day(self, rng):
+        # نشاط أعلى في أيام الأسبوع وخلال الفصول الدراسية
+        while True:
+            day = self.today - timedelta(days=rng.randrange(1, self.history_days))
+            weight = 1.0 if day.weekday() < 5 else 0.4
+            if day.month in (7, 8):
+                weight *= 0.5
+            if rng.random() < weight:
+                return day
+
+    def open_loan_rows(self):
+        """إعارات مفتوحة لكتب مختلفة (كتاب واحد لا يُعار مرتين في نفس الوقت)"""
+        rng = self._rng('open_loans', 0)
+        target = min(self.books, int(self.loans * self.open_share))
+        book_weights = self._cum_weights('books', min(self.books, 100000), 0.9)
+        step = coprime_step(self.books)
+        chosen = set()
+        attempts = 0
+        while len(chosen) < target and attempts < target * 20:
+            attempts += 1
+            rank = zipf_sample(rng, book_weights) if rng.random() < 0.7 else rng.randrange(self.books)
+            chosen.add(self.book_offset + (rank * step) % self.books + 1)
+        rows = []
+        for book_id in sorted(chosen):
+            user_index = self.user_offset + rng.randrange(self.users)
+            username, full_name = user_identity(user_index)
+            borrow_day = self.today - timedelta(days=rng.randrange(0, 45))
+            rows.append((book_id, user_index + 1, f"{full_name} ({username})", borrow_day, None))
+        return rows
+
+
+TABLE_COLUMNS = {
+    'books': ('id', 'title', 'author', 'year', 'decade', 'available'),
+    'users': ('id', 'username', 'password_hash', 'role', 'full_name', 'email'),
+    'borrowed_books': ('book_id', 'user_id', 'borrower', 'borrow_date', 'return_date'),
+}
+
+_worker = {}
+
+
+def _init_worker(credentials, generator):
+    """تهيئة اتصال خاص بكل عملية كتابة"""
+    lib = library.LibraryManagementSystem(credentials=credentials)
+    connection = pymysql.connect(**lib.db_config)
+    with connection.cursor() as cursor:
+        cursor.execute("SET unique_checks = 0")
+        cursor.execute("SET foreign_key_checks = 0")
+    _worker['connection'] = connection
+    _worker['generator'] = generator
+
+
+def _write_chunk(task):
+    """توليد جزء وكتابته على دفعات، مع commit واحد لكل دفعة"""
+    table, chunk, start, count = task
+    generator = _worker['generator']
+    connection = _worker['connection']
+    rows = getattr(generator, {
+        'books': 'book_rows',
+        'users': 'user_rows',
+        'borrowed_books': 'loan_rows',
+    }[table])(chunk, start, count)
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), generator.batch_size):
+            multi_row_insert(cursor, table, TABLE_COLUMNS[table], rows[offset:offset + generator.batch_size])
+            connection.commit()
+    return table, len(rows)
+
+
+def chunk_tasks(table, total, chunk_size):
+    return [(table, n, start, min(chunk_size, total - start))
+            for n, start in enumerate(range(0, total, chunk_size))]
+
+
+def secondary_indexes(cursor, database, table):
+    """قائمة الفهارس الثانوية غير الفريدة لجدول"""
+    cursor.execute("""
+        SELECT index_name, GROUP_CONCAT(column_name ORDER BY seq_in_index) AS columns
+        FROM information_schema.statistics
+        WHERE table_schema = %s AND table_name = %s AND index_name <> 'PRIMARY' AND non_unique = 1
+        GROUP BY index_name
+    """, (database, table))
+    return cursor.fetchall()
+
+
+def drop_secondary_indexes(lib, tables):
+    """حذف الفهارس الثانوية قبل التحميل وإرجاع تعريفاتها لإعادة إنشائها"""
+    dropped = []
+    with lib.get_cursor() as cursor:
+        for table in tables:
+            for index in secondary_indexes(cursor, lib.db_config['database'], table):
+                try:
+                    cursor.execute(f"ALTER TABLE {table} DROP INDEX {index['index_name']}")
+                    dropped.append((table, index['index_name'], index['columns']))
+                except pymysql.Error as e:
+                    # فهارس المفاتيح الأجنبية لا يمكن حذفها، تبقى كما هي
+                    logger.info(f"Keeping index {table}.{index['index_name']}: {e.args[-1]}")
+    return dropped
+
+
+def restore_secondary_indexes(lib, dropped):
+    """إعادة إنشاء الفهارس بعد التحميل، عبارة ALTER واحدة لكل جدول"""
+    by_table = {}
+    for table, name, columns in dropped:
+        by_table.setdefault(table, []).append(f"ADD INDEX {name} ({columns})")
+    with lib.get_cursor() as cursor:
+        for table, clauses in by_table.items():
+            started = time.time()
+            cursor.execute(f"ALTER TABLE {table} {', '.join(clauses)}")
+            logger.info(f"✅ Rebuilt {len(clauses)} index(es) on {table} in {time.time() - started:.1f}s")
+
+
+def current_offsets(lib):
+    with lib.get_cursor() as cursor:
+        offsets = {}
+        for table in ('books', 'users'):
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) AS max_id FROM {table}")
+            offsets[table] = cursor.fetchone()['max_id']
+    return offsets
+
+
+def load_credentials(args):
+    return {
+        'DB_HOST': os.getenv('DB_HOST', 'localhost'),
+        'DB_USER': os.getenv('DB_USER', 'admin'),
+        'DB_PASSWORD': os.getenv('DB_PASSWORD', ''),
+        'DB_NAME': args.database or os.getenv('DB_NAME', 'library_db'),
+        'DB_PORT': os.getenv('DB_PORT', '3306'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Populate the library database with synthetic, reproducible data")
+    parser.add_argument('--database', help="target database name (default: DB_NAME)")
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--loans', type=int, default=10000000, help="closed loan history rows")
+    parser.add_argument('--open-share', type=float, default=0.02,
+                        help="open loans as a share of --loans (capped at the number of books)")
+    parser.add_argument('--authors', type=int, default=50000, help="distinct authors (Zipf distributed)")
+    parser.add_argument('--history-days', type=int, default=5 * 365)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--batch-size', type=int, default=2000, help="rows per multi-row INSERT")
+    parser.add_argument('--chunk-size', type=int, default=50000, help="rows generated per worker task")
+    parser.add_argument('--keep-indexes', action='store_true', help="do not drop secondary indexes during load")
+    args = parser.parse_args(argv)
+
+    if args.users < 1 or args.books < 1:
+        parser.error("--books and --users must be positive")
+
+    credentials = load_credentials(args)
+    lib = library.LibraryManagementSystem(credentials=credentials)
+    if not lib.init_db():
+        logger.error("❌ Could not initialize the target database")
+        return 1
+
+    offsets = current_offsets(lib)
+    generator = Generator(args, offsets, lib.hash_password(DEFAULT_PASSWORD))
+    tables = ['users', 'books', 'borrowed_books']
+    dropped = [] if args.keep_indexes else drop_secondary_indexes(lib, tables)
+
+    started = time.time()
+    try:
+        with Pool(args.workers, initializer=_init_worker, initargs=(credentials, generator)) as pool:
+            # الكتب والمستخدمون أولاً لأن الاستعارات تشير إليهم
+            for table, total in (('users', args.users), ('books', args.books), ('borrowed_books', args.loans)):
+                table_started = time.time()
+                written = 0
+                for _, count in pool.imap_unordered(_write_chunk, chunk_tasks(table, total, args.chunk_size)):
+                    written += count
+                elapsed = time.time() - table_started
+                logger.info(f"✅ {table}: {written:,} rows in {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f} rows/s)")
+
+        with lib.get_cursor() as cursor:
+            open_rows = generator.open_loan_rows()
+            for offset in range(0, len(open_rows), args.batch_size):
+                multi_row_insert(cursor, 'borrowed_books', TABLE_COLUMNS['borrowed_books'],
+                                 open_rows[offset:offset + args.batch_size])
+            cursor.execute("""
+                UPDATE books b JOIN borrowed_books bb ON b.id = bb.book_id
+                SET b.available = FALSE
+                WHERE bb.return_date IS NULL
+            """)
+            logger.info(f"✅ borrowed_books: {len(open_rows):,} open loans")
+    finally:
+        if dropped:
+            restore_secondary_indexes(lib, dropped)
+
+    # التحميل المباشر يتجاوز عدادات التصفح
+    lib.rebuild_facets()
+
+    logger.info(f"🎉 Done in {time.time() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
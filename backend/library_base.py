@@ -0,0 +1,1947 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import partial, wraps
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from circuit import BreakerTicket, circuit_open_error
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEMO_USERS = [
+    ('admin', 'admin123', 'admin', 'System Administrator', 'admin@library.com'),
+    ('librarian', 'lib123', 'librarian', 'Library Manager', 'librarian@library.com'),
+    ('user', 'user123', 'user', 'Regular User', 'user@library.com')
+]
+
+DEMO_BOOKS = [
+    ('The Great Gatsby', 'F. Scott Fitzgerald', 1925),
+    ('To Kill a Mockingbird', 'Harper Lee', 1960),
+    ('1984', 'George Orwell', 1949),
+    ('Pride and Prejudice', 'Jane Austen', 1813),
+    ('The Catcher in the Rye', 'J.D. Salinger', 1951)
+]
+
+# الفهارس الثانوية المشتركة بين كل المحركات: الاسم -> (الجدول، الأعمدة)
+# كل فهرس مصمم لاستعلام محدد في هذا الملف
+INDEXES = {
+    # get_available_books و get_available_books_count و browse_books(available=...): نطاق على available ثم ترتيب
+    # (title, id) بدون فرز، وتغطي الأعمدة المعروضة
+    'idx_books_available_cover': ('books', ('available', 'title', 'id', 'author', 'year')),
+    # get_all_books و search_books: قراءة مرتبة حسب العنوان من الفهرس وحده
+    'idx_books_title_cover': ('books', ('title', 'author', 'year', 'available')),
+    # browse_books: تصفح مرتب حسب العنوان داخل مؤلف أو عقد واحد، والترقيم بالمفتاح (title, id)
+    'idx_books_author_title': ('books', ('author', 'title', 'id')),
+    'idx_books_decade_title': ('books', ('decade', 'title', 'id')),
+    # return_book: الإعارة المفتوحة لكتاب واحد بدل كل تاريخ إعاراته، ويخدم المفتاح الأجنبي أيضاً
+    'idx_loans_book_open': ('borrowed_books', ('book_id', 'return_date')),
+    # get_borrowed_books: الإعارات المفتوحة مرتبة حسب borrow_date، وتغطي borrower
+    'idx_loans_open_date': ('borrowed_books', ('return_date', 'borrow_date', 'book_id', 'borrower')),
+    # get_user_loans: إعارات مستخدم واحد المفتوحة مرتبة حسب borrow_date في مسح نطاق واحد
+    'idx_loans_user_open': ('borrowed_books', ('user_id', 'return_date', 'borrow_date')),
+    # get_all_users و browse_users: الأحدث أولاً والترقيم بالمفتاح (created_date, id)، وداخل دور واحد
+    'idx_users_created_id': ('users', ('created_date', 'id')),
+    'idx_users_role_created': ('users', ('role', 'created_date', 'id')),
+    # browse_users(prefix=...): نطاق بادئة مرتب بنفس العمود، وداخل دور واحد (username له فهرس UNIQUE)
+    'idx_users_full_name': ('users', ('full_name', 'id')),
+    'idx_users_email': ('users', ('email', 'id')),
+    'idx_users_role_username': ('users', ('role', 'username', 'id')),
+    'idx_users_role_full_name': ('users', ('role', 'full_name', 'id')),
+    'idx_users_role_email': ('users', ('role', 'email', 'id')),
+    # archive_closed_loans: الإعارات المغلقة الأقدم من عمر محدد، مرتبة حسب id
+    'idx_loans_closed': ('borrowed_books', ('return_date', 'id')),
+    # get_loan_history لكتاب واحد في الأرشيف
+    'idx_archive_book': ('borrowed_books_archive', ('book_id', 'borrow_date')),
+    'idx_archive_user': ('borrowed_books_archive', ('user_id', 'borrow_date')),
+    # get_overdue_loans: "متأخرة الآن" نطاق على due_date داخل الإعارات المفتوحة، مرتبة بدون فرز
+    'idx_loans_open_due': ('borrowed_books', ('return_date', 'due_date')),
+    # طابور الحجز لكل كتاب بترتيب الوصول (FIFO حسب id)
+    'idx_holds_queue': ('holds', ('book_id', 'status', 'id')),
+    'idx_holds_user': ('holds', ('user_id', 'status', 'id')),
+    # expire_holds: الحجوزات الجاهزة التي انتهت مهلتها
+    'idx_holds_expiry': ('holds', ('status', 'expires_at')),
+    # get_facets: القيم الأكثر كتباً لكل بُعد
+    'idx_facets_total': ('book_facets', ('facet', 'total')),
+    # compact_changes: هل يوجد تغيير أحدث لنفس الكتاب، والحذف حسب العمر
+    'idx_changes_book': ('catalog_changes', ('book_id', 'id')),
+    'idx_changes_time': ('catalog_changes', ('changed_at',)),
+    # get_loan_activity: الإعارات والإرجاعات لنطاق أيام، والأرشيف يُقرأ فقط عند بناء الأيام القديمة
+    'idx_loans_borrowed': ('borrowed_books', ('borrow_date', 'user_id', 'book_id')),
+    'idx_archive_borrowed': ('borrowed_books_archive', ('borrow_date', 'user_id', 'book_id')),
+    'idx_archive_returned': ('borrowed_books_archive', ('return_date', 'borrow_date')),
+}
+
+# أعمدة أُضيفت بعد الإصدار الأول: تُضاف لقواعد البيانات الموجودة عند التهيئة
+ADDED_COLUMNS = [
+    ('borrowed_books', 'user_id', 'INTEGER REFERENCES users(id) ON DELETE SET NULL'),
+    ('borrowed_books_archive', 'user_id', 'INTEGER'),
+    ('borrowed_books', 'due_date', 'DATE'),
+    ('borrowed_books', 'overdue_days', 'INTEGER'),
+    ('borrowed_books', 'fine_amount', 'DECIMAL(10, 2)'),
+    ('borrowed_books_archive', 'due_date', 'DATE'),
+    ('borrowed_books_archive', 'overdue_days', 'INTEGER'),
+    ('borrowed_books_archive', 'fine_amount', 'DECIMAL(10, 2)'),
+    ('books', 'decade', 'INTEGER'),
+]
+
+# أعمدة الإعارة المشتركة بين الجدول الساخن والأرشيف
+LOAN_COLUMNS = ['id', 'book_id', 'user_id', 'borrower', 'borrow_date', 'return_date',
+                'due_date', 'overdue_days', 'fine_amount']
+
+
+
+class _Record:
+    """يضاف إلى namedtuple: row['title'] و row.get() تعمل كما في صفوف dict السابقة"""
+
+    __slots__ = ()
+    _positions = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._positions[key]
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        position = self._positions.get(key)
+        return default if position is None else tuple.__getitem__(self, position)
+
+    def keys(self):
+        return self._fields
+
+    @classmethod
+    def from_rows(cls, rows):
+        """سجلات من صفوف tuple_cursor: tuple.__new__ في C بدون استدعاء Python لكل صف"""
+        return list(map(partial(tuple.__new__, cls), rows))
+
+
+def record_type(name, fields):
+    """نوع صف مضغوط: tuple بأسماء أعمدة مشتركة بدل dict لكل صف (بدون مفاتيح مكررة ولا __dict__)
+
+    القوالب تقرأ book.title كما هي، والكود القديم يقرأ book['title']؛ الصفوف للقراءة فقط.
+    """
+    base = namedtuple(name, fields)
+    return type(name, (_Record, base), {
+        '__slots__': (),
+        '_positions': {field: position for position, field in enumerate(base._fields)},
+    })
+
+
+# صفوف القوائم الكبيرة، بترتيب أعمدة SELECT في الاستعلامات التي تعيدها
+Book = record_type('Book', 'id title author year available')
+Loan = record_type('Loan', 'loan_id id title author year borrower user_id borrow_date due_date overdue_days fine_amount')
+User = record_type('User', 'id username role full_name email created_date')
+
+# قوائم الاستعارة والإرجاع، مشتركة بين القراءة الكاملة والتدفقية
+AVAILABLE_BOOKS_QUERY = "SELECT id, title, author, year, available FROM books WHERE available = TRUE ORDER BY title"
+BORROWED_BOOKS_QUERY = """
+    SELECT bb.id, b.id, b.title, b.author, b.year, bb.borrower, bb.user_id, bb.borrow_date,
+           bb.due_date, bb.overdue_days, bb.fine_amount, u.username, u.full_name
+    FROM books b
+    JOIN borrowed_books bb ON b.id = bb.book_id
+    LEFT JOIN users u ON u.id = bb.user_id
+    WHERE b.available = FALSE AND bb.return_date IS NULL
+    ORDER BY bb.borrow_date DESC
+"""
+
+# أعمدة البحث بالبادئة في دليل المستخدمين
+USER_SEARCH_FIELDS = ('username', 'full_name', 'email')
+
+# الإعارات المغلقة الأقدم من هذا العمر تنتقل إلى borrowed_books_archive
+LOAN_ARCHIVE_AGE_DAYS = int(os.getenv('LOAN_ARCHIVE_AGE_DAYS', 365))
+LOAN_ARCHIVE_FIRST_YEAR = int(os.getenv('LOAN_ARCHIVE_FIRST_YEAR', 2015))
+
+
+# مدة بقاء الكتاب محجوزاً لصاحب الحجز بعد إرجاعه
+HOLD_WINDOW_HOURS = int(os.getenv('HOLD_WINDOW_HOURS', 48))
+ACTIVE_HOLD_STATUSES = ('waiting', 'ready')
+
+# سجل تغييرات الكتالوج: الإدخالات الأقدم من هذا تُضغط (آخر حالة لكل كتاب فقط) ثم تُحذف
+CHANGE_COMPACT_AFTER_MINUTES = int(os.getenv('CHANGE_COMPACT_AFTER_MINUTES', 60))
+CHANGE_RETENTION_DAYS = int(os.getenv('CHANGE_RETENTION_DAYS', 30))
+# صف job_state الذي يُقفل في بداية كل transaction تغير الكتالوج (_lock_change_log)
+CHANGE_LOG_LOCK = 'catalog_changes_lock'
+
+
+def parse_loan_periods(value):
+    """"admin:28,librarian:28,user:14" -> {'admin': 28, ...}"""
+    periods = {}
+    for item in value.split(','):
+        if ':' in item:
+            role, days = item.split(':', 1)
+            periods[role.strip()] = int(days)
+    return periods
+
+
+# مدة الإعارة بالأيام لكل دور، والغرامة اليومية بعد فترة السماح بحد أقصى لكل إعارة
+LOAN_PERIODS = parse_loan_periods(os.getenv('LOAN_PERIODS', 'admin:28,librarian:28,user:14'))
+DEFAULT_LOAN_PERIOD = int(os.getenv('DEFAULT_LOAN_PERIOD', 14))
+FINE_PER_DAY = Decimal(os.getenv('FINE_PER_DAY', '0.25'))
+FINE_CAP = Decimal(os.getenv('FINE_CAP', '20.00'))
+FINE_GRACE_DAYS = int(os.getenv('FINE_GRACE_DAYS', 0))
+
+
+def book_decade(year):
+    return year - year % 10 if year is not None else None
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def loan_period(role):
+    return LOAN_PERIODS.get(role, DEFAULT_LOAN_PERIOD)
+
+
+def loan_fine(due_date, on_date):
+    """(أيام التأخير، الغرامة) لإعارة في تاريخ معين، نفس قاعدة fines.py"""
+    if due_date is None:
+        return 0, Decimal('0.00')
+    days = max(0, (on_date - due_date).days)
+    charged = max(0, days - FINE_GRACE_DAYS)
+    return days, min(FINE_PER_DAY * charged, FINE_CAP).quantize(Decimal('0.01'))
+
+# فهارس قديمة أصبحت بادئة لفهارس مركبة أعلاه
+OBSOLETE_INDEXES = [
+    ('books', 'idx_title'),
+    ('books', 'idx_author'),
+    ('books', 'idx_available'),
+    ('borrowed_books', 'idx_book_id'),
+    # borrower أصبح نصاً للعرض فقط، والبحث حسب المستخدم عبر user_id
+    ('borrowed_books', 'idx_borrower'),
+    ('books', 'idx_books_author'),
+    ('books', 'idx_books_available_title'),
+    ('users', 'idx_users_created'),
+]
+
+
+# أقفال SQLite والاختبارات: على مستوى العملية فقط
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def hash_password(password):
+    """تجزئة كلمة المرور (دالة على مستوى الوحدة حتى تعمل في عمليات provision_users)"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def borrower_label(full_name, username):
+    """النص المحفوظ في borrower والمعروض في القوائم"""
+    return f"{full_name} ({username})"
+
+
+def parse_borrower_label(label):
+    """استخراج username من "الاسم (username)" في السجلات القديمة"""
+    if not label or not label.endswith(')') or '(' not in label:
+        return None
+    return label[label.rindex('(') + 1:-1].strip() or None
+
+
+def catalog_read(method):
+    """قراءة كتالوج: تُدمج مع نداء جارٍ بنفس الوسائط (single_flight)، وتعيد آخر نتيجة صالحة
+    (stale_results) إذا فشلت القاعدة، بدل القيمة الافتراضية
+
+    مفتاح الدمج يشمل catalog_generation، فالطلب الذي يصل بعد كتابة في هذه العملية لا ينضم لقراءة بدأت قبلها.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        read = partial(self._guarded_read, method, args, kwargs)
+        flight = self.single_flight
+        if flight is not None:
+            result, error = flight.do((method.__name__, self.catalog_generation) + key[1:], read)
+        else:
+            result, error = read()
+        stale = self.stale_results
+        if stale is None:
+            return result
+        if error is None:
+            stale.remember(key, result)
+            return result
+        return stale.recall(key, result)
+    return wrapper
+
+
+class _SettlingCursor:
+    """cursor تدفقي يسجل نجاح استخدام circuit_breaker بعد execute؛ باقي الدوال من الـ cursor نفسه"""
+
+    def __init__(self, cursor, ticket):
+        self._cursor = cursor
+        self._ticket = ticket
+
+    def execute(self, query, args=None):
+        result = self._cursor.execute(query, args)
+        self._ticket.release(True)
+        return result
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class LibraryBackend:
+    """الواجهة المشتركة لكل محركات قواعد البيانات
+
+    كل محرك (MySQL / PostgreSQL / SQLite) يحدد الاتصال و DDL والفروق البسيطة في SQL،
+    وكل الاستعلامات هنا مكتوبة بعلامات %s وتُترجم عند الحاجة داخل المحرك.
+    """
+
+    backend_name = None
+    Error = Exception
+    like_operator = 'LIKE'
+    # يُضاف لاستعلامات الطوابير حتى تتخطى المعاملات المتزامنة الصفوف المقفلة بدل انتظارها
+    skip_locked = ''
+    # قفل صف للقراءة التي يُبنى عليها قرار كتابة (SQLite: كاتب واحد في كل مرة أصلاً)
+    for_update = ''
+
+    # تغييرات الإتاحة المنتظرة لكل transaction مفتوحة في هذا الخيط (بترتيب التداخل)
+    _transactions = threading.local()
+    _availability_listeners = ()
+    # SingleFlight لدمج القراءات المتزامنة (app.py)، ويزيد catalog_generation بعد كل commit يغير الكتالوج
+    single_flight = None
+    catalog_generation = 0
+    # circuit.CircuitBreaker و circuit.StaleResults (app.py)
+    circuit_breaker = None
+    stale_results = None
+
+    def connect(self):
+        """فتح اتصال جديد بقاعدة البيانات"""
+        raise NotImplementedError
+
+    def is_outage_error(self, error):
+        """هل يعني الخطأ أن القاعدة غير متاحة (اتصال)، لا خطأ في الاستعلام نفسه أو تعارض أقفال"""
+        return False
+
+    def schema_statements(self):
+        """عبارات إنشاء الجداول والفهارس الخاصة بالمحرك"""
+        raise NotImplementedError
+
+    def insert_ignore_sql(self, table, columns):
+        """عبارة INSERT تتجاهل الصفوف المكررة"""
+        raise NotImplementedError
+
+    def create_database_if_not_exists(self):
+        """إنشاء قاعدة البيانات إذا لم تكن موجودة"""
+        return True
+
+    def stream_cursor(self, connection, tuples=False):
+        """cursor يقرأ الصفوف من الخادم تدريجياً بدلاً من تحميلها كلها في الذاكرة"""
+        return self.tuple_cursor(connection) if tuples else connection.cursor()
+
+    def tuple_cursor(self, connection):
+        """cursor يعيد الصفوف كـ tuple كما يرسلها المشغل، بدون بناء dict لكل صف"""
+        raise NotImplementedError
+
+    def insert_many(self, cursor, table, columns, rows, ignore=False):
+        """إدراج دفعة كبيرة من الصفوف؛ ignore=True يتجاهل الصفوف التي تتعارض مع مفتاح فريد"""
+        if ignore:
+            cursor.executemany(self.insert_ignore_sql(table, columns), rows)
+            return
+        placeholders = ', '.join(['%s'] * len(columns))
+        cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+    def reset_id_sequence(self, cursor, table):
+        """مزامنة عداد id بعد إدراج صفوف بأرقام صريحة"""
+        pass
+
+    def index_exists(self, cursor, table, name):
+        """هل يوجد فهرس بهذا الاسم على الجدول"""
+        raise NotImplementedError
+
+    def drop_index_sql(self, table, name):
+        return f"DROP INDEX {name}"
+
+    def add_column_sql(self, table, column, definition):
+        return f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+
+    def insert_returning_id(self, cursor, query, args):
+        """تنفيذ INSERT وإرجاع id الصف الجديد"""
+        cursor.execute(query, args)
+        return cursor.lastrowid
+
+    def bulk_update(self, cursor, table, columns, rows, key='id', batch_size=1000):
+        """تحديث صفوف كثيرة بعبارة UPDATE واحدة لكل دفعة: rows = [(key, value1, value2, ...)]"""
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            assignments = []
+            params = []
+            for position, column in enumerate(columns, 1):
+                whens = ' '.join(['WHEN %s THEN %s'] * len(batch))
+                assignments.append(f"{column} = CASE {key} {whens} ELSE {column} END")
+                for row in batch:
+                    params.extend((row[0], row[position]))
+            placeholders = ', '.join(['%s'] * len(batch))
+            params.extend(row[0] for row in batch)
+            cursor.execute(
+                f"UPDATE {table} SET {', '.join(assignments)} WHERE {key} IN ({placeholders})",
+                params
+            )
+
+    def ensure_archive_partitions(self, cursor, through_year):
+        """إضافة أقسام سنوية لجدول الأرشيف حتى السنة المحددة (للمحركات التي تدعم التقسيم)"""
+        pass
+
+    def lock_connection(self):
+        """اتصال مخصص لقفل استشاري يبقى مفتوحاً ما دام القفل محجوزاً"""
+        return self.connect()
+
+    def try_advisory_lock(self, connection, name, timeout=0):
+        """قفل محلي داخل العملية؛ MySQL و PostgreSQL يستبدلانه بقفل على الخادم مشترك بين النسخ"""
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(name, threading.Lock())
+        return lock.acquire(timeout=timeout) if timeout else lock.acquire(blocking=False)
+
+    def release_advisory_lock(self, connection, name):
+        lock = _local_locks.get(name)
+        if lock is not None and lock.locked():
+            lock.release()
+
+    def advisory_lock_alive(self, connection):
+        """هل ما زال اتصال القفل قائماً (انقطاعه يحرر القفل على الخادم)"""
+        return True
+
+    @contextmanager
+    def exclusive(self, name, timeout=30):
+        """تنفيذ كتلة في نسخة واحدة فقط في نفس الوقت؛ يعطي False إذا لم يُحجز القفل"""
+        connection = None
+        acquired = False
+        try:
+            connection = self.lock_connection()
+            acquired = self.try_advisory_lock(connection, name, timeout)
+        except self.Error as e:
+            logger.error(f"❌ Could not take lock {name}: {e}")
+        try:
+            yield acquired
+        finally:
+            if connection is not None:
+                try:
+                    if acquired:
+                        self.release_advisory_lock(connection, name)
+                except self.Error as e:
+                    logger.warning(f"⚠️  Could not release lock {name}: {e}")
+                finally:
+                    connection.close()
+
+    def explain_plan(self, cursor, query, args=None):
+        """تشغيل EXPLAIN وإرجاع المشاكل كقائمة (النوع، التفاصيل)
+
+        الأنواع: full_scan، full_index_scan، filesort، temporary
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def get_connection(self):
+        """الحصول على اتصال بقاعدة البيانات"""
+        connection = None
+        try:
+            connection = self.connect()
+            logger.debug("Database connection established")
+            yield connection
+        except self.Error as e:
+            logger.error(f"Database connection error: {e}")
+            raise
+        finally:
+            if connection:
+                connection.close()
+                logger.debug("Database connection closed")
+
+    @contextmanager
+    def guarded_connection(self):
+        """(اتصال، BreakerTicket أو None) عبر circuit_breaker: رفض فوري وهو مفتوح، وتسجيل نتيجة كل استخدام
+
+        أي خطأ هنا يُسجل لـ catalog_read في هذا الخيط، لأن الدوال تلتقطه وتعيد قيمة افتراضية.
+        """
+        breaker = self.circuit_breaker
+        ticket = None
+        if breaker is not None:
+            kind = breaker.acquire()
+            if kind is None:
+                error = circuit_open_error(self.Error)(f"database circuit open, retrying in {breaker.retry_in():.0f}s")
+                self._transactions.failed = error
+                raise error
+            ticket = BreakerTicket(breaker, kind)
+        ok = True
+        try:
+            with self.get_connection() as connection:
+                yield connection, ticket
+        except self.Error as e:
+            ok = not self.is_outage_error(e)
+            self._transactions.failed = e
+            raise
+        finally:
+            if ticket is not None:
+                ticket.release(ok)
+
+    def _guarded_read(self, method, args, kwargs):
+        """(النتيجة، خطأ القاعدة أو None)"""
+        self._transactions.failed = None
+        try:
+            result = method(self, *args, **kwargs)
+            return result, self._transactions.failed
+        finally:
+            self._transactions.failed = None
+
+    @contextmanager
+    def get_stream_cursor(self, tuples=False):
+        """cursor للقراءة التدفقية للنتائج الكبيرة
+
+        نتيجة circuit_breaker تُسجل بعد execute لا بعد آخر صف: الاستجابة المتدفقة تبقى مفتوحة
+        ما دام العميل يقرأ، ولا يجب أن تحجز الاتصال التجريبي طوال ذلك.
+        """
+        with self.guarded_connection() as (connection, ticket):
+            cursor = self.stream_cursor(connection, tuples)
+            try:
+                yield cursor if ticket is None else _SettlingCursor(cursor, ticket)
+                connection.commit()
+            except self.Error as e:
+                connection.rollback()
+                logger.error(f"Streaming query failed: {e}")
+                raise
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def get_cursor(self, tuples=False):
+        """الحصول على cursor لإجراء الاستعلامات؛ tuples=True للقوائم الكبيرة التي تُبنى منها سجلات"""
+        with self.guarded_connection() as (connection, _):
+            cursor = self.tuple_cursor(connection) if tuples else connection.cursor()
+            changes = []
+            stack = self._pending_availability()
+            stack.append(changes)
+            try:
+                yield cursor
+                connection.commit()
+                logger.debug("Transaction committed")
+            except self.Error as e:
+                connection.rollback()
+                logger.error(f"Transaction rolled back: {e}")
+                raise
+            finally:
+                stack.pop()
+                if self._transactions.__dict__.get('change_log') is cursor:
+                    self._transactions.change_log = None
+                cursor.close()
+        if changes:
+            self.catalog_generation += 1
+            self._notify_availability(changes)
+
+    def add_availability_listener(self, listener):
+        """listener([(book_id, available, change_id), ...]) بعد كل commit تتغير فيه إتاحة كتب؛ None لكتاب محذوف
+
+        change_id رقم التغيير في catalog_changes، ليرتب المستمع هذه التحديثات مع ما يقرؤه من السجل.
+        """
+        self._availability_listeners = self._availability_listeners + (listener,)
+
+    def _pending_availability(self):
+        stack = getattr(self._transactions, 'stack', None)
+        if stack is None:
+            stack = self._transactions.stack = []
+        return stack
+
+    def _availability_changed(self, book_id, available, change_id):
+        """تسجيل تغيير كتاب وإتاحته بعد commit، يُبلغ للمستمعين بعده فقط ولا شيء إذا ألغيت transaction"""
+        stack = self._transactions.__dict__.get('stack')
+        if stack:
+            stack[-1].append((book_id, available, change_id))
+
+    def _notify_availability(self, changes):
+        for listener in self._availability_listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                logger.error(f"❌ Availability listener failed: {e}")
+
+    def init_db(self):
+        """تهيئة قاعدة البيانات وإنشاء الجداول"""
+        try:
+            # أولاً: تأكد من وجود قاعدة البيانات
+            self.create_database_if_not_exists()
+
+            with self.get_cursor() as cursor:
+                self.create_schema(cursor)
+
+                # التحقق من وجود المستخدمين الافتراضيين
+                cursor.execute("SELECT COUNT(*) as count FROM users")
+                user_count = cursor.fetchone()['count']
+
+                if user_count == 0:
+                    logger.info("Adding demo users...")
+                    insert_user = self.insert_ignore_sql(
+                        'users', ('username', 'password_hash', 'role', 'full_name', 'email')
+                    )
+                    for username, password, role, full_name, email in DEMO_USERS:
+                        cursor.execute(insert_user, (username, self.hash_password(password), role, full_name, email))
+                    logger.info("✅ Demo users added")
+
+                # التحقق من وجود الكتب التجريبية
+                cursor.execute("SELECT COUNT(*) as count FROM books")
+                book_count = cursor.fetchone()['count']
+
+                if book_count == 0:
+                    logger.info("Adding demo books...")
+                    for title, author, year in DEMO_BOOKS:
+                        cursor.execute(
+                            "INSERT INTO books (title, author, year, decade) VALUES (%s, %s, %s, %s)",
+                            (title, author, year, book_decade(year))
+                        )
+                    logger.info("✅ Demo books added")
+
+                facets_built = self.get_job_state(cursor, 'book_facets_built')
+
+            # أول تشغيل بعد إضافة book_facets: العدادات تُحسب مرة واحدة ثم تُحدث مع كل تغيير
+            if not facets_built:
+                self.rebuild_facets()
+            return True
+
+        except self.Error as e:
+            logger.error(f"❌ Error initializing database: {e}")
+            return False
+
+    def create_schema(self, cursor):
+        """إنشاء الجداول والفهارس بدون بيانات تجريبية"""
+        for statement in self.schema_statements():
+            cursor.execute(statement)
+        self.ensure_archive_partitions(cursor, date.today().year + 1)
+        self.ensure_columns(cursor)
+        self.ensure_indexes(cursor)
+        logger.info("✅ Database tables created/verified successfully")
+
+    def ensure_columns(self, cursor):
+        """إضافة الأعمدة الناقصة لقواعد البيانات الموجودة (أعمدة تقبل NULL فلا تعيد كتابة الجدول)"""
+        for table, column, definition in ADDED_COLUMNS:
+            cursor.execute(f"SELECT * FROM {table} WHERE 1 = 0")
+            if column not in [c[0] for c in cursor.description]:
+                cursor.execute(self.add_column_sql(table, column, definition))
+                logger.info(f"✅ Column {table}.{column} added")
+
+    def ensure_indexes(self, cursor):
+        """إضافة الفهارس الناقصة لقواعد البيانات الموجودة ثم حذف القديمة"""
+        for name, (table, columns) in INDEXES.items():
+            if not self.index_exists(cursor, table, name):
+                cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+                logger.info(f"✅ Index {name} created on {table}")
+        # الحذف بعد الإنشاء: المفتاح الأجنبي يحتاج فهرساً على book_id في كل لحظة
+        for table, name in OBSOLETE_INDEXES:
+            if self.index_exists(cursor, table, name):
+                cursor.execute(self.drop_index_sql(table, name))
+                logger.info(f"Dropped index {name} on {table}")
+
+    def table_columns(self, table):
+        """أسماء أعمدة جدول بالترتيب، بدون الاعتماد على information_schema"""
+        with self.get_cursor() as cursor:
+            cursor.execute(f"SELECT * FROM {table} WHERE 1 = 0")
+            return [column[0] for column in cursor.description]
+
+    def hash_password(self, password):
+        """تجزئة كلمة المرور"""
+        return hash_password(password)
+
+    def authenticate_user(self, username, password):
+        """مصادقة المستخدم"""
+        try:
+            with self.get_cursor() as cursor:
+                query = "SELECT id, username, password_hash, role, full_name FROM users WHERE username = %s"
+                cursor.execute(query, (username,))
+                user = cursor.fetchone()
+
+                if user:
+                    input_password_hash = self.hash_password(password)
+                    if input_password_hash == user['password_hash']:
+                        logger.info(f"✅ User {username} authenticated")
+                        return {
+                            "id": user['id'],
+                            "username": user['username'],
+                            "role": user['role'],
+                            "full_name": user['full_name']
+                        }
+        except self.Error as e:
+            logger.error(f"❌ Authentication error: {e}")
+        return None
+
+    @catalog_read
+    def get_all_books(self):
+        """الحصول على جميع الكتب"""
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                cursor.execute("SELECT id, title, author, year, available FROM books ORDER BY title")
+                return Book.from_rows(cursor.fetchall())
+        except self.Error as e:
+            logger.error(f"❌ Error getting books: {e}")
+            return []
+
+    @catalog_read
+    def get_available_books(self):
+        """الحصول على الكتب المتاحة"""
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                cursor.execute(AVAILABLE_BOOKS_QUERY)
+                return Book.from_rows(cursor.fetchall())
+        except self.Error as e:
+            logger.error(f"❌ Error getting available books: {e}")
+            return []
+
+    def iter_available_books(self, batch_size=500):
+        """الكتب المتاحة بقراءة تدفقية بدون تحميلها كلها (لصفحات القوائم المتدفقة)
+
+        أخطاء القاعدة تُرفع للمستدعي بعد إغلاق المؤشر، و close() على المولد يغلقه أيضاً.
+        """
+        with self.get_stream_cursor(tuples=True) as cursor:
+            cursor.execute(AVAILABLE_BOOKS_QUERY)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from Book.from_rows(rows)
+
+    @catalog_read
+    def get_borrowed_books(self):
+        """الحصول على الكتب المستعارة"""
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                cursor.execute(BORROWED_BOOKS_QUERY)
+                return self._loans_with_borrower(cursor.fetchall())
+        except self.Error as e:
+            logger.error(f"❌ Error getting borrowed books: {e}")
+            return []
+
+    def iter_borrowed_books(self, batch_size=500):
+        """الإعارات المفتوحة بقراءة تدفقية، بنفس سلوك iter_available_books"""
+        with self.get_stream_cursor(tuples=True) as cursor:
+            cursor.execute(BORROWED_BOOKS_QUERY)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from self._loans_with_borrower(rows)
+
+    def get_user_loans(self, user_id):
+        """إعارات المستخدم المفتوحة، الأحدث أولاً"""
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                cursor.execute("""
+                    SELECT bb.id, b.id, b.title, b.author, b.year, bb.borrower, bb.user_id, bb.borrow_date,
+                           bb.due_date, bb.overdue_days, bb.fine_amount
+                    FROM borrowed_books bb
+                    JOIN books b ON b.id = bb.book_id
+                    WHERE bb.user_id = %s AND bb.return_date IS NULL
+                    ORDER BY bb.borrow_date DESC
+                """, (user_id,))
+                return Loan.from_rows(cursor.fetchall())
+        except self.Error as e:
+            logger.error(f"❌ Error getting loans for user {user_id}: {e}")
+            return []
+
+    @catalog_read
+    def get_overdue_loans(self, on_date=None, limit=50):
+        """الإعارات المفتوحة التي تجاوزت due_date، الأقدم أولاً"""
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                cursor.execute("""
+                    SELECT bb.id, b.id, b.title, b.author, b.year, bb.borrower, bb.user_id, bb.borrow_date,
+                           bb.due_date, bb.overdue_days, bb.fine_amount, u.username, u.full_name
+                    FROM borrowed_books bb
+                    JOIN books b ON b.id = bb.book_id
+                    LEFT JOIN users u ON u.id = bb.user_id
+                    WHERE bb.return_date IS NULL AND bb.due_date < %s
+                    ORDER BY bb.due_date
+                    LIMIT %s
+                """, (on_date or date.today(), limit))
+                return self._loans_with_borrower(cursor.fetchall())
+        except self.Error as e:
+            logger.error(f"❌ Error getting overdue loans: {e}")
+            return []
+
+    @catalog_read
+    def get_overdue_loans_count(self, on_date=None):
+        """عدد الإعارات المتأخرة الآن"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    "SELECT COUNT(*) as count FROM borrowed_books WHERE return_date IS NULL AND due_date < %s",
+                    (on_date or date.today(),)
+                )
+                return cursor.fetchone()['count']
+        except self.Error as e:
+            logger.error(f"❌ Error getting overdue loans count: {e}")
+            return 0
+
+    @staticmethod
+    def _loans_with_borrower(rows):
+        """صفوف (أعمدة Loan، username، full_name) -> Loan بالاسم الحالي من جدول users،
+        أو النص المحفوظ للسجلات غير المربوطة بمستخدم"""
+        borrower = Loan._positions['borrower']
+        loans = []
+        for *values, username, full_name in rows:
+            if username:
+                values[borrower] = borrower_label(full_name, username)
+            loans.append(Loan._make(values))
+        return loans
+
+    def add_book(self, title, author, year=None):
+        """إضافة كتاب جديد"""
+        try:
+            with self.get_cursor() as cursor:
+                self._lock_change_log(cursor)
+                book_id = self.insert_returning_id(
+                    cursor, "INSERT INTO books (title, author, year, decade) VALUES (%s, %s, %s, %s)",
+                    (title, author, year, book_decade(year))
+                )
+                self._adjust_facets(cursor, author, book_decade(year), 1, 1)
+                self._availability_changed(book_id, True, self._record_change(cursor, book_id))
+                logger.info(f"✅ Book '{title}' added")
+                return True
+        except self.Error as e:
+            logger.error(f"❌ Error adding book: {e}")
+            return False
+
+    def update_book(self, book_id, title, author, year):
+        """تحديث معلومات الكتاب"""
+        try:
+            with self.get_cursor() as cursor:
+                self._lock_change_log(cursor)
+                cursor.execute("SELECT author, decade, available FROM books WHERE id = %s", (book_id,))
+                old = cursor.fetchone()
+                cursor.execute(
+                    "UPDATE books SET title = %s, author = %s, year = %s, decade = %s WHERE id = %s",
+                    (title, author, year, book_decade(year), book_id)
+                )
+                updated = cursor.rowcount > 0
+                if updated:
+                    available = 1 if old['available'] else 0
+                    self._adjust_facets(cursor, old['author'], old['decade'], -1, -available)
+                    self._adjust_facets(cursor, author, book_decade(year), 1, available)
+                    self._availability_changed(book_id, bool(available), self._record_change(cursor, book_id))
+                logger.info(f"✅ Book {book_id} updated")
+                return updated
+        except self.Error as e:
+            logger.error(f"❌ Error updating book: {e}")
+            return False
+
+    def delete_book(self, book_id):
+        """حذف كتاب"""
+        try:
+            with self.get_cursor() as cursor:
+                self._lock_change_log(cursor)
+                cursor.execute("SELECT author, decade, available FROM books WHERE id = %s", (book_id,))
+                old = cursor.fetchone()
+                cursor.execute("DELETE FROM books WHERE id = %s", (book_id,))
+                deleted = cursor.rowcount > 0
+                if deleted:
+                    self._adjust_facets(cursor, old['author'], old['decade'], -1, -1 if old['available'] else 0)
+                    self._availability_changed(book_id, None, self._record_change(cursor, book_id, 'delete'))
+                logger.info(f"✅ Book {book_id} deleted")
+                return deleted
+        except self.Error as e:
+            logger.error(f"❌ Error deleting book: {e}")
+            return False
+
+    def borrow_book(self, book_id, user_id):
+        """استعارة كتاب"""
+        try:
+            with self.get_cursor() as cursor:
+                self._lock_change_log(cursor)
+                # صف الكتاب مقفل حتى commit: إعارتان متزامنتان لا تريانه متاحاً معاً
+                cursor.execute(f"SELECT available FROM books WHERE id = %s{self.for_update}", (book_id,))
+                book = cursor.fetchone()
+
+                if not book:
+                    return False
+
+                hold = None
+                if not book['available']:
+                    # الكتاب غير متاح إلا إذا كان محجوزاً لهذا المستخدم ولم تنته المهلة
+                    cursor.execute(
+                        "SELECT id FROM holds WHERE book_id = %s AND user_id = %s AND status = 'ready' AND expires_at > %s",
+                        (book_id, user_id, datetime.now())
+                    )
+                    hold = cursor.fetchone()
+                    if not hold:
+                        return False
+
+                cursor.execute("SELECT username, full_name, role FROM users WHERE id = %s", (user_id,))
+                user = cursor.fetchone()
+                if not user:
+                    return False
+
+                borrower_name = borrower_label(user['full_name'], user['username'])
+                today = date.today()
+                due_date = today + timedelta(days=loan_period(user['role']))
+                if not self._set_available(cursor, book_id, False) and not hold:
+                    # غيرته transaction أخرى بعد القراءة
+                    return False
+                cursor.execute(
+                    "INSERT INTO borrowed_books (book_id, user_id, borrower, borrow_date, due_date) VALUES (%s, %s, %s, %s, %s)",
+                    (book_id, user_id, borrower_name, today, due_date)
+                )
+                if hold:
+                    cursor.execute("UPDATE holds SET status = 'fulfilled' WHERE id = %s", (hold['id'],))
+                logger.info(f"✅ Book {book_id} borrowed by {borrower_name}")
+                return True
+        except self.Error as e:
+            logger.error(f"❌ Error borrowing book: {e}")
+            return False
+
+    def return_book(self, book_id):
+        """إرجاع كتاب"""
+        try:
+            with self.get_cursor() as cursor:
+                self._lock_change_log(cursor)
+                cursor.execute(f"SELECT available FROM books WHERE id = %s{self.for_update}", (book_id,))
+                book = cursor.fetchone()
+
+                if book and book['available']:
+                    return False
+
+                cursor.execute(
+                    "SELECT id, due_date FROM borrowed_books WHERE book_id = %s AND return_date IS NULL", (book_id,)
+                )
+                loans = cursor.fetchall()
+                if not loans:
+                    # غير مُعار (قد يكون محجوزاً بانتظار صاحب الحجز)
+                    return False
+                today = date.today()
+                for loan in loans:
+                    # الغرامة النهائية تُثبت عند الإرجاع
+                    overdue_days, fine = loan_fine(loan['due_date'], today)
+                    cursor.execute(
+                        "UPDATE borrowed_books SET return_date = %s, overdue_days = %s, fine_amount = %s WHERE id = %s",
+                        (today, overdue_days, fine, loan['id'])
+                    )
+                # الكتاب يذهب لأول حجز في الطابور، وإلا يصبح متاحاً للجميع
+                if not self._claim_next_hold(cursor, book_id):
+                    self._set_available(cursor, book_id, True)
+                logger.info(f"✅ Book {book_id} returned")
+                return True
+        except self.Error as e:
+            logger.error(f"❌ Error returning book: {e}")
+            return False
+
+    @catalog_read
+    def browse_books(self, author=None, decade=None, available=None, after=None, limit=50):
+        """صفحة من الكتب مرتبة حسب العنوان مع فلاتر التصفح
+
+        after هو id آخر كتاب في الصفحة السابقة؛ الترقيم بالمفتاح (title, id) بدل OFFSET.
+        يعيد (الكتب، id آخر كتاب إذا كان هناك صفحة تالية وإلا None).
+        """
+        conditions, args = [], []
+        if author is not None:
+            conditions.append("author = %s")
+            args.append(author)
+        if decade is not None:
+            conditions.append("decade = %s")
+            args.append(decade)
+        if available is not None:
+            conditions.append("available = %s")
+            args.append(available)
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                if after is not None:
+                    cursor.execute("SELECT title FROM books WHERE id = %s", (after,))
+                    last = cursor.fetchone()
+                    if last:
+                        conditions.append("(title > %s OR (title = %s AND id > %s))")
+                        args.extend([last[0], last[0], after])
+                where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+                cursor.execute(f"""
+                    SELECT id, title, author, year, available
+                    FROM books
+                    {where}
+                    ORDER BY title, id
+                    LIMIT %s
+                """, args + [limit + 1])
+                books = Book.from_rows(cursor.fetchall())
+        except self.Error as e:
+            logger.error(f"❌ Error browsing books: {e}")
+            return [], None
+
+        if len(books) > limit:
+            books = books[:limit]
+            return books, books[-1].id
+        return books, None
+
+    @catalog_read
+    def get_facets(self, limit=20):
+        """قيم كل بُعد مع عدد الكتب والمتاح منها، من book_facets فقط
+
+        العدادات لكل بُعد على حدة (لا تتأثر بالفلاتر الأخرى)؛ المؤلفون الأكثر كتباً أولاً والعقود بالترتيب.
+        """
+        facets = {}
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("""
+                    SELECT value, total, available FROM book_facets
+                    WHERE facet = 'author' AND total > 0
+                    ORDER BY total DESC
+                    LIMIT %s
+                """, (limit,))
+                facets['author'] = cursor.fetchall()
+                cursor.execute("SELECT value, total, available FROM book_facets WHERE facet = 'decade' AND total > 0")
+                facets['decade'] = sorted(cursor.fetchall(), key=lambda row: int(row['value']))
+                cursor.execute("SELECT total, available FROM book_facets WHERE facet = 'all'")
+                totals = cursor.fetchone()
+                facets['availability'] = {'total': totals['total'], 'available': totals['available']} if totals else \
+                    {'total': 0, 'available': 0}
+        except self.Error as e:
+            logger.error(f"❌ Error reading facets: {e}")
+            return {'author': [], 'decade': [], 'availability': {'total': 0, 'available': 0}}
+        return facets
+
+    def rebuild_facets(self, chunk_size=5000):
+        """إعادة حساب book_facets من books (مهمة خلفية)، ويعيد عدد الكتب التي أُضيف لها decade"""
+        backfilled = 0
+        try:
+            # books.decade للكتب التي أُضيفت قبل العمود أو بالتحميل المباشر
+            last_id = 0
+            while True:
+                with self.get_cursor() as cursor:
+                    cursor.execute("""
+                        SELECT id, year FROM books
+                        WHERE decade IS NULL AND year IS NOT NULL AND id > %s
+                        ORDER BY id
+                        LIMIT %s
+                    """, (last_id, chunk_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    self.bulk_update(cursor, 'books', ('decade',), [(row['id'], book_decade(row['year'])) for row in rows])
+                backfilled += len(rows)
+                last_id = rows[-1]['id']
+
+            with self.get_cursor() as cursor:
+                self._rebuild_facets(cursor)
+        except self.Error as e:
+            logger.error(f"❌ Error rebuilding facets: {e}")
+            return 0
+
+        if backfilled:
+            logger.info(f"✅ Decade filled in for {backfilled:,} book(s)")
+        return backfilled
+
+    def _rebuild_facets(self, cursor):
+        cursor.execute("DELETE FROM book_facets")
+        cursor.execute("""
+            INSERT INTO book_facets (facet, value, total, available)
+            SELECT 'author', author, COUNT(*), SUM(CASE WHEN available THEN 1 ELSE 0 END)
+            FROM books
+            GROUP BY author
+        """)
+        cursor.execute("""
+            SELECT decade, COUNT(*) AS total, SUM(CASE WHEN available THEN 1 ELSE 0 END) AS available
+            FROM books
+            WHERE decade IS NOT NULL
+            GROUP BY decade
+        """)
+        rows = [('decade', str(row['decade']), row['total'], row['available']) for row in cursor.fetchall()]
+        cursor.execute("SELECT COUNT(*) AS total, SUM(CASE WHEN available THEN 1 ELSE 0 END) AS available FROM books")
+        totals = cursor.fetchone()
+        rows.append(('all', '', totals['total'], totals['available'] or 0))
+        self.insert_many(cursor, 'book_facets', ('facet', 'value', 'total', 'available'), rows)
+        self.set_job_state(cursor, 'book_facets_built', 1)
+        logger.info("✅ Browse facet counts rebuilt")
+
+    def get_book(self, book_id):
+        """كتاب واحد أو None"""
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                cursor.execute("SELECT id, title, author, year, available FROM books WHERE id = %s", (book_id,))
+                row = cursor.fetchone()
+                return Book._make(row) if row else None
+        except self.Error as e:
+            logger.error(f"❌ Error getting book {book_id}: {e}")
+            return None
+
+    def get_books(self, book_ids):
+        """{id: كتاب} لمجموعة كتب بقراءة المفتاح الأساسي"""
+        if not book_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(book_ids))
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                cursor.execute(
+                    f"SELECT id, title, author, year, available FROM books WHERE id IN ({placeholders})", list(book_ids)
+                )
+                return {book.id: book for book in Book.from_rows(cursor.fetchall())}
+        except self.Error as e:
+            logger.error(f"❌ Error getting books: {e}")
+            return {}
+
+    def get_book_neighbours(self, book_id, limit=10):
+        """"استُعير معه": الجيران المحسوبون مسبقاً لكتاب، بقراءة نطاق على المفتاح الأساسي"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("""
+                    SELECT b.id, b.title, b.author, b.year, b.available, n.score, n.together
+                    FROM book_neighbours n
+                    JOIN books b ON b.id = n.neighbour_id
+                    WHERE n.book_id = %s
+                    ORDER BY n.position
+                    LIMIT %s
+                """, (book_id, limit))
+                return cursor.fetchall()
+        except self.Error as e:
+            logger.error(f"❌ Error getting neighbours for book {book_id}: {e}")
+            return []
+
+    def save_book_neighbours(self, cursor, neighbours):
+        """استبدال جيران مجموعة كتب: {book_id: [(neighbour_id, score, together), ...]} بالترتيب"""
+        book_ids = list(neighbours)
+        for start in range(0, len(book_ids), 1000):
+            batch = book_ids[start:start + 1000]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f"DELETE FROM book_neighbours WHERE book_id IN ({placeholders})", batch)
+        rows = [
+            (book_id, position, neighbour_id, score, together)
+            for book_id, items in neighbours.items()
+            for position, (neighbour_id, score, together) in enumerate(items, 1)
+        ]
+        if rows:
+            self.insert_many(cursor, 'book_neighbours', ('book_id', 'position', 'neighbour_id', 'score', 'together'), rows)
+
+    @catalog_read
+    def search_books(self, query):
+        """بحث عن الكتب"""
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                search_query = f"%{query}%"
+                cursor.execute(f"""
+                    SELECT id, title, author, year, available
+                    FROM books
+                    WHERE title {self.like_operator} %s OR author {self.like_operator} %s
+                    ORDER BY title
+                """, (search_query, search_query))
+                return Book.from_rows(cursor.fetchall())
+        except self.Error as e:
+            logger.error(f"❌ Error searching books: {e}")
+            return []
+
+    @catalog_read
+    def get_total_books(self):
+        """الحصول على إجمالي عدد الكتب"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) as count FROM books")
+                return cursor.fetchone()['count']
+        except self.Error as e:
+            logger.error(f"❌ Error getting total books: {e}")
+            return 0
+
+    @catalog_read
+    def get_available_books_count(self):
+        """الحصول على عدد الكتب المتاحة"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) as count FROM books WHERE available = TRUE")
+                return cursor.fetchone()['count']
+        except self.Error as e:
+            logger.error(f"❌ Error getting available books count: {e}")
+            return 0
+
+    @catalog_read
+    def get_borrowed_books_count(self):
+        """الحصول على عدد الكتب المستعارة"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) as count FROM books WHERE available = FALSE")
+                return cursor.fetchone()['count']
+        except self.Error as e:
+            logger.error(f"❌ Error getting borrowed books count: {e}")
+            return 0
+
+    def create_user(self, username, password, role, full_name, email):
+        """إنشاء مستخدم جديد"""
+        try:
+            password_hash = self.hash_password(password)
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO users (username, password_hash, role, full_name, email) VALUES (%s, %s, %s, %s, %s)",
+                    (username, password_hash, role, full_name, email)
+                )
+                logger.info(f"✅ User {username} created")
+                return True
+        except self.Error as e:
+            logger.error(f"❌ Error creating user: {e}")
+            return False
+
+    def create_users(self, cursor, users):
+        """إدراج دفعة مستخدمين (username، password_hash، role، full_name، email) مع تجاهل الموجودين
+
+        يعيد {username: id} للحسابات التي أُنشئت فعلاً؛ الغائب عنه كان موجوداً من قبل
+        (أو أنشأته عملية أخرى في نفس اللحظة، فتختلف password_hash).
+        """
+        if not users:
+            return {}
+        placeholders = ', '.join(['%s'] * len(users))
+        usernames = [user[0] for user in users]
+        cursor.execute(f"SELECT username FROM users WHERE username IN ({placeholders})", usernames)
+        existing = {row['username'] for row in cursor.fetchall()}
+        self.insert_many(cursor, 'users', ('username', 'password_hash', 'role', 'full_name', 'email'),
+                         [user for user in users if user[0] not in existing], ignore=True)
+        cursor.execute(f"SELECT id, username, password_hash FROM users WHERE username IN ({placeholders})", usernames)
+        hashes = {user[0]: user[1] for user in users}
+        return {
+            row['username']: row['id'] for row in cursor.fetchall()
+            if row['username'] not in existing and hashes.get(row['username']) == row['password_hash']
+        }
+
+    def browse_users(self, role=None, prefix=None, field='username', after=None, limit=50):
+        """صفحة من دليل المستخدمين، كل استعلام مسح نطاق في فهرس بحد أقصى limit + 1 صف
+
+        بدون prefix: الأحدث أولاً بالمفتاح (created_date, id). مع prefix: المستخدمون الذين يبدأ field
+        عندهم بالنص، مرتبين حسب field ثم id. after هو id آخر مستخدم في الصفحة السابقة.
+        يعيد (المستخدمين، id آخر مستخدم إذا كان هناك صفحة تالية وإلا None).
+        """
+        if field not in USER_SEARCH_FIELDS:
+            raise ValueError(f"field must be one of {', '.join(USER_SEARCH_FIELDS)}")
+        conditions, args = [], []
+        if role is not None:
+            conditions.append("role = %s")
+            args.append(role)
+        if prefix:
+            # نطاق بدل LIKE: يستخدم الفهرس مع أي collation (ولا يفرق بين الحروف الكبيرة والصغيرة في MySQL)
+            conditions.append(f"{field} >= %s AND {field} < %s")
+            args.extend([prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)])
+            order = f"{field}, id"
+        else:
+            order = "created_date DESC, id DESC"
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                if after is not None:
+                    cursor.execute(f"SELECT created_date, {field} FROM users WHERE id = %s", (after,))
+                    last = cursor.fetchone()
+                    # الشرط الأول حد للنطاق يستخدمه الفهرس، والثاني يستثني ما قبل after عند التساوي
+                    if last and prefix:
+                        conditions.append(f"{field} >= %s AND ({field} > %s OR id > %s)")
+                        args.extend([last[1], last[1], after])
+                    elif last:
+                        conditions.append("created_date <= %s AND (created_date < %s OR id < %s)")
+                        args.extend([last[0], last[0], after])
+                where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+                cursor.execute(f"""
+                    SELECT id, username, role, full_name, email, created_date
+                    FROM users
+                    {where}
+                    ORDER BY {order}
+                    LIMIT %s
+                """, args + [limit + 1])
+                users = User.from_rows(cursor.fetchall())
+        except self.Error as e:
+            logger.error(f"❌ Error browsing users: {e}")
+            return [], None
+
+        if len(users) > limit:
+            users = users[:limit]
+            return users, users[-1].id
+        return users, None
+
+    def get_user_role_counts(self):
+        """عدد المستخدمين لكل دور (مسح كامل لفهرس الدور؛ الواجهة تحتفظ بالنتيجة مؤقتاً)"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("SELECT role, COUNT(*) AS total FROM users GROUP BY role ORDER BY role")
+                return {row['role']: row['total'] for row in cursor.fetchall()}
+        except self.Error as e:
+            logger.error(f"❌ Error counting users by role: {e}")
+            return {}
+
+    def get_all_users(self):
+        """الحصول على جميع المستخدمين"""
+        try:
+            with self.get_cursor(tuples=True) as cursor:
+                cursor.execute("""
+                    SELECT id, username, role, full_name, email, created_date
+                    FROM users
+                    ORDER BY created_date DESC
+                """)
+                return User.from_rows(cursor.fetchall())
+        except self.Error as e:
+            logger.error(f"❌ Error getting users: {e}")
+            return []
+
+    def archive_closed_loans(self, max_age_days=LOAN_ARCHIVE_AGE_DAYS, chunk_size=1000, pause=0.1, max_chunks=None,
+                             should_stop=None):
+        """نقل الإعارات المغلقة القديمة إلى الأرشيف على دفعات، transaction واحدة لكل دفعة
+
+        pause بين الدفعات يحد من الضغط على القاعدة أثناء ساعات العمل،
+        و should_stop() يسمح للمجدول بإيقاف العملية بين دفعتين.
+        """
+        cutoff = date.today() - timedelta(days=max_age_days)
+        columns = ', '.join(LOAN_COLUMNS)
+        select_columns = ', '.join(
+            'COALESCE(borrow_date, return_date)' if column == 'borrow_date' else column for column in LOAN_COLUMNS
+        )
+        archived = chunks = 0
+        try:
+            with self.get_cursor() as cursor:
+                self.ensure_archive_partitions(cursor, date.today().year + 1)
+
+            while max_chunks is None or chunks < max_chunks:
+                with self.get_cursor() as cursor:
+                    cursor.execute("""
+                        SELECT id FROM borrowed_books
+                        WHERE return_date IS NOT NULL AND return_date < %s
+                        ORDER BY return_date, id
+                        LIMIT %s
+                    """, (cutoff, chunk_size))
+                    ids = [row['id'] for row in cursor.fetchall()]
+                    if not ids:
+                        break
+                    placeholders = ', '.join(['%s'] * len(ids))
+                    cursor.execute(
+                        f"INSERT INTO borrowed_books_archive ({columns}) "
+                        f"SELECT {select_columns} FROM borrowed_books WHERE id IN ({placeholders})",
+                        ids
+                    )
+                    cursor.execute(f"DELETE FROM borrowed_books WHERE id IN ({placeholders})", ids)
+                archived += len(ids)
+                chunks += 1
+                if len(ids) < chunk_size or (should_stop and should_stop()):
+                    break
+                if pause:
+                    time.sleep(pause)
+        except self.Error as e:
+            logger.error(f"❌ Error archiving loans after {archived} rows: {e}")
+
+        if archived:
+            logger.info(f"✅ Archived {archived} loan(s) closed before {cutoff}")
+        return archived
+
+    def get_loan_history(self, book_id=None, user_id=None, since=None, limit=100):
+        """سجل الإعارات من الجدول الساخن والأرشيف معاً"""
+        conditions = []
+        params = []
+        if book_id is not None:
+            conditions.append("book_id = %s")
+            params.append(book_id)
+        if user_id is not None:
+            conditions.append("user_id = %s")
+            params.append(user_id)
+        if since is not None:
+            conditions.append("borrow_date >= %s")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        columns = ', '.join(LOAN_COLUMNS)
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT {columns} FROM borrowed_books {where}
+                    UNION ALL
+                    SELECT {columns} FROM borrowed_books_archive {where}
+                    ORDER BY borrow_date DESC, id DESC
+                    LIMIT %s
+                """, params + params + [limit])
+                return cursor.fetchall()
+        except self.Error as e:
+            logger.error(f"❌ Error getting loan history: {e}")
+            return []
+
+    def iter_loan_pairs(self, since=0, batch_size=50000):
+        """دفعات (id، user_id، book_id) للإعارات بعد id معين من الجدول الساخن والأرشيف، بقراءة تدفقية
+
+        الجدولان في عبارة واحدة حتى يُقرآ من نفس snapshot: بقراءتين منفصلتين تظهر إعارة
+        نُقلت للأرشيف بينهما مرتين.
+        """
+        with self.get_stream_cursor() as cursor:
+            cursor.execute("""
+                SELECT id, user_id, book_id FROM borrowed_books WHERE id > %s AND user_id IS NOT NULL
+                UNION ALL
+                SELECT id, user_id, book_id FROM borrowed_books_archive WHERE id > %s AND user_id IS NOT NULL
+            """, (since, since))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    def get_first_loan_date(self):
+        """أقدم تاريخ إعارة في الجدول الساخن والأرشيف (None بدون إعارات)"""
+        try:
+            with self.get_cursor() as cursor:
+                days = []
+                for table in ('borrowed_books', 'borrowed_books_archive'):
+                    cursor.execute(
+                        f"SELECT borrow_date FROM {table} WHERE borrow_date IS NOT NULL ORDER BY borrow_date LIMIT 1"
+                    )
+                    row = cursor.fetchone()
+                    if row:
+                        days.append(row['borrow_date'])
+                return min(days) if days else None
+        except self.Error as e:
+            logger.error(f"❌ Error getting first loan date: {e}")
+            return None
+
+    def get_loan_activity(self, cursor, start, end, archive=False):
+        """تجميعات الإعارة للأيام [start, end) التي يبني منها analytics.py الملخصات
+
+        الإعارات لكل يوم حسب المؤلف والدور، المستعيرون المختلفون لكل يوم، والإرجاعات لكل يوم
+        حسب تاريخ الإعارة (لحساب المدة). archive=True يضيف الأرشيف للأيام القديمة.
+        """
+        activity = {'authors': [], 'roles': [], 'borrowers': [], 'returns': []}
+        tables = ('borrowed_books', 'borrowed_books_archive') if archive else ('borrowed_books',)
+        for table in tables:
+            cursor.execute(f"""
+                SELECT l.borrow_date AS day, b.author AS value, COUNT(*) AS loans
+                FROM {table} l
+                LEFT JOIN books b ON b.id = l.book_id
+                WHERE l.borrow_date >= %s AND l.borrow_date < %s
+                GROUP BY l.borrow_date, b.author
+            """, (start, end))
+            activity['authors'].extend(cursor.fetchall())
+            cursor.execute(f"""
+                SELECT l.borrow_date AS day, u.role AS value, COUNT(*) AS loans
+                FROM {table} l
+                LEFT JOIN users u ON u.id = l.user_id
+                WHERE l.borrow_date >= %s AND l.borrow_date < %s
+                GROUP BY l.borrow_date, u.role
+            """, (start, end))
+            activity['roles'].extend(cursor.fetchall())
+            # borrower يميز السجلات القديمة بدون user_id فقط
+            cursor.execute(f"""
+                SELECT DISTINCT borrow_date AS day, user_id, CASE WHEN user_id IS NULL THEN borrower END AS borrower
+                FROM {table}
+                WHERE borrow_date >= %s AND borrow_date < %s
+            """, (start, end))
+            activity['borrowers'].extend(cursor.fetchall())
+            cursor.execute(f"""
+                SELECT return_date AS day, borrow_date, COUNT(*) AS loans
+                FROM {table}
+                WHERE return_date >= %s AND return_date < %s
+                GROUP BY return_date, borrow_date
+            """, (start, end))
+            activity['returns'].extend(cursor.fetchall())
+        return activity
+
+    def save_loan_rollups(self, cursor, start, end, daily, dimensions):
+        """استبدال ملخصات الأيام [start, end) ثم إعادة حساب صفوف الأشهر التي تلمسها
+
+        daily: صفوف (day، loans، returns، loan_days، borrowers، borrowers_hll)
+        dimensions: {'author': [(day, value, loans)], 'role': [...]}
+        """
+        cursor.execute("DELETE FROM loan_daily WHERE day >= %s AND day < %s", (start, end))
+        self.insert_many(cursor, 'loan_daily', ('day', 'loans', 'returns', 'loan_days', 'borrowers', 'borrowers_hll'),
+                         daily)
+        for dimension, rows in dimensions.items():
+            cursor.execute(
+                "DELETE FROM loan_rollups WHERE grain = 'd' AND dimension = %s AND day >= %s AND day < %s",
+                (dimension, start, end)
+            )
+            self.insert_many(cursor, 'loan_rollups', ('grain', 'dimension', 'day', 'value', 'loans'),
+                             [('d', dimension, day, value, loans) for day, value, loans in rows])
+            month = month_start(start)
+            while month < end:
+                cursor.execute(
+                    "DELETE FROM loan_rollups WHERE grain = 'm' AND dimension = %s AND day = %s", (dimension, month)
+                )
+                cursor.execute("""
+                    INSERT INTO loan_rollups (grain, dimension, day, value, loans)
+                    SELECT 'm', dimension, %s, value, SUM(loans) FROM loan_rollups
+                    WHERE grain = 'd' AND dimension = %s AND day >= %s AND day < %s
+                    GROUP BY dimension, value
+                """, (month, dimension, month, next_month(month)))
+                month = next_month(month)
+
+    def get_loan_daily(self, start, end):
+        """ملخصات الأيام [start, end) مرتبة حسب اليوم"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("""
+                    SELECT day, loans, returns, loan_days, borrowers, borrowers_hll FROM loan_daily
+                    WHERE day >= %s AND day < %s
+                    ORDER BY day
+                """, (start, end))
+                return cursor.fetchall()
+        except self.Error as e:
+            logger.error(f"❌ Error getting daily loan rollups: {e}")
+            return []
+
+    def get_loan_rollup_totals(self, dimension, start, end, limit=None):
+        """الإعارات لكل قيمة من البعد في الأيام [start, end)، الأكثر أولاً
+
+        الأشهر الكاملة تُقرأ من صفوف الشهر، والأيام على طرفي النطاق من صفوف اليوم.
+        """
+        first_month = start if start.day == 1 else next_month(start)
+        last_month = month_start(end)
+        if first_month < last_month:
+            parts = [('d', start, first_month), ('m', first_month, last_month), ('d', last_month, end)]
+        else:
+            parts = [('d', start, end)]
+        parts = [part for part in parts if part[1] < part[2]]
+        if not parts:
+            return []
+        # OR على نطاقات المفتاح الأساسي: كل جزء بحث نطاق مستقل
+        ranges = ' OR '.join("(grain = %s AND dimension = %s AND day >= %s AND day < %s)" for _ in parts)
+        params = [value for grain, part_start, part_end in parts for value in (grain, dimension, part_start, part_end)]
+        limit_sql = ""
+        if limit is not None:
+            limit_sql = "LIMIT %s"
+            params.append(limit)
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT value, SUM(loans) AS total FROM loan_rollups
+                    WHERE {ranges}
+                    GROUP BY value
+                    ORDER BY total DESC, value
+                    {limit_sql}
+                """, params)
+                return cursor.fetchall()
+        except self.Error as e:
+            logger.error(f"❌ Error getting loan rollup totals: {e}")
+            return []
+
+    def backfill_loan_users(self, chunk_size=5000, pause=0.05):
+        """ربط السجلات القديمة بـ user_id من نص borrower، على دفعات قصيرة حسب id
+
+        كل دفعة transaction مستقلة فلا يُقفل الجدول طوال العملية، ويمكن إعادة التشغيل في أي وقت.
+        """
+        linked = 0
+        for table in ('borrowed_books', 'borrowed_books_archive'):
+            last_id = 0
+            while True:
+                try:
+                    with self.get_cursor() as cursor:
+                        cursor.execute(
+                            f"SELECT id, borrower FROM {table} WHERE id > %s AND user_id IS NULL ORDER BY id LIMIT %s",
+                            (last_id, chunk_size)
+                        )
+                        rows = cursor.fetchall()
+                        if not rows:
+                            break
+                        last_id = rows[-1]['id']
+
+                        usernames = {}
+                        for row in rows:
+                            username = parse_borrower_label(row['borrower'])
+                            if username:
+                                usernames.setdefault(username, []).append(row['id'])
+                        if usernames:
+                            placeholders = ', '.join(['%s'] * len(usernames))
+                            cursor.execute(
+                                f"SELECT id, username FROM users WHERE username IN ({placeholders})",
+                                list(usernames)
+                            )
+                            updates = [
+                                (user['id'], loan_id)
+                                for user in cursor.fetchall()
+                                for loan_id in usernames[user['username']]
+                            ]
+                            if updates:
+                                cursor.executemany(
+                                    f"UPDATE {table} SET user_id = %s WHERE id = %s AND user_id IS NULL", updates
+                                )
+                                linked += len(updates)
+                except self.Error as e:
+                    logger.error(f"❌ Error backfilling {table} after id {last_id}: {e}")
+                    return linked
+                if pause:
+                    time.sleep(pause)
+
+        logger.info(f"✅ Linked {linked} loan(s) to users")
+        return linked
+
+    def reconcile_availability(self):
+        """تصحيح books.available حسب الإعارات المفتوحة والحجوزات الجاهزة فعلاً، ويعيد عدد الكتب المصححة"""
+        try:
+            with self.get_cursor() as cursor:
+                self._lock_change_log(cursor)
+                cursor.execute("""
+                    SELECT id FROM books
+                    WHERE available = TRUE
+                      AND (EXISTS (SELECT 1 FROM borrowed_books bb WHERE bb.book_id = books.id AND bb.return_date IS NULL)
+                           OR EXISTS (SELECT 1 FROM holds h WHERE h.book_id = books.id AND h.status = 'ready'))
+                """)
+                to_borrowed = [row['id'] for row in cursor.fetchall()]
+                cursor.execute("""
+                    SELECT id FROM books
+                    WHERE available = FALSE
+                      AND NOT EXISTS (SELECT 1 FROM borrowed_books bb WHERE bb.book_id = books.id AND bb.return_date IS NULL)
+                      AND NOT EXISTS (SELECT 1 FROM holds h WHERE h.book_id = books.id AND h.status = 'ready')
+                """)
+                to_available = [row['id'] for row in cursor.fetchall()]
+                # كتاباً كتاباً حتى يُسجل كل تغيير في catalog_changes
+                for book_id in to_borrowed:
+                    self._set_available(cursor, book_id, False)
+                for book_id in to_available:
+                    self._set_available(cursor, book_id, True)
+                marked_borrowed, marked_available = len(to_borrowed), len(to_available)
+        except self.Error as e:
+            logger.error(f"❌ Error reconciling availability: {e}")
+            return 0
+
+        if marked_borrowed or marked_available:
+            logger.warning(f"⚠️  Availability drift fixed: {marked_borrowed} marked borrowed, {marked_available} marked available")
+        return marked_borrowed + marked_available
+
+    def _claim_next_hold(self, cursor, book_id):
+        """تحويل أول حجز منتظر للكتاب إلى جاهز، داخل transaction المستدعي
+
+        صف الكتاب يُقفل أولاً حتى لا يُضاف حجز (place_hold) بين فحص الطابور وجعل الكتاب متاحاً.
+        """
+        cursor.execute(f"SELECT id FROM books WHERE id = %s{self.for_update}", (book_id,))
+        cursor.execute(
+            f"SELECT id, user_id FROM holds WHERE book_id = %s AND status = 'waiting' ORDER BY id LIMIT 1{self.skip_locked}",
+            (book_id,)
+        )
+        hold = cursor.fetchone()
+        if not hold:
+            return None
+        now = datetime.now()
+        cursor.execute(
+            "UPDATE holds SET status = 'ready', ready_at = %s, expires_at = %s WHERE id = %s",
+            (now, now + timedelta(hours=HOLD_WINDOW_HOURS), hold['id'])
+        )
+        logger.info(f"✅ Book {book_id} reserved for user {hold['user_id']} (hold {hold['id']})")
+        return hold
+
+    def place_hold(self, book_id, user_id):
+        """إضافة المستخدم لطابور حجز كتاب مُعار، ويعيد id الحجز أو None"""
+        try:
+            with self.get_cursor() as cursor:
+                self._lock_change_log(cursor)
+                # نفس القفل الذي يأخذه _claim_next_hold: إرجاع متزامن إما يرى هذا الحجز أو يسبقه فنرى الكتاب متاحاً
+                cursor.execute(f"SELECT available FROM books WHERE id = %s{self.for_update}", (book_id,))
+                book = cursor.fetchone()
+                # الكتاب المتاح يُستعار مباشرة
+                if not book or book['available']:
+                    return None
+
+                cursor.execute(
+                    "SELECT COUNT(*) as count FROM holds WHERE book_id = %s AND user_id = %s AND status IN ('waiting', 'ready')",
+                    (book_id, user_id)
+                )
+                if cursor.fetchone()['count']:
+                    return None
+                cursor.execute(
+                    "SELECT COUNT(*) as count FROM borrowed_books WHERE book_id = %s AND user_id = %s AND return_date IS NULL",
+                    (book_id, user_id)
+                )
+                if cursor.fetchone()['count']:
+                    return None
+
+                hold_id = self.insert_returning_id(
+                    cursor,
+                    "INSERT INTO holds (book_id, user_id, status, placed_at) VALUES (%s, %s, 'waiting', %s)",
+                    (book_id, user_id, datetime.now())
+                )
+                logger.info(f"✅ Hold {hold_id} placed on book {book_id} by user {user_id}")
+                return hold_id
+        except self.Error as e:
+            logger.error(f"❌ Error placing hold: {e}")
+            return None
+
+    def cancel_hold(self, hold_id, user_id):
+        """إلغاء حجز المستخدم؛ إذا كان جاهزاً ينتقل الكتاب للحجز التالي"""
+        try:
+            with self.get_cursor() as cursor:
+                self._lock_change_log(cursor)
+                cursor.execute(
+                    "SELECT book_id, status FROM holds WHERE id = %s AND user_id = %s", (hold_id, user_id)
+                )
+                hold = cursor.fetchone()
+                if not hold or hold['status'] not in ACTIVE_HOLD_STATUSES:
+                    return False
+
+                cursor.execute(
+                    "UPDATE holds SET status = 'cancelled' WHERE id = %s AND status = %s", (hold_id, hold['status'])
+                )
+                if cursor.rowcount == 0:
+                    return False
+                if hold['status'] == 'ready' and not self._claim_next_hold(cursor, hold['book_id']):
+                    self._set_available(cursor, hold['book_id'], True)
+                logger.info(f"✅ Hold {hold_id} cancelled")
+                return True
+        except self.Error as e:
+            logger.error(f"❌ Error cancelling hold: {e}")
+            return False
+
+    def get_user_holds(self, user_id):
+        """حجوزات المستخدم النشطة مع الترتيب في الطابور"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute("""
+                    SELECT h.id, h.book_id, b.title, b.author, h.status, h.placed_at, h.expires_at,
+                           (SELECT COUNT(*) FROM holds q
+                            WHERE q.book_id = h.book_id AND q.status = 'waiting' AND q.id <= h.id) AS position
+                    FROM holds h
+                    JOIN books b ON b.id = h.book_id
+                    WHERE h.user_id = %s AND h.status IN ('waiting', 'ready')
+                    ORDER BY h.id
+                """, (user_id,))
+                return cursor.fetchall()
+        except self.Error as e:
+            logger.error(f"❌ Error getting holds for user {user_id}: {e}")
+            return []
+
+    def expire_holds(self, batch_size=100, should_stop=None):
+        """إنهاء الحجوزات الجاهزة التي لم تُستلم في المهلة وتمرير الكتاب للحجز التالي"""
+        expired = 0
+        while True:
+            try:
+                with self.get_cursor() as cursor:
+                    self._lock_change_log(cursor)
+                    cursor.execute(
+                        f"SELECT id, book_id FROM holds WHERE status = 'ready' AND expires_at < %s "
+                        f"ORDER BY expires_at LIMIT %s{self.skip_locked}",
+                        (datetime.now(), batch_size)
+                    )
+                    holds = cursor.fetchall()
+                    for hold in holds:
+                        cursor.execute("UPDATE holds SET status = 'expired' WHERE id = %s", (hold['id'],))
+                        if not self._claim_next_hold(cursor, hold['book_id']):
+                            self._set_available(cursor, hold['book_id'], True)
+            except self.Error as e:
+                logger.error(f"❌ Error expiring holds: {e}")
+                break
+            expired += len(holds)
+            if len(holds) < batch_size or (should_stop and should_stop()):
+                break
+
+        if expired:
+            logger.info(f"✅ Expired {expired} hold(s)")
+        return expired
+
+    def _set_available(self, cursor, book_id, available):
+        """تغيير حالة الإتاحة مع عدادات التصفح وسجل التغييرات داخل نفس transaction؛ False إذا لم تتغير"""
+        cursor.execute(
+            "UPDATE books SET available = %s WHERE id = %s AND available <> %s", (available, book_id, available)
+        )
+        if cursor.rowcount == 0:
+            return False
+        cursor.execute("SELECT author, decade FROM books WHERE id = %s", (book_id,))
+        book = cursor.fetchone()
+        self._adjust_facets(cursor, book['author'], book['decade'], 0, 1 if available else -1)
+        self._availability_changed(book_id, bool(available), self._record_change(cursor, book_id))
+        return True
+
+    def _adjust_facets(self, cursor, author, decade, total, available):
+        """تعديل صفوف book_facets لكتاب واحد بدل GROUP BY عند العرض"""
+        insert = self.insert_ignore_sql('book_facets', ('facet', 'value', 'total', 'available'))
+        for facet, value in (('all', ''), ('author', author), ('decade', decade)):
+            if value is None:
+                continue
+            cursor.execute(insert, (facet, str(value), 0, 0))
+            cursor.execute(
+                "UPDATE book_facets SET total = total + %s, available = available + %s WHERE facet = %s AND value = %s",
+                (total, available, facet, str(value))
+            )
+
+    def _lock_change_log(self, cursor):
+        """قفل صف العداد في job_state حتى commit؛ أول عبارة في كل transaction قد تغير الكتالوج
+
+        بدونه قد تُثبت transaction رقم 101 قبل أخرى أخذت 100، فيتجاوز عميلٌ قرأ بينهما التغيير 100
+        إلى الأبد (get_changes يقرأ id > since). مع القفل تُوزع الأرقام وتُثبت بنفس الترتيب.
+        أخذه قبل أي صف كتاب أو book_facets يجعل ترتيب الأقفال واحداً في كل المعاملات فلا تتقاطع.
+        """
+        cursor.execute("UPDATE job_state SET value = value + 1 WHERE name = %s", (CHANGE_LOG_LOCK,))
+        if cursor.rowcount == 0:
+            cursor.execute(self.insert_ignore_sql('job_state', ('name', 'value')), (CHANGE_LOG_LOCK, 0))
+            cursor.execute("UPDATE job_state SET value = value + 1 WHERE name = %s", (CHANGE_LOG_LOCK,))
+        self._transactions.change_log = cursor
+
+    def _record_change(self, cursor, book_id, op='upsert'):
+        """إضافة الحالة الجديدة للكتاب إلى catalog_changes (بعد _lock_change_log في نفس transaction)؛ يعيد رقم التغيير"""
+        if getattr(self._transactions, 'change_log', None) is not cursor:
+            raise RuntimeError("catalog change recorded without _lock_change_log at the start of the transaction")
+        if op == 'delete':
+            return self.insert_returning_id(
+                cursor, "INSERT INTO catalog_changes (book_id, op, changed_at) VALUES (%s, 'delete', %s)",
+                (book_id, datetime.now())
+            )
+        return self.insert_returning_id(cursor, """
+            INSERT INTO catalog_changes (book_id, op, title, author, year, available, changed_at)
+            SELECT id, 'upsert', title, author, year, available, %s FROM books WHERE id = %s
+        """, (datetime.now(), book_id))
+
+    def get_job_state(self, cursor, name, default=0):
+        cursor.execute("SELECT value FROM job_state WHERE name = %s", (name,))
+        row = cursor.fetchone()
+        return row['value'] if row else default
+
+    def set_job_state(self, cursor, name, value):
+        cursor.execute(self.insert_ignore_sql('job_state', ('name', 'value')), (name, value))
+        cursor.execute(
+            "UPDATE job_state SET value = %s, updated_at = %s WHERE name = %s", (value, datetime.now(), name)
+        )
+
+    def get_changes(self, since, limit=500):
+        """التغييرات بعد المؤشر since
+
+        يعيد (التغييرات، المؤشر الجديد، هل يوجد المزيد)، أو None إذا كان المؤشر أقدم من السجل المحفوظ
+        أو لا ينتمي لهذه القاعدة؛ عندها يحتاج العميل نسخة كاملة من get_catalog_snapshot().
+        """
+        try:
+            with self.get_cursor() as cursor:
+                last = self._last_change(cursor)
+                if since > last or since < self.get_job_state(cursor, 'catalog_changes_purged_through'):
+                    return None
+                cursor.execute("""
+                    SELECT id, book_id, op, title, author, year, available
+                    FROM catalog_changes
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (since, limit + 1))
+                rows = cursor.fetchall()
+        except self.Error as e:
+            logger.error(f"❌ Error reading catalog changes: {e}")
+            return [], since, False
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return rows, (rows[-1]['id'] if rows else since), more
+
+    def iter_books(self, since=0, until=None, batch_size=5000):
+        """دفعات (id، title، author) للكتب بعد id معين وحتى until، مرتبة حسب id وبقراءة تدفقية"""
+        query = "SELECT id, title, author FROM books WHERE id > %s"
+        args = [since]
+        if until is not None:
+            query += " AND id <= %s"
+            args.append(until)
+        with self.get_stream_cursor() as cursor:
+            cursor.execute(query + " ORDER BY id", args)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    def iter_all_books(self, batch_size=5000):
+        """كل الكتب كسجلات Book مرتبة حسب العنوان (مثل get_all_books) بقراءة تدفقية"""
+        with self.get_stream_cursor(tuples=True) as cursor:
+            cursor.execute("SELECT id, title, author, year, available FROM books ORDER BY title")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from Book.from_rows(rows)
+
+    def iter_availability(self, batch_size=50000):
+        """دفعات (id، available) لكل الكتب بقراءة تدفقية واحدة (لبناء AvailabilityBitmap)"""
+        with self.get_stream_cursor(tuples=True) as cursor:
+            cursor.execute("SELECT id, available FROM books")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    def iter_book_popularity(self, batch_size=5000):
+        """(id, title, author, loans) لكل الكتب بقراءة تدفقية، حيث loans عدد إعاراته الحالية والمؤرشفة"""
+        with self.get_stream_cursor() as cursor:
+            cursor.execute("""
+                SELECT b.id, b.title, b.author, COALESCE(l.loans, 0) AS loans
+                FROM books b
+                LEFT JOIN (
+                    SELECT book_id, COUNT(*) AS loans FROM (
+                        SELECT book_id FROM borrowed_books
+                        UNION ALL
+                        SELECT book_id FROM borrowed_books_archive
+                    ) all_loans
+                    GROUP BY book_id
+                ) l ON l.book_id = b.id
+            """)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+
+    def _last_change(self, cursor):
+        cursor.execute("SELECT MAX(id) AS last FROM catalog_changes")
+        return cursor.fetchone()['last'] or 0
+
+    def get_change_cursor(self):
+        """آخر موضع في سجل التغييرات، لمن يبني نسخة من الكتالوج ثم يتابع التغييرات بعدها"""
+        try:
+            with self.get_cursor() as cursor:
+                return self._last_change(cursor)
+        except self.Error as e:
+            logger.error(f"❌ Error reading the change cursor: {e}")
+            return 0
+
+    def get_catalog_snapshot(self, after=0, limit=1000):
+        """صفحة من الكتب بعد id معين مرتبة حسب id، مع المؤشر الذي تبدأ بعده المزامنة التزايدية
+
+        المؤشر من الصفحة الأولى هو الصالح للمزامنة: الصفحات التالية تُقرأ بعده فتعكس ما قبله على الأقل.
+        """
+        try:
+            with self.get_cursor() as cursor:
+                # المؤشر أولاً: التغييرات بعده قد تتكرر في النسخة، وتطبيقها مرة أخرى لا يضر
+                last = self._last_change(cursor)
+                cursor.execute(
+                    "SELECT id, title, author, year, available FROM books WHERE id > %s ORDER BY id LIMIT %s",
+                    (after, limit)
+                )
+                return cursor.fetchall(), last
+        except self.Error as e:
+            logger.error(f"❌ Error building catalog snapshot: {e}")
+            return [], 0
+
+    def compact_changes(self, compact_after_minutes=CHANGE_COMPACT_AFTER_MINUTES,
+                        retention_days=CHANGE_RETENTION_DAYS, chunk_size=5000, should_stop=None):
+        """ضغط سجل التغييرات ثم حذف القديم منه
+
+        الضغط يحذف الإدخالات التي يوجد بعدها إدخال أحدث لنفس الكتاب، فتبقى المؤشرات القديمة صالحة
+        لأن كل إدخال يحمل الحالة الكاملة للكتاب. الحذف حسب العمر يرفع catalog_changes_purged_through،
+        والعملاء الأقدم منه يحصلون على نسخة كاملة.
+        """
+        compacted = purged = 0
+        try:
+            with self.get_cursor() as cursor:
+                last = self._last_change(cursor)
+                cursor.execute(
+                    "SELECT MAX(id) AS boundary FROM catalog_changes WHERE changed_at < %s",
+                    (datetime.now() - timedelta(minutes=compact_after_minutes),)
+                )
+                compact_boundary = cursor.fetchone()['boundary'] or 0
+
+            low = 0
+            while low < compact_boundary:
+                with self.get_cursor() as cursor:
+                    cursor.execute("""
+                        SELECT c.id FROM catalog_changes c
+                        WHERE c.id > %s AND c.id <= %s
+                          AND EXISTS (SELECT 1 FROM catalog_changes n WHERE n.book_id = c.book_id AND n.id > c.id)
+                        ORDER BY c.id
+                        LIMIT %s
+                    """, (low, compact_boundary, chunk_size))
+                    ids = [row['id'] for row in cursor.fetchall()]
+                    if not ids:
+                        break
+                    cursor.execute(f"DELETE FROM catalog_changes WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+                compacted += len(ids)
+                low = ids[-1]
+                if should_stop and should_stop():
+                    break
+
+            with self.get_cursor() as cursor:
+                cursor.execute(
+                    "SELECT MAX(id) AS boundary FROM catalog_changes WHERE changed_at < %s AND id < %s",
+                    (datetime.now() - timedelta(days=retention_days), last)
+                )
+                purge_boundary = cursor.fetchone()['boundary']
+                if purge_boundary:
+                    # المؤشر يُرفع قبل الحذف في نفس transaction
+                    self.set_job_state(cursor, 'catalog_changes_purged_through', purge_boundary)
+                    cursor.execute("DELETE FROM catalog_changes WHERE id <= %s", (purge_boundary,))
+                    purged = cursor.rowcount
+        except self.Error as e:
+            logger.error(f"❌ Error compacting catalog changes: {e}")
+
+        if compacted or purged:
+            logger.info(f"✅ Catalog changes: {compacted} compacted, {purged} purged")
+        return compacted + purged
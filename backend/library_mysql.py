@@ -1,14 +1,23 @@
 import pymysql
 from pymysql import Error
 from contextlib import contextmanager
-import hashlib
 import os
 import logging
 
+from library_base import LibraryBackend, LOAN_ARCHIVE_FIRST_YEAR
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class LibraryManagementSystem:
+# أخطاء العميل عند تعذر الاتصال أو انقطاعه: 2002/2003 تعذر الاتصال، 2006 الخادم ذهب، 2013/2055 انقطع أثناء الاستعلام
+CONNECTION_ERRORS = {2002, 2003, 2006, 2013, 2055}
+
+class LibraryManagementSystem(LibraryBackend):
+    backend_name = 'mysql'
+    Error = Error
+    skip_locked = ' FOR UPDATE SKIP LOCKED'
+    for_update = ' FOR UPDATE'
+
     def __init__(self, credentials=None):
         # استخدام credentials من KMS أو .env
         if credentials:
@@ -34,16 +43,26 @@ class LibraryManagementSystem:
                 'cursorclass': pymysql.cursors.DictCursor,
                 'autocommit': False
             }
-        
+
         logger.info(f"Using MySQL at: {self.db_config['host']}:{self.db_config['port']}")
-    
+
+    def connect(self):
+        """فتح اتصال جديد بـ MySQL"""
+        return pymysql.connect(**self.db_config)
+
+    def is_outage_error(self, error):
+        # OperationalError تشمل أيضاً deadlock (1213) وانتهاء انتظار القفل (1205)
+        if isinstance(error, pymysql.err.InterfaceError):
+            return True
+        return isinstance(error, pymysql.err.OperationalError) and bool(error.args) and error.args[0] in CONNECTION_ERRORS
+
     def create_database_if_not_exists(self):
         """إنشاء قاعدة البيانات إذا لم تكن موجودة"""
         try:
             # اتصال بدون تحديد قاعدة بيانات
             temp_config = self.db_config.copy()
             temp_config.pop('database', None)
-            
+
             connection = pymysql.connect(**temp_config)
             with connection.cursor() as cursor:
                 cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.db_config['database']}")
@@ -52,17 +71,17 @@ class LibraryManagementSystem:
             connection.commit()
             connection.close()
             return True
-            
+
         except Error as e:
             logger.error(f"❌ Failed to create database: {e}")
             return False
-    
+
     @contextmanager
     def get_connection(self):
         """الحصول على اتصال بقاعدة البيانات"""
         connection = None
         try:
-            connection = pymysql.connect(**self.db_config)
+            connection = self.connect()
             logger.debug("Database connection established")
             yield connection
         except Error as e:
@@ -71,7 +90,7 @@ class LibraryManagementSystem:
             if e.args[0] == 1049:  # Unknown database
                 logger.info("Database doesn't exist, creating it...")
                 if self.create_database_if_not_exists():
-                    connection = pymysql.connect(**self.db_config)
+                    connection = self.connect()
                     yield connection
                 else:
                     raise
@@ -81,306 +100,236 @@ class LibraryManagementSystem:
             if connection:
                 connection.close()
                 logger.debug("Database connection closed")
-    
-    @contextmanager
-    def get_cursor(self):
-        """الحصول على cursor لإجراء الاستعلامات"""
-        with self.get_connection() as connection:
-            cursor = connection.cursor()
-            try:
-                yield cursor
-                connection.commit()
-                logger.debug("Transaction committed")
-            except Error as e:
-                connection.rollback()
-                logger.error(f"Transaction rolled back: {e}")
-                raise
-            finally:
-                cursor.close()
-    
-    def init_db(self):
-        """تهيئة قاعدة البيانات وإنشاء الجداول"""
-        try:
-            # أولاً: تأكد من وجود قاعدة البيانات
-            self.create_database_if_not_exists()
-            
-            with self.get_cursor() as cursor:
-                # إنشاء جدول المستخدمين
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        username VARCHAR(50) UNIQUE NOT NULL,
-                        password_hash VARCHAR(255) NOT NULL,
-                        role VARCHAR(20) NOT NULL,
-                        full_name VARCHAR(100) NOT NULL,
-                        email VARCHAR(100),
-                        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        INDEX idx_username (username)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-                """)
-                
-                # إنشاء جدول الكتب
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS books (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        title VARCHAR(255) NOT NULL,
-                        author VARCHAR(100) NOT NULL,
-                        year INT,
-                        available BOOLEAN DEFAULT TRUE,
-                        added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        INDEX idx_title (title),
-                        INDEX idx_author (author),
-                        INDEX idx_available (available)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-                """)
-                
-                # إنشاء جدول الكتب المستعارة
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS borrowed_books (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        book_id INT NOT NULL,
-                        borrower VARCHAR(100) NOT NULL,
-                        borrow_date DATE DEFAULT (CURRENT_DATE),
-                        return_date DATE,
-                        FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
-                        INDEX idx_book_id (book_id),
-                        INDEX idx_borrower (borrower)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-                """)
-                
-                logger.info("✅ Database tables created/verified successfully")
-                
-                # التحقق من وجود المستخدمين الافتراضيين
-                cursor.execute("SELECT COUNT(*) as count FROM users")
-                result = cursor.fetchone()
-                user_count = result['count'] if isinstance(result, dict) else result[0]
-                
-                if user_count == 0:
-                    logger.info("Adding demo users...")
-                    demo_users = [
-                        ('admin', self.hash_password('admin123'), 'admin', 'System Administrator', 'admin@library.com'),
-                        ('librarian', self.hash_password('lib123'), 'librarian', 'Library Manager', 'librarian@library.com'),
-                        ('user', self.hash_password('user123'), 'user', 'Regular User', 'user@library.com')
-                    ]
-                    
-                    for user in demo_users:
-                        cursor.execute(
-                            "INSERT IGNORE INTO users (username, password_hash, role, full_name, email) VALUES (%s, %s, %s, %s, %s)",
-                            user
-                        )
-                    logger.info("✅ Demo users added")
-                
-                # التحقق من وجود الكتب التجريبية
-                cursor.execute("SELECT COUNT(*) as count FROM books")
-                result = cursor.fetchone()
-                book_count = result['count'] if isinstance(result, dict) else result[0]
-                
-                if book_count == 0:
-                    logger.info("Adding demo books...")
-                    demo_books = [
-                        ('The Great Gatsby', 'F. Scott Fitzgerald', 1925),
-                        ('To Kill a Mockingbird', 'Harper Lee', 1960),
-                        ('1984', 'George Orwell', 1949),
-                        ('Pride and Prejudice', 'Jane Austen', 1813),
-                        ('The Catcher in the Rye', 'J.D. Salinger', 1951)
-                    ]
-                    
-                    for book in demo_books:
-                        cursor.execute(
-                            "INSERT IGNORE INTO books (title, author, year) VALUES (%s, %s, %s)",
-                            book
-                        )
-                    logger.info("✅ Demo books added")
-                
-                return True
-                
-        except Error as e:
-            logger.error(f"❌ Error initializing database: {e}")
-            return False
-    
-    def hash_password(self, password):
-        """تجزئة كلمة المرور"""
-        return hashlib.sha256(password.encode()).hexdigest()
-    
-    def authenticate_user(self, username, password):
-        """مصادقة المستخدم"""
-        try:
-            with self.get_cursor() as cursor:
-                query = "SELECT id, username, password_hash, role, full_name FROM users WHERE username = %s"
-                cursor.execute(query, (username,))
-                user = cursor.fetchone()
-                
-                if user:
-                    input_password_hash = self.hash_password(password)
-                    if input_password_hash == user['password_hash']:
-                        logger.info(f"✅ User {username} authenticated")
-                        return {
-                            "id": user['id'],
-                            "username": user['username'],
-                            "role": user['role'],
-                            "full_name": user['full_name']
-                        }
-        except Error as e:
-            logger.error(f"❌ Authentication error: {e}")
-        return None
-    
-    def get_all_books(self):
-        """الحصول على جميع الكتب"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("SELECT id, title, author, year, available FROM books ORDER BY title")
-                return cursor.fetchall()
-        except Error as e:
-            logger.error(f"❌ Error getting books: {e}")
-            return []
-    
-    def get_available_books(self):
-        """الحصول على الكتب المتاحة"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("SELECT id, title, author, year FROM books WHERE available = TRUE ORDER BY title")
-                return cursor.fetchall()
-        except Error as e:
-            logger.error(f"❌ Error getting available books: {e}")
-            return []
-    
-    def get_borrowed_books(self):
-        """الحصول على الكتب المستعارة"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("""
-                    SELECT b.id, b.title, b.author, bb.borrower, bb.borrow_date 
-                    FROM books b 
-                    JOIN borrowed_books bb ON b.id = bb.book_id 
-                    WHERE b.available = FALSE AND bb.return_date IS NULL
-                    ORDER BY bb.borrow_date DESC
-                """)
-                return cursor.fetchall()
-        except Error as e:
-            logger.error(f"❌ Error getting borrowed books: {e}")
-            return []
-    
-    def add_book(self, title, author, year=None):
-        """إضافة كتاب جديد"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("INSERT INTO books (title, author, year) VALUES (%s, %s, %s)", (title, author, year))
-                logger.info(f"✅ Book '{title}' added")
-                return True
-        except Error as e:
-            logger.error(f"❌ Error adding book: {e}")
-            return False
-    
-    def borrow_book(self, book_id, borrower_name):
-        """استعارة كتاب"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("SELECT available FROM books WHERE id = %s", (book_id,))
-                book = cursor.fetchone()
-                
-                if not book or not book['available']:
-                    return False
-                
-                cursor.execute("UPDATE books SET available = FALSE WHERE id = %s", (book_id,))
-                cursor.execute("INSERT INTO borrowed_books (book_id, borrower) VALUES (%s, %s)", (book_id, borrower_name))
-                logger.info(f"✅ Book {book_id} borrowed by {borrower_name}")
-                return True
-        except Error as e:
-            logger.error(f"❌ Error borrowing book: {e}")
-            return False
-    
-    def return_book(self, book_id):
-        """إرجاع كتاب"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("SELECT available FROM books WHERE id = %s", (book_id,))
-                book = cursor.fetchone()
-                
-                if book and book['available']:
-                    return False
-                
-                cursor.execute("UPDATE books SET available = TRUE WHERE id = %s", (book_id,))
-                cursor.execute("UPDATE borrowed_books SET return_date = CURRENT_DATE WHERE book_id = %s AND return_date IS NULL", (book_id,))
-                logger.info(f"✅ Book {book_id} returned")
-                return True
-        except Error as e:
-            logger.error(f"❌ Error returning book: {e}")
-            return False
-    
-    def search_books(self, query):
-        """بحث عن الكتب"""
-        try:
-            with self.get_cursor() as cursor:
-                search_query = f"%{query}%"
-                cursor.execute("""
-                    SELECT id, title, author, year, available 
-                    FROM books 
-                    WHERE title LIKE %s OR author LIKE %s
-                    ORDER BY title
-                """, (search_query, search_query))
-                return cursor.fetchall()
-        except Error as e:
-            logger.error(f"❌ Error searching books: {e}")
-            return []
-    
-    def get_total_books(self):
-        """الحصول على إجمالي عدد الكتب"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("SELECT COUNT(*) as count FROM books")
-                result = cursor.fetchone()
-                return result['count'] if isinstance(result, dict) else result[0]
-        except Error as e:
-            logger.error(f"❌ Error getting total books: {e}")
-            return 0
-    
-    def get_available_books_count(self):
-        """الحصول على عدد الكتب المتاحة"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("SELECT COUNT(*) as count FROM books WHERE available = TRUE")
-                result = cursor.fetchone()
-                return result['count'] if isinstance(result, dict) else result[0]
-        except Error as e:
-            logger.error(f"❌ Error getting available books count: {e}")
-            return 0
-    
-    def get_borrowed_books_count(self):
-        """الحصول على عدد الكتب المستعارة"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("SELECT COUNT(*) as count FROM books WHERE available = FALSE")
-                result = cursor.fetchone()
-                return result['count'] if isinstance(result, dict) else result[0]
-        except Error as e:
-            logger.error(f"❌ Error getting borrowed books count: {e}")
-            return 0
-    
-    def create_user(self, username, password, role, full_name, email):
-        """إنشاء مستخدم جديد"""
+
+    def stream_cursor(self, connection, tuples=False):
+        """SSCursor / SSDictCursor: الصفوف تُقرأ من الخادم عند الحاجة"""
+        return connection.cursor(pymysql.cursors.SSCursor if tuples else pymysql.cursors.SSDictCursor)
+
+    def tuple_cursor(self, connection):
+        return connection.cursor(pymysql.cursors.Cursor)
+
+    def schema_statements(self):
+        """جداول MySQL"""
+        return [
+            # إنشاء جدول المستخدمين
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                role VARCHAR(20) NOT NULL,
+                full_name VARCHAR(100) NOT NULL,
+                email VARCHAR(100),
+                created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_username (username)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # إنشاء جدول الكتب
+            """
+            CREATE TABLE IF NOT EXISTS books (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                title VARCHAR(255) NOT NULL,
+                author VARCHAR(100) NOT NULL,
+                year INT,
+                available BOOLEAN DEFAULT TRUE,
+                added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                decade INT
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # إنشاء جدول الكتب المستعارة
+            """
+            CREATE TABLE IF NOT EXISTS borrowed_books (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                book_id INT NOT NULL,
+                user_id INT,
+                borrower VARCHAR(100) NOT NULL,
+                borrow_date DATE DEFAULT (CURRENT_DATE),
+                return_date DATE,
+                due_date DATE,
+                overdue_days INT,
+                fine_amount DECIMAL(10, 2),
+                FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # أرشيف الإعارات المغلقة، مقسم حسب سنة الإعارة (الجداول المقسمة لا تدعم المفاتيح الأجنبية)
+            f"""
+            CREATE TABLE IF NOT EXISTS borrowed_books_archive (
+                id INT NOT NULL,
+                book_id INT NOT NULL,
+                user_id INT,
+                borrower VARCHAR(100) NOT NULL,
+                borrow_date DATE NOT NULL,
+                return_date DATE,
+                due_date DATE,
+                overdue_days INT,
+                fine_amount DECIMAL(10, 2),
+                archived_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, borrow_date)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            PARTITION BY RANGE COLUMNS (borrow_date) (
+                PARTITION p_old VALUES LESS THAN ('{LOAN_ARCHIVE_FIRST_YEAR}-01-01'),
+                PARTITION pmax VALUES LESS THAN (MAXVALUE)
+            )
+            """,
+            # طوابير حجز الكتب المُعارة
+            """
+            CREATE TABLE IF NOT EXISTS holds (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                book_id INT NOT NULL,
+                user_id INT NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                placed_at DATETIME NOT NULL,
+                ready_at DATETIME,
+                expires_at DATETIME,
+                FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # سجل تغييرات الكتالوج للمزامنة التزايدية (بدون مفتاح أجنبي: الحذف يُسجل أيضاً)
+            """
+            CREATE TABLE IF NOT EXISTS catalog_changes (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                book_id INT NOT NULL,
+                op VARCHAR(10) NOT NULL,
+                title VARCHAR(255),
+                author VARCHAR(100),
+                year INT,
+                available BOOLEAN,
+                changed_at DATETIME NOT NULL
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # قيم صغيرة مشتركة بين المهام (مؤشرات، آخر معالجة)
+            """
+            CREATE TABLE IF NOT EXISTS job_state (
+                name VARCHAR(100) PRIMARY KEY,
+                value BIGINT NOT NULL DEFAULT 0,
+                updated_at DATETIME
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # عدادات التصفح لكل مؤلف وعقد (و 'all' للمجموع)، تُحدث مع كل تغيير في books
+            """
+            CREATE TABLE IF NOT EXISTS book_facets (
+                facet VARCHAR(10) NOT NULL,
+                value VARCHAR(100) NOT NULL,
+                total INT NOT NULL DEFAULT 0,
+                available INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (facet, value)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # "استُعير معه": أقرب الكتب لكل كتاب بالترتيب، تكتبها recommend.py وتُقرأ بالمفتاح الأساسي
+            """
+            CREATE TABLE IF NOT EXISTS book_neighbours (
+                book_id INT NOT NULL,
+                position SMALLINT NOT NULL,
+                neighbour_id INT NOT NULL,
+                score FLOAT NOT NULL,
+                together INT NOT NULL,
+                PRIMARY KEY (book_id, position)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # ملخصات الإعارة اليومية لـ analytics.py: عدادات اليوم ومسودة HyperLogLog للمستعيرين المختلفين
+            """
+            CREATE TABLE IF NOT EXISTS loan_daily (
+                day DATE PRIMARY KEY,
+                loans INT NOT NULL DEFAULT 0,
+                returns INT NOT NULL DEFAULT 0,
+                loan_days BIGINT NOT NULL DEFAULT 0,
+                borrowers INT NOT NULL DEFAULT 0,
+                borrowers_hll BLOB
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # الإعارات لكل مؤلف ودور، بدقة يوم ('d') وشهر ('m') حتى تقرأ النطاقات الطويلة صفوفاً شهرية
+            """
+            CREATE TABLE IF NOT EXISTS loan_rollups (
+                grain CHAR(1) NOT NULL,
+                dimension VARCHAR(10) NOT NULL,
+                day DATE NOT NULL,
+                value VARCHAR(100) NOT NULL,
+                loans INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (grain, dimension, day, value)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+        ]
+
+    def ensure_archive_partitions(self, cursor, through_year):
+        """تقسيم pmax إلى أقسام سنوية ناقصة (pmax فارغ عادةً فالعملية سريعة)"""
+        cursor.execute("""
+            SELECT partition_name FROM information_schema.partitions
+            WHERE table_schema = DATABASE() AND table_name = 'borrowed_books_archive'
+        """)
+        existing = {row['partition_name'] for row in cursor.fetchall()}
+        missing = [year for year in range(LOAN_ARCHIVE_FIRST_YEAR, through_year + 1) if f"p{year}" not in existing]
+        if not missing:
+            return
+        partitions = ', '.join(f"PARTITION p{year} VALUES LESS THAN ('{year + 1}-01-01')" for year in missing)
+        cursor.execute(
+            f"ALTER TABLE borrowed_books_archive REORGANIZE PARTITION pmax INTO "
+            f"({partitions}, PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+        )
+        logger.info(f"✅ Added archive partitions {missing[0]}..{missing[-1]}")
+
+    def index_exists(self, cursor, table, name):
+        cursor.execute("""
+            SELECT COUNT(*) AS count FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """, (table, name))
+        return cursor.fetchone()['count'] > 0
+
+    def drop_index_sql(self, table, name):
+        return f"DROP INDEX {name} ON {table}"
+
+    def add_column_sql(self, table, column, definition):
+        """MySQL يتجاهل REFERENCES داخل تعريف العمود، فيُضاف المفتاح الأجنبي كبند مستقل"""
+        if ' REFERENCES ' not in f" {definition}":
+            return super().add_column_sql(table, column, definition)
+        column_type, reference = definition.split('REFERENCES', 1)
+        return f"ALTER TABLE {table} ADD COLUMN {column} {column_type.strip()}, ADD FOREIGN KEY ({column}) REFERENCES {reference.strip()}"
+
+    def explain_plan(self, cursor, query, args=None):
+        """EXPLAIN التقليدي: type=ALL مسح كامل و Extra يوضح الفرز والجداول المؤقتة"""
+        cursor.execute(f"EXPLAIN {query}", args)
+        issues = []
+        for row in cursor.fetchall():
+            table = row.get('table')
+            extra = row.get('Extra') or ''
+            if row.get('type') == 'ALL':
+                issues.append(('full_scan', f"{table}: rows={row.get('rows')}"))
+            elif row.get('type') == 'index':
+                issues.append(('full_index_scan', f"{table} via {row.get('key')}: rows={row.get('rows')}"))
+            if 'Using filesort' in extra:
+                issues.append(('filesort', f"{table}: {extra}"))
+            if 'Using temporary' in extra:
+                issues.append(('temporary', f"{table}: {extra}"))
+        return issues
+
+    def lock_connection(self):
+        """GET_LOCK لا يحتاج قاعدة بيانات، فيعمل حتى قبل create_database_if_not_exists"""
+        config = self.db_config.copy()
+        config.pop('database', None)
+        config['autocommit'] = True
+        return pymysql.connect(**config)
+
+    def _lock_name(self, name):
+        # أقفال GET_LOCK مشتركة على مستوى الخادم كله، وطول الاسم 64 حرفاً كحد أقصى
+        return f"{self.db_config['database']}.{name}"[:64]
+
+    def try_advisory_lock(self, connection, name, timeout=0):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT GET_LOCK(%s, %s) AS acquired", (self._lock_name(name), timeout))
+            return cursor.fetchone()['acquired'] == 1
+
+    def release_advisory_lock(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (self._lock_name(name),))
+
+    def advisory_lock_alive(self, connection):
         try:
-            password_hash = self.hash_password(password)
-            with self.get_cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO users (username, password_hash, role, full_name, email) VALUES (%s, %s, %s, %s, %s)",
-                    (username, password_hash, role, full_name, email)
-                )
-                logger.info(f"✅ User {username} created")
-                return True
-        except Error as e:
-            logger.error(f"❌ Error creating user: {e}")
+            connection.ping(reconnect=False)
+            return True
+        except Error:
             return False
-    
-    def get_all_users(self):
-        """الحصول على جميع المستخدمين"""
-        try:
-            with self.get_cursor() as cursor:
-                cursor.execute("""
-                    SELECT id, username, role, full_name, email, created_date 
-                    FROM users 
-                    ORDER BY created_date DESC
-                """)
-                return cursor.fetchall()
-        except Error as e:
-            logger.error(f"❌ Error getting users: {e}")
-            return []
+
+    def insert_ignore_sql(self, table, columns):
+        placeholders = ', '.join(['%s'] * len(columns))
+        return f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
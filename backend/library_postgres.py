@@ -0,0 +1,284 @@
+import psycopg2
+import psycopg2.extras
+import itertools
+import hashlib
+import os
+import logging
+import time
+
+from library_base import LibraryBackend, LOAN_ARCHIVE_FIRST_YEAR
+
+# إعداد التسجيل
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_stream_ids = itertools.count(1)
+
+class LibraryManagementSystem(LibraryBackend):
+    backend_name = 'postgresql'
+    Error = psycopg2.Error
+    like_operator = 'ILIKE'
+    skip_locked = ' FOR UPDATE SKIP LOCKED'
+    for_update = ' FOR UPDATE'
+
+    def __init__(self, credentials=None):
+        # استخدام credentials من DATABASE_URL أو .env
+        credentials = credentials or {}
+        self.db_config = {
+            'host': credentials.get('DB_HOST', os.getenv('DB_HOST', 'localhost')),
+            'dbname': credentials.get('DB_NAME', os.getenv('DB_NAME', 'library_db')),
+            'user': credentials.get('DB_USER', os.getenv('DB_USER', 'library_user')),
+            'password': credentials.get('DB_PASSWORD', os.getenv('DB_PASSWORD', '')),
+            'port': int(credentials.get('DB_PORT', os.getenv('DB_PORT', 5432)))
+        }
+        logger.info(f"Using PostgreSQL at: {self.db_config['host']}:{self.db_config['port']}")
+
+    def connect(self):
+        """فتح اتصال جديد بـ PostgreSQL"""
+        return psycopg2.connect(cursor_factory=psycopg2.extras.RealDictCursor, **self.db_config)
+
+    def is_outage_error(self, error):
+        # بدون pgcode: فشل الاتصال نفسه في العميل؛ الفئة 08 وإيقاف الخادم (57P01-57P03) من الخادم.
+        # deadlock وانتهاء مهلة القفل OperationalError أيضاً لكن لها pgcode آخر
+        if isinstance(error, psycopg2.InterfaceError):
+            return True
+        if not isinstance(error, psycopg2.OperationalError):
+            return False
+        code = error.pgcode
+        return code is None or code.startswith('08') or code in ('57P01', '57P02', '57P03')
+
+    def stream_cursor(self, connection, tuples=False):
+        """named cursor: PostgreSQL يحتفظ بالنتيجة على الخادم ويرسلها على دفعات"""
+        factory = psycopg2.extensions.cursor if tuples else psycopg2.extras.RealDictCursor
+        cursor = connection.cursor(name=f"stream_{next(_stream_ids)}", cursor_factory=factory)
+        cursor.itersize = 5000
+        return cursor
+
+    def tuple_cursor(self, connection):
+        return connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+
+    def insert_many(self, cursor, table, columns, rows, ignore=False):
+        """execute_values يرسل الدفعة كعبارة INSERT واحدة متعددة الصفوف"""
+        conflict = " ON CONFLICT DO NOTHING" if ignore else ""
+        psycopg2.extras.execute_values(
+            cursor, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s{conflict}", rows, page_size=1000
+        )
+
+    def insert_returning_id(self, cursor, query, args):
+        """lastrowid لا يعمل في PostgreSQL، فنستخدم RETURNING"""
+        cursor.execute(f"{query} RETURNING id", args)
+        return cursor.fetchone()['id']
+
+    def reset_id_sequence(self, cursor, table):
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))"
+        )
+
+    def schema_statements(self):
+        """جداول PostgreSQL"""
+        return [
+            # إنشاء جدول المستخدمين
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                role VARCHAR(20) NOT NULL CHECK (role IN ('admin', 'librarian', 'user')),
+                full_name VARCHAR(100) NOT NULL,
+                email VARCHAR(100),
+                created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # إنشاء جدول الكتب
+            """
+            CREATE TABLE IF NOT EXISTS books (
+                id SERIAL PRIMARY KEY,
+                title VARCHAR(255) NOT NULL,
+                author VARCHAR(100) NOT NULL,
+                year INTEGER,
+                available BOOLEAN DEFAULT TRUE,
+                added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                decade INTEGER
+            )
+            """,
+            # إنشاء جدول الكتب المستعارة
+            """
+            CREATE TABLE IF NOT EXISTS borrowed_books (
+                id SERIAL PRIMARY KEY,
+                book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+                user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                borrower VARCHAR(100) NOT NULL,
+                borrow_date DATE DEFAULT CURRENT_DATE,
+                return_date DATE,
+                due_date DATE,
+                overdue_days INTEGER,
+                fine_amount NUMERIC(10, 2)
+            )
+            """,
+            # إعارة مفتوحة واحدة فقط لكل كتاب
+            "CREATE UNIQUE INDEX IF NOT EXISTS unique_active_borrow ON borrowed_books (book_id) WHERE return_date IS NULL",
+            # أرشيف الإعارات المغلقة، مقسم حسب تاريخ الإعارة
+            """
+            CREATE TABLE IF NOT EXISTS borrowed_books_archive (
+                id INTEGER NOT NULL,
+                book_id INTEGER NOT NULL,
+                user_id INTEGER,
+                borrower VARCHAR(100) NOT NULL,
+                borrow_date DATE NOT NULL,
+                return_date DATE,
+                due_date DATE,
+                overdue_days INTEGER,
+                fine_amount NUMERIC(10, 2),
+                archived_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, borrow_date)
+            ) PARTITION BY RANGE (borrow_date)
+            """,
+            "CREATE TABLE IF NOT EXISTS borrowed_books_archive_default PARTITION OF borrowed_books_archive DEFAULT",
+            # طوابير حجز الكتب المُعارة
+            """
+            CREATE TABLE IF NOT EXISTS holds (
+                id SERIAL PRIMARY KEY,
+                book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                status VARCHAR(20) NOT NULL CHECK (status IN ('waiting', 'ready', 'fulfilled', 'cancelled', 'expired')),
+                placed_at TIMESTAMP NOT NULL,
+                ready_at TIMESTAMP,
+                expires_at TIMESTAMP
+            )
+            """,
+            # سجل تغييرات الكتالوج للمزامنة التزايدية (بدون مفتاح أجنبي: الحذف يُسجل أيضاً)
+            """
+            CREATE TABLE IF NOT EXISTS catalog_changes (
+                id BIGSERIAL PRIMARY KEY,
+                book_id INTEGER NOT NULL,
+                op VARCHAR(10) NOT NULL,
+                title VARCHAR(255),
+                author VARCHAR(100),
+                year INTEGER,
+                available BOOLEAN,
+                changed_at TIMESTAMP NOT NULL
+            )
+            """,
+            # قيم صغيرة مشتركة بين المهام (مؤشرات، آخر معالجة)
+            """
+            CREATE TABLE IF NOT EXISTS job_state (
+                name VARCHAR(100) PRIMARY KEY,
+                value BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP
+            )
+            """,
+            # عدادات التصفح لكل مؤلف وعقد (و 'all' للمجموع)، تُحدث مع كل تغيير في books
+            """
+            CREATE TABLE IF NOT EXISTS book_facets (
+                facet VARCHAR(10) NOT NULL,
+                value VARCHAR(100) NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                available INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (facet, value)
+            )
+            """,
+            # "استُعير معه": أقرب الكتب لكل كتاب بالترتيب، تكتبها recommend.py وتُقرأ بالمفتاح الأساسي
+            """
+            CREATE TABLE IF NOT EXISTS book_neighbours (
+                book_id INTEGER NOT NULL,
+                position SMALLINT NOT NULL,
+                neighbour_id INTEGER NOT NULL,
+                score REAL NOT NULL,
+                together INTEGER NOT NULL,
+                PRIMARY KEY (book_id, position)
+            )
+            """,
+            # ملخصات الإعارة اليومية لـ analytics.py: عدادات اليوم ومسودة HyperLogLog للمستعيرين المختلفين
+            """
+            CREATE TABLE IF NOT EXISTS loan_daily (
+                day DATE PRIMARY KEY,
+                loans INTEGER NOT NULL DEFAULT 0,
+                returns INTEGER NOT NULL DEFAULT 0,
+                loan_days BIGINT NOT NULL DEFAULT 0,
+                borrowers INTEGER NOT NULL DEFAULT 0,
+                borrowers_hll BYTEA
+            )
+            """,
+            # الإعارات لكل مؤلف ودور، بدقة يوم ('d') وشهر ('m') حتى تقرأ النطاقات الطويلة صفوفاً شهرية
+            """
+            CREATE TABLE IF NOT EXISTS loan_rollups (
+                grain CHAR(1) NOT NULL,
+                dimension VARCHAR(10) NOT NULL,
+                day DATE NOT NULL,
+                value VARCHAR(100) NOT NULL,
+                loans INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (grain, dimension, day, value)
+            )
+            """,
+        ]
+
+    def ensure_archive_partitions(self, cursor, through_year):
+        """قسم لكل سنة، والقسم الافتراضي يستقبل ما قبل LOAN_ARCHIVE_FIRST_YEAR"""
+        for year in range(LOAN_ARCHIVE_FIRST_YEAR, through_year + 1):
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS borrowed_books_archive_y{year} PARTITION OF borrowed_books_archive "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            )
+
+    def index_exists(self, cursor, table, name):
+        cursor.execute(
+            "SELECT COUNT(*) AS count FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s AND indexname = %s",
+            (table, name)
+        )
+        return cursor.fetchone()['count'] > 0
+
+    def explain_plan(self, cursor, query, args=None):
+        """EXPLAIN (FORMAT JSON): البحث في شجرة الخطة عن Seq Scan و Sort"""
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", args)
+        plan = cursor.fetchone()['QUERY PLAN'][0]['Plan']
+        issues = []
+        stack = [plan]
+        while stack:
+            node = stack.pop()
+            node_type = node.get('Node Type')
+            if node_type == 'Seq Scan':
+                issues.append(('full_scan', f"{node.get('Relation Name')}: rows={node.get('Plan Rows')}"))
+            elif node_type in ('Sort', 'Incremental Sort'):
+                issues.append(('filesort', f"sort on {', '.join(node.get('Sort Key', []))}"))
+            elif node_type in ('Materialize', 'HashAggregate'):
+                issues.append(('temporary', node_type))
+            stack.extend(node.get('Plans', []))
+        return issues
+
+    def lock_connection(self):
+        connection = self.connect()
+        connection.autocommit = True
+        return connection
+
+    @staticmethod
+    def _lock_key(name):
+        # مفتاح bigint ثابت لكل اسم
+        return int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], 'big', signed=True)
+
+    def try_advisory_lock(self, connection, name, timeout=0):
+        """قفل استشاري على مستوى الجلسة، يُحرر تلقائياً إذا انقطع الاتصال"""
+        deadline = time.monotonic() + timeout
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute("SELECT pg_try_advisory_lock(%s) AS acquired", (self._lock_key(name),))
+                if cursor.fetchone()['acquired']:
+                    return True
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.2)
+
+    def release_advisory_lock(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (self._lock_key(name),))
+
+    def advisory_lock_alive(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def insert_ignore_sql(self, table, columns):
+        placeholders = ', '.join(['%s'] * len(columns))
+        return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT DO NOTHING"
@@ -0,0 +1,296 @@
+import sqlite3
+import threading
+import itertools
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+import os
+import logging
+
+from library_base import LibraryBackend
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# تحويل التواريخ صراحةً بدلاً من المحولات الافتراضية (deprecated منذ Python 3.12)
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+_memory_ids = itertools.count(1)
+
+
+def _translate(query):
+    """تحويل علامات %s الخاصة بـ MySQL/PostgreSQL إلى علامات SQLite"""
+    return query.replace('%s', '?').replace('%%', '%')
+
+
+def _dict_row(cursor, row):
+    return {column[0]: row[index] for index, column in enumerate(cursor.description)}
+
+
+class _Cursor(sqlite3.Cursor):
+    """cursor يقبل نفس صيغة الاستعلامات المستخدمة في باقي المحركات"""
+
+    def execute(self, query, args=None):
+        return super().execute(_translate(query), args if args is not None else ())
+
+    def executemany(self, query, seq_of_args):
+        return super().executemany(_translate(query), seq_of_args)
+
+
+class _Connection(sqlite3.Connection):
+    def cursor(self, factory=_Cursor):
+        return super().cursor(factory)
+
+
+class LibraryManagementSystem(LibraryBackend):
+    backend_name = 'sqlite'
+    Error = sqlite3.Error
+
+    def __init__(self, credentials=None):
+        credentials = credentials or {}
+        path = credentials.get('DB_PATH') or os.getenv('SQLITE_PATH', 'library.db')
+        self.db_config = {
+            'path': path,
+            'cache_size_kb': int(credentials.get('SQLITE_CACHE_KB', os.getenv('SQLITE_CACHE_KB', 16384))),
+            'mmap_size': int(credentials.get('SQLITE_MMAP_SIZE', os.getenv('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))),
+            'busy_timeout_ms': int(credentials.get('SQLITE_BUSY_TIMEOUT_MS', os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))),
+        }
+        self._local = threading.local()
+        self._keeper = None
+
+        if path == ':memory:':
+            # قاعدة بيانات في الذاكرة مشتركة بين كل الاتصالات، تبقى ما دام اتصال keeper مفتوحاً
+            self._uri = f"file:library_memory_{next(_memory_ids)}?mode=memory&cache=shared"
+            self._keeper = self.connect()
+        else:
+            self._uri = None
+            with self.get_connection() as connection:
+                # WAL يسمح بالقراءة أثناء الكتابة، ويُحفظ في ملف القاعدة
+                connection.execute("PRAGMA journal_mode = WAL")
+
+        logger.info(f"Using SQLite at: {path}")
+
+    def connect(self):
+        """فتح اتصال جديد بـ SQLite مع إعدادات الأداء"""
+        if self._uri:
+            connection = sqlite3.connect(self._uri, uri=True, factory=_Connection,
+                                         detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        else:
+            connection = sqlite3.connect(self.db_config['path'], factory=_Connection,
+                                         detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                                         timeout=self.db_config['busy_timeout_ms'] / 1000.0)
+        connection.row_factory = _dict_row
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        connection.execute(f"PRAGMA busy_timeout = {self.db_config['busy_timeout_ms']}")
+        connection.execute(f"PRAGMA cache_size = -{self.db_config['cache_size_kb']}")
+        connection.execute(f"PRAGMA mmap_size = {self.db_config['mmap_size']}")
+        return connection
+
+    def is_outage_error(self, error):
+        # OperationalError تشمل أخطاء الصياغة و "no such table" و "database is locked"، فالتمييز بالرسالة
+        if not isinstance(error, sqlite3.OperationalError):
+            return False
+        message = str(error).lower()
+        return 'unable to open' in message or 'disk i/o' in message
+
+    @contextmanager
+    def get_connection(self):
+        """اتصال واحد لكل thread يُعاد استخدامه حتى تبقى ذاكرة الصفحات ساخنة"""
+        if getattr(self._local, 'busy', False):
+            # استدعاء متداخل: اتصال مؤقت مستقل حتى لا يتداخل commit الداخلي مع الخارجي
+            connection = self.connect()
+            try:
+                yield connection
+            finally:
+                connection.close()
+            return
+
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self.connect()
+            self._local.connection = connection
+        self._local.busy = True
+        try:
+            yield connection
+        except self.Error as e:
+            logger.error(f"Database connection error: {e}")
+            raise
+        finally:
+            if connection.in_transaction:
+                connection.rollback()
+            self._local.busy = False
+
+    def tuple_cursor(self, connection):
+        """بدون row_factory: sqlite3 يبني الـ tuple في C"""
+        cursor = connection.cursor()
+        cursor.row_factory = None
+        return cursor
+
+    def schema_statements(self):
+        """جداول SQLite"""
+        return [
+            # إنشاء جدول المستخدمين
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                role VARCHAR(20) NOT NULL,
+                full_name VARCHAR(100) NOT NULL,
+                email VARCHAR(100),
+                created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # إنشاء جدول الكتب
+            """
+            CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY,
+                title VARCHAR(255) NOT NULL,
+                author VARCHAR(100) NOT NULL,
+                year INTEGER,
+                available BOOLEAN DEFAULT TRUE,
+                added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                decade INTEGER
+            )
+            """,
+            # إنشاء جدول الكتب المستعارة
+            """
+            CREATE TABLE IF NOT EXISTS borrowed_books (
+                id INTEGER PRIMARY KEY,
+                book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+                user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                borrower VARCHAR(100) NOT NULL,
+                borrow_date DATE DEFAULT CURRENT_DATE,
+                return_date DATE,
+                due_date DATE,
+                overdue_days INTEGER,
+                fine_amount DECIMAL(10, 2)
+            )
+            """,
+            # أرشيف الإعارات المغلقة (SQLite لا يدعم التقسيم، الفهرس على book_id يكفي)
+            """
+            CREATE TABLE IF NOT EXISTS borrowed_books_archive (
+                id INTEGER NOT NULL,
+                book_id INTEGER NOT NULL,
+                user_id INTEGER,
+                borrower VARCHAR(100) NOT NULL,
+                borrow_date DATE NOT NULL,
+                return_date DATE,
+                due_date DATE,
+                overdue_days INTEGER,
+                fine_amount DECIMAL(10, 2),
+                archived_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, borrow_date)
+            )
+            """,
+            # طوابير حجز الكتب المُعارة
+            """
+            CREATE TABLE IF NOT EXISTS holds (
+                id INTEGER PRIMARY KEY,
+                book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                status VARCHAR(20) NOT NULL,
+                placed_at TIMESTAMP NOT NULL,
+                ready_at TIMESTAMP,
+                expires_at TIMESTAMP
+            )
+            """,
+            # سجل تغييرات الكتالوج للمزامنة التزايدية؛ AUTOINCREMENT يمنع إعادة استخدام المؤشرات
+            """
+            CREATE TABLE IF NOT EXISTS catalog_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                book_id INTEGER NOT NULL,
+                op VARCHAR(10) NOT NULL,
+                title VARCHAR(255),
+                author VARCHAR(100),
+                year INTEGER,
+                available BOOLEAN,
+                changed_at TIMESTAMP NOT NULL
+            )
+            """,
+            # قيم صغيرة مشتركة بين المهام (مؤشرات، آخر معالجة)
+            """
+            CREATE TABLE IF NOT EXISTS job_state (
+                name VARCHAR(100) PRIMARY KEY,
+                value BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP
+            )
+            """,
+            # عدادات التصفح لكل مؤلف وعقد (و 'all' للمجموع)، تُحدث مع كل تغيير في books
+            """
+            CREATE TABLE IF NOT EXISTS book_facets (
+                facet VARCHAR(10) NOT NULL,
+                value VARCHAR(100) NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                available INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (facet, value)
+            )
+            """,
+            # "استُعير معه": أقرب الكتب لكل كتاب بالترتيب، تكتبها recommend.py وتُقرأ بالمفتاح الأساسي
+            """
+            CREATE TABLE IF NOT EXISTS book_neighbours (
+                book_id INTEGER NOT NULL,
+                position SMALLINT NOT NULL,
+                neighbour_id INTEGER NOT NULL,
+                score REAL NOT NULL,
+                together INTEGER NOT NULL,
+                PRIMARY KEY (book_id, position)
+            )
+            """,
+            # ملخصات الإعارة اليومية لـ analytics.py: عدادات اليوم ومسودة HyperLogLog للمستعيرين المختلفين
+            """
+            CREATE TABLE IF NOT EXISTS loan_daily (
+                day DATE PRIMARY KEY,
+                loans INTEGER NOT NULL DEFAULT 0,
+                returns INTEGER NOT NULL DEFAULT 0,
+                loan_days BIGINT NOT NULL DEFAULT 0,
+                borrowers INTEGER NOT NULL DEFAULT 0,
+                borrowers_hll BLOB
+            )
+            """,
+            # الإعارات لكل مؤلف ودور، بدقة يوم ('d') وشهر ('m') حتى تقرأ النطاقات الطويلة صفوفاً شهرية
+            """
+            CREATE TABLE IF NOT EXISTS loan_rollups (
+                grain CHAR(1) NOT NULL,
+                dimension VARCHAR(10) NOT NULL,
+                day DATE NOT NULL,
+                value VARCHAR(100) NOT NULL,
+                loans INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (grain, dimension, day, value)
+            )
+            """,
+        ]
+
+    def index_exists(self, cursor, table, name):
+        cursor.execute(
+            "SELECT COUNT(*) AS count FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+            (table, name)
+        )
+        return cursor.fetchone()['count'] > 0
+
+    def explain_plan(self, cursor, query, args=None):
+        """EXPLAIN QUERY PLAN: SCAN بدون فهرس مسح كامل، و TEMP B-TREE فرز أو تجميع مؤقت"""
+        cursor.execute(f"EXPLAIN QUERY PLAN {query}", args)
+        issues = []
+        for row in cursor.fetchall():
+            detail = row['detail']
+            if detail.startswith('SCAN '):
+                if ' INDEX ' in detail:
+                    issues.append(('full_index_scan', detail))
+                else:
+                    issues.append(('full_scan', detail))
+            elif 'TEMP B-TREE FOR ORDER BY' in detail or 'TEMP B-TREE FOR RIGHT PART OF ORDER BY' in detail:
+                issues.append(('filesort', detail))
+            elif 'TEMP B-TREE' in detail:
+                issues.append(('temporary', detail))
+        return issues
+
+    def insert_ignore_sql(self, table, columns):
+        placeholders = ', '.join(['%s'] * len(columns))
+        return f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+نقل البيانات بين محركات قواعد البيانات (PostgreSQL <-> MySQL <-> SQLite) على أجزاء متوازية
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from multiprocessing import Pool
+
+from dotenv import load_dotenv
+
+import backends
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# الترتيب مهم: borrowed_books تشير إلى books
+TABLES = ['users', 'books', 'borrowed_books', 'borrowed_books_archive', 'holds', 'catalog_changes']
+
+# أعمدة لها أسماء مختلفة بين المخططات (database/init.sql مقابل library_*.py)
+COLUMN_ALIASES = {
+    'books': [('created_date', 'added_date')],
+}
+
+# قيم بديلة لأعمدة تقبل NULL في المخطط القديم وهي NOT NULL في الجديد
+NULL_DEFAULTS = {
+    'users': {'full_name': ''},
+    'borrowed_books': {'borrower': ''},
+    'borrowed_books_archive': {'borrower': ''},
+}
+
+# MySQL يعيد BOOLEAN كرقم، و PostgreSQL لا يقبل رقماً في عمود boolean
+BOOLEAN_COLUMNS = {
+    'books': {'available'},
+    'catalog_changes': {'available'},
+}
+
+DEFAULT_CHECKPOINT = 'migration_checkpoint.json'
+
+
+def build_column_map(table, source_columns, target_columns):
+    """ربط أعمدة المصدر بأعمدة الهدف: الاسم نفسه أولاً ثم الأسماء البديلة"""
+    target_set = set(target_columns)
+    mapping = []
+    for column in source_columns:
+        if column in target_set:
+            mapping.append((column, column))
+            continue
+        for left, right in COLUMN_ALIASES.get(table, []):
+            alias = right if column == left else left if column == right else None
+            if alias and alias in target_set:
+                mapping.append((column, alias))
+                break
+        else:
+            logger.warning(f"⚠️  {table}.{column} has no target column and will not be copied")
+    if ('id', 'id') not in mapping:
+        raise ValueError(f"{table} must have an id column on both sides")
+    return mapping
+
+
+def source_columns(source, table):
+    """أعمدة الجدول في المصدر، أو None إذا لم يكن فيه (المخطط القديم في database/init.sql)"""
+    try:
+        return source.table_columns(table)
+    except source.Error:
+        return None
+
+
+def normalize(value, boolean=False):
+    """تجهيز القيمة للكتابة: التواريخ بدون أجزاء الثانية لأن TIMESTAMP في MySQL يقرّبها"""
+    if value is None:
+        return None
+    if boolean:
+        return bool(value)
+    if isinstance(value, datetime):
+        return value.replace(microsecond=0, tzinfo=None)
+    return value
+
+
+def canonical(value):
+    """تمثيل نصي موحد بين المحركات لحساب البصمة"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, Decimal) and value == value.to_integral_value():
+        return str(int(value))
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+class ChunkChecksum:
+    """بصمة ترتيبية لصفوف جزء: sha256 على القيم بعد التوحيد"""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self.rows = 0
+
+    def update(self, values):
+        self._hash.update('\x1f'.join(canonical(v) for v in values).encode('utf-8'))
+        self._hash.update(b'\x1e')
+        self.rows += 1
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+_worker = {}
+
+
+def _init_worker(source_url, target_url):
+    _worker['source'] = backends.create_library_system(database_url=source_url)
+    _worker['target'] = backends.create_library_system(database_url=target_url)
+
+
+def copy_chunk(task):
+    """نسخ جزء [low, high) من جدول في transaction واحدة ثم التحقق منه"""
+    table, low, high = task[:3]
+    source, target = _worker['source'], _worker['target']
+    try:
+        return _copy_chunk(source, target, *task)
+    except (source.Error, target.Error) as e:
+        logger.error(f"❌ {table} [{low}, {high}) failed: {e}")
+        return {'table': table, 'low': low, 'high': high, 'rows': 0, 'checksum': None, 'verified': False}
+
+
+def _copy_chunk(source, target, table, low, high, mapping, batch_size):
+    source_columns = [s for s, _ in mapping]
+    target_columns = [t for _, t in mapping]
+    defaults = NULL_DEFAULTS.get(table, {})
+    booleans = BOOLEAN_COLUMNS.get(table, set())
+    source_checksum = ChunkChecksum()
+
+    with target.get_cursor() as write_cursor:
+        # إعادة تشغيل جزء غير مكتمل يجب أن تبدأ من حالة نظيفة
+        write_cursor.execute(f"DELETE FROM {table} WHERE id >= %s AND id < %s", (low, high))
+
+        with source.get_stream_cursor() as read_cursor:
+            read_cursor.execute(
+                f"SELECT {', '.join(source_columns)} FROM {table} WHERE id >= %s AND id < %s ORDER BY id",
+                (low, high)
+            )
+            while True:
+                rows = read_cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batch = []
+                for row in rows:
+                    values = []
+                    for source_column, target_column in mapping:
+                        value = normalize(row[source_column], target_column in booleans)
+                        if value is None and target_column in defaults:
+                            value = defaults[target_column]
+                        values.append(value)
+                    source_checksum.update(values)
+                    batch.append(tuple(values))
+                target.insert_many(write_cursor, table, target_columns, batch)
+
+    # قراءة الجزء من الهدف بعد commit والمقارنة
+    target_checksum = ChunkChecksum()
+    with target.get_stream_cursor() as verify_cursor:
+        verify_cursor.execute(
+            f"SELECT {', '.join(target_columns)} FROM {table} WHERE id >= %s AND id < %s ORDER BY id",
+            (low, high)
+        )
+        while True:
+            rows = verify_cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                target_checksum.update([normalize(row[column], column in booleans) for column in target_columns])
+
+    return {
+        'table': table,
+        'low': low,
+        'high': high,
+        'rows': source_checksum.rows,
+        'checksum': source_checksum.hexdigest(),
+        'verified': source_checksum.hexdigest() == target_checksum.hexdigest()
+                    and source_checksum.rows == target_checksum.rows,
+    }
+
+
+def id_ranges(lib, table, chunk_size):
+    """تقسيم الجدول إلى نطاقات من المفتاح الأساسي"""
+    with lib.get_cursor() as cursor:
+        cursor.execute(f"SELECT MIN(id) AS low, MAX(id) AS high FROM {table}")
+        bounds = cursor.fetchone()
+    if bounds['low'] is None:
+        return []
+    low, high = int(bounds['low']), int(bounds['high'])
+    return [(start, min(start + chunk_size, high + 1)) for start in range(low, high + 1, chunk_size)]
+
+
+class Checkpoint:
+    """ملف JSON يسجل الأجزاء المكتملة حتى يمكن استئناف النقل"""
+
+    def __init__(self, path, source_url, target_url):
+        self.path = path
+        self.data = {'source': source_url, 'target': target_url, 'chunks': {}}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            if saved.get('source') == source_url and saved.get('target') == target_url:
+                self.data = saved
+            else:
+                logger.warning(f"⚠️  Checkpoint {path} belongs to another migration, starting fresh")
+
+    @staticmethod
+    def key(table, low, high):
+        return f"{table}:{low}:{high}"
+
+    def done(self, table, low, high):
+        return self.key(table, low, high) in self.data['chunks']
+
+    def record(self, result):
+        self.data['chunks'][self.key(result['table'], result['low'], result['high'])] = {
+            'rows': result['rows'],
+            'checksum': result['checksum'],
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def redact(url):
+    """إخفاء كلمة المرور عند طباعة الرابط"""
+    if '@' not in url or '://' not in url:
+        return url
+    scheme, rest = url.split('://', 1)
+    credentials, host = rest.rsplit('@', 1)
+    user = credentials.split(':', 1)[0]
+    return f"{scheme}://{user}:***@{host}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy users, books and loans between database backends")
+    parser.add_argument('--source', required=True, help="source DATABASE_URL (postgresql://, mysql://, sqlite:///)")
+    parser.add_argument('--target', required=True, help="target DATABASE_URL")
+    parser.add_argument('--tables', default=','.join(TABLES))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=50000, help="primary-key range per chunk")
+    parser.add_argument('--batch-size', type=int, default=5000, help="rows per fetch and per INSERT batch")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT)
+    args = parser.parse_args(argv)
+
+    tables = [t for t in TABLES if t in args.tables.split(',')]
+    source = backends.create_library_system(database_url=args.source)
+    target = backends.create_library_system(database_url=args.target)
+    if source.backend_name == 'sqlite' and args.workers > 1 and source.db_config['path'] == ':memory:':
+        parser.error("an in-memory SQLite source cannot be shared with worker processes")
+
+    # المخطط فقط، بدون البيانات التجريبية التي يضيفها init_db()
+    target.create_database_if_not_exists()
+    with target.get_cursor() as cursor:
+        target.create_schema(cursor)
+
+    # الروابط تُحفظ بدون كلمات المرور
+    checkpoint = Checkpoint(args.checkpoint, redact(args.source), redact(args.target))
+    logger.info(f"🚚 {redact(args.source)} -> {redact(args.target)}")
+    failed = []
+    started = time.time()
+
+    with Pool(args.workers, initializer=_init_worker, initargs=(args.source, args.target)) as pool:
+        copied_tables = []
+        for table in tables:
+            columns = source_columns(source, table)
+            if columns is None:
+                logger.warning(f"⚠️  {table} does not exist in the source and was skipped")
+                continue
+            copied_tables.append(table)
+            mapping = build_column_map(table, columns, target.table_columns(table))
+            ranges = id_ranges(source, table, args.chunk_size)
+            pending = [(table, low, high, mapping, args.batch_size)
+                       for low, high in ranges if not checkpoint.done(table, low, high)]
+            logger.info(f"📦 {table}: {len(ranges)} chunk(s), {len(ranges) - len(pending)} already done")
+
+            table_started = time.time()
+            copied = 0
+            for result in pool.imap_unordered(copy_chunk, pending):
+                if result['verified']:
+                    checkpoint.record(result)
+                    copied += result['rows']
+                else:
+                    failed.append(result)
+                    logger.error(f"❌ Chunk {table} [{result['low']}, {result['high']}) was not copied or failed verification")
+            elapsed = time.time() - table_started
+            logger.info(f"✅ {table}: {copied:,} rows in {elapsed:.1f}s ({copied / max(elapsed, 1e-9):,.0f} rows/s)")
+
+            with target.get_cursor() as cursor:
+                target.reset_id_sequence(cursor, table)
+
+    if 'catalog_changes' in copied_tables:
+        # مؤشرات العملاء تبقى صالحة فقط إذا انتقل حد الحذف مع السجل
+        try:
+            with source.get_cursor() as cursor:
+                purged_through = source.get_job_state(cursor, 'catalog_changes_purged_through')
+        except source.Error:
+            # مصدر بدون job_state لم يحذف من السجل شيئاً
+            purged_through = 0
+        with target.get_cursor() as cursor:
+            target.set_job_state(cursor, 'catalog_changes_purged_through', purged_through)
+
+    if 'books' in copied_tables:
+        # عدادات التصفح مشتقة من books فتُحسب في الهدف بدل نسخها
+        target.rebuild_facets()
+
+    if failed:
+        logger.error(f"❌ {len(failed)} chunk(s) failed verification; rerun to retry them")
+        return 1
+
+    logger.info(f"🎉 Migration finished in {time.time() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
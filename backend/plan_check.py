@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+فحص خطط تنفيذ الاستعلامات (EXPLAIN) لكل دوال طبقة البيانات
+"""
+
+import argparse
+import sys
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from dotenv import load_dotenv
+
+import backends
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+
+def _loan_activity(lib, ctx):
+    with lib.get_cursor() as cursor:
+        return lib.get_loan_activity(cursor, date.today() - timedelta(days=7), date.today(), archive=True)
+
+
+# كل فحص: اسم الدالة -> استدعاء يمر بكل الاستعلامات التي تنفذها
+PLAN_CHECKS = {
+    'authenticate_user': lambda lib, ctx: lib.authenticate_user(ctx['username'], 'plan-check'),
+    'get_all_books': lambda lib, ctx: lib.get_all_books(),
+    'get_available_books': lambda lib, ctx: lib.get_available_books(),
+    'get_borrowed_books': lambda lib, ctx: lib.get_borrowed_books(),
+    'search_books': lambda lib, ctx: lib.search_books('the'),
+    'get_user_loans': lambda lib, ctx: lib.get_user_loans(ctx['user_id']),
+    'borrow_book': lambda lib, ctx: lib.borrow_book(ctx['book_id'], ctx['user_id']),
+    'return_book': lambda lib, ctx: lib.return_book(ctx['book_id']),
+    'get_overdue_loans': lambda lib, ctx: lib.get_overdue_loans(),
+    'get_overdue_loans_count': lambda lib, ctx: lib.get_overdue_loans_count(),
+    'get_total_books': lambda lib, ctx: lib.get_total_books(),
+    'get_available_books_count': lambda lib, ctx: lib.get_available_books_count(),
+    'get_borrowed_books_count': lambda lib, ctx: lib.get_borrowed_books_count(),
+    'get_all_users': lambda lib, ctx: lib.get_all_users(),
+    'get_loan_history': lambda lib, ctx: lib.get_loan_history(book_id=ctx['book_id']),
+    'get_user_holds': lambda lib, ctx: lib.get_user_holds(ctx['user_id']),
+    'expire_holds': lambda lib, ctx: lib.expire_holds(),
+    'get_changes': lambda lib, ctx: lib.get_changes(0),
+    'get_catalog_snapshot': lambda lib, ctx: lib.get_catalog_snapshot(),
+    'browse_books': lambda lib, ctx: lib.browse_books(author='George Orwell', after=ctx['book_id']),
+    'browse_books_decade': lambda lib, ctx: lib.browse_books(decade=1940, after=ctx['book_id']),
+    'browse_books_available': lambda lib, ctx: lib.browse_books(available=True),
+    'get_facets': lambda lib, ctx: lib.get_facets(),
+    'get_book': lambda lib, ctx: lib.get_book(ctx['book_id']),
+    'get_book_neighbours': lambda lib, ctx: lib.get_book_neighbours(ctx['book_id']),
+    'browse_users': lambda lib, ctx: lib.browse_users(after=ctx['user_id']),
+    'browse_users_role': lambda lib, ctx: lib.browse_users(role='user', after=ctx['user_id']),
+    'browse_users_username': lambda lib, ctx: lib.browse_users(prefix='ad', after=ctx['user_id']),
+    'browse_users_full_name': lambda lib, ctx: lib.browse_users(prefix='Sys', field='full_name', after=ctx['user_id']),
+    'browse_users_email': lambda lib, ctx: lib.browse_users(role='user', prefix='user', field='email',
+                                                            after=ctx['user_id']),
+    'get_user_role_counts': lambda lib, ctx: lib.get_user_role_counts(),
+    'get_first_loan_date': lambda lib, ctx: lib.get_first_loan_date(),
+    'get_loan_activity': _loan_activity,
+    'get_loan_daily': lambda lib, ctx: lib.get_loan_daily(date(2024, 1, 1), date.today()),
+    'get_loan_rollup_totals': lambda lib, ctx: lib.get_loan_rollup_totals('author', date(2024, 1, 15), date.today(), 10),
+}
+
+# فحوص تكتب فعلاً (إعارات، سجل تغييرات، غرامات، حجوزات): على قاعدة تجريبية فقط (--seed-books)
+WRITE_CHECKS = {'borrow_book', 'return_book', 'expire_holds'}
+
+# مشاكل متوقعة ومقبولة لكل دالة
+ALLOWED_ISSUES = {
+    # قوائم كاملة بطبيعتها: مسح فهرس مرتب يغطي الأعمدة أفضل ما يمكن
+    'get_all_books': {'full_index_scan'},
+    'get_all_users': {'full_index_scan'},
+    'get_total_books': {'full_index_scan'},
+    # المجموع لكل دور يمر على فهرس الدور كله، والواجهة تحتفظ به مؤقتاً
+    'get_user_role_counts': {'full_index_scan'},
+    'get_catalog_snapshot': {'full_scan', 'full_index_scan'},
+    # LIKE '%...%' لا يمكن أن يستخدم فهرس B-tree
+    'search_books': {'full_scan', 'full_index_scan'},
+    # دمج الجدولين يحتاج فرزاً، لكن لصفوف كتاب واحد فقط
+    'get_loan_history': {'filesort', 'temporary'},
+    # IN على حالتين يكسر ترتيب الفهرس، والفرز على حجوزات مستخدم واحد النشطة فقط
+    'get_user_holds': {'filesort'},
+    # ORDER BY ... LIMIT 1 يقرأ أول مدخل في الفهرس فقط
+    'get_first_loan_date': {'full_index_scan'},
+    # تجميع نطاق أيام محدود بالفهرس، والتجميع نفسه يحتاج جدولاً مؤقتاً وفرزاً
+    'get_loan_activity': {'filesort', 'temporary'},
+    'get_loan_rollup_totals': {'filesort', 'temporary'},
+}
+
+
+class PlanIssue:
+    def __init__(self, method, query, kind, detail):
+        self.method = method
+        self.query = query
+        self.kind = kind
+        self.detail = detail
+
+    def __str__(self):
+        query = ' '.join(self.query.split())
+        return f"{self.method}: {self.kind} ({self.detail}) in: {query[:120]}"
+
+
+class _RecordingCursor:
+    """يسجل كل استعلام يمر عبره مع معاملاته"""
+
+    def __init__(self, cursor, statements):
+        self._cursor = cursor
+        self._statements = statements
+
+    def execute(self, query, args=None):
+        self._statements.append((query, args))
+        return self._cursor.execute(query, args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def capture_queries(lib, call):
+    """تنفيذ الاستدعاء وإرجاع الاستعلامات التي نفذها"""
+    statements = []
+    original = lib.get_cursor
+
+    @contextmanager
+    def recording_cursor(tuples=False):
+        with original(tuples=tuples) as cursor:
+            yield _RecordingCursor(cursor, statements)
+
+    lib.get_cursor = recording_cursor
+    try:
+        call()
+    finally:
+        del lib.get_cursor
+    return statements
+
+
+def _context(lib):
+    """قيم حقيقية من القاعدة لاستخدامها في الاستعلامات"""
+    with lib.get_cursor() as cursor:
+        cursor.execute("SELECT id, username FROM users ORDER BY id LIMIT 1")
+        user = cursor.fetchone()
+        cursor.execute("SELECT id FROM books WHERE available = TRUE ORDER BY id LIMIT 1")
+        book = cursor.fetchone()
+    return {
+        'username': user['username'] if user else 'admin',
+        'user_id': user['id'] if user else 1,
+        'book_id': book['id'] if book else 1,
+    }
+
+
+def check_plans(lib, methods=None, writes=False):
+    """تشغيل EXPLAIN على كل استعلام مسجل وإرجاع المشاكل غير المسموح بها
+
+    WRITE_CHECKS تُتخطى إلا مع writes=True (قاعدة تجريبية)، لأنها تنفذ الدوال نفسها.
+    """
+    ctx = _context(lib)
+    issues = []
+    for method, check in PLAN_CHECKS.items():
+        if methods and method not in methods:
+            continue
+        if method in WRITE_CHECKS and not writes:
+            continue
+        allowed = ALLOWED_ISSUES.get(method, set())
+        for query, args in capture_queries(lib, lambda: check(lib, ctx)):
+            if not query.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            with lib.get_cursor() as cursor:
+                for kind, detail in lib.explain_plan(cursor, query, args):
+                    if kind not in allowed:
+                        issues.append(PlanIssue(method, query, kind, detail))
+    return issues
+
+
+def assert_plans(lib, methods=None, writes=False):
+    """للاستخدام في الاختبارات: AssertionError عند وجود خطة متراجعة"""
+    issues = check_plans(lib, methods, writes)
+    if issues:
+        raise AssertionError("Query plan regressions:\n" + '\n'.join(f"  - {issue}" for issue in issues))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN every data-layer query and flag scans, filesorts and temp tables")
+    parser.add_argument('--database-url', help="database to check (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--only', help="comma separated subset of methods")
+    parser.add_argument('--seed-books', type=int, default=0,
+                        help="seed a scratch database with this many books before checking (never use on production)")
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    if args.seed_books:
+        import benchmark
+        benchmark.reset_scratch_database(lib)
+        benchmark.seed_catalog(lib, args.seed_books)
+    else:
+        lib.init_db()
+
+    methods = set(args.only.split(',')) if args.only else None
+    writes = bool(args.seed_books)
+    if not writes:
+        requested = WRITE_CHECKS & methods if methods else set()
+        if requested:
+            print(f"❌ {', '.join(sorted(requested))} write to the database; run them with --seed-books on a scratch database")
+            return 2
+        print(f"ℹ️  Skipping write checks ({', '.join(sorted(WRITE_CHECKS))}); use --seed-books to include them")
+    issues = check_plans(lib, methods, writes)
+    if issues:
+        print(f"❌ {len(issues)} plan issue(s):")
+        for issue in issues:
+            print(f"   - {issue}")
+        return 1
+
+    print("✅ All query plans use indexes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+إنشاء حسابات بالجملة من CSV (بداية كل فصل دراسي)
+
+الملف يُقرأ تدفقياً على دفعات: تجزئة كلمات المرور في مجموعة عمليات بينما تُدرج الدفعة السابقة،
+ثم INSERT IGNORE في transaction لكل دفعة، ونتيجة لكل سطر (created / exists / duplicate / invalid / error).
+ميزانية CPU (بعدد الأنوية) تُبطئ العملية بالنوم بين الدفعات حتى تعمل بجانب الاستخدام العادي.
+
+الأعمدة: username,password,role,full_name,email (role و full_name و email اختيارية)
+"""
+
+import argparse
+import csv
+import logging
+import math
+import os
+import sys
+import time
+from collections import Counter, deque
+from multiprocessing import Pool
+
+from dotenv import load_dotenv
+
+import backends
+from library_base import hash_password
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROLES = ('admin', 'librarian', 'user')
+PROVISION_BATCH_SIZE = int(os.getenv('PROVISION_BATCH_SIZE', 1000))
+# الأنوية المسموح باستهلاكها في المتوسط (تجزئة + تحضير)، 0 بلا حد
+PROVISION_CPU_BUDGET = float(os.getenv('PROVISION_CPU_BUDGET', 1))
+RESULT_COLUMNS = ('line', 'username', 'status', 'user_id', 'message')
+# أطوال الأعمدة في جدول users
+MAX_LENGTHS = {'username': 50, 'full_name': 100, 'email': 100}
+
+
+def hash_chunk(passwords):
+    """تعمل في عملية منفصلة: التجزئات ووقت CPU المستهلك لها"""
+    started = time.process_time()
+    hashes = [hash_password(password) for password in passwords]
+    return hashes, time.process_time() - started
+
+
+class CpuBudget:
+    """نوم بين الدفعات حتى لا يتجاوز متوسط استهلاك CPU عدد الأنوية المحدد"""
+
+    def __init__(self, cores):
+        self.cores = cores
+        self.started = time.monotonic()
+        self.own_started = time.process_time()
+        self.worker_seconds = 0.0
+        self.slept = 0.0
+
+    @property
+    def cpu_seconds(self):
+        return time.process_time() - self.own_started + self.worker_seconds
+
+    def throttle(self):
+        if not self.cores:
+            return
+        delay = self.cpu_seconds / self.cores - (time.monotonic() - self.started)
+        if delay > 0:
+            time.sleep(delay)
+            self.slept += delay
+
+
+def validate(row, default_role):
+    """(username، password، role، full_name، email) أو سبب الرفض"""
+    username = (row.get('username') or '').strip()
+    password = row.get('password') or ''
+    role = (row.get('role') or '').strip().lower() or default_role
+    full_name = (row.get('full_name') or '').strip()
+    email = (row.get('email') or '').strip() or None
+    if not username:
+        return None, "username is required"
+    if not password:
+        return None, "password is required"
+    if role not in ROLES:
+        return None, f"role must be one of {', '.join(ROLES)}"
+    for column, value in (('username', username), ('full_name', full_name), ('email', email)):
+        if value and len(value) > MAX_LENGTHS[column]:
+            return None, f"{column} is longer than {MAX_LENGTHS[column]} characters"
+    return (username, password, role, full_name, email), None
+
+
+class Provisioner:
+    """خط المعالجة: قراءة -> تحقق -> تجزئة (متوازية) -> إدراج -> نتائج، مع إحصاءات التشغيل"""
+
+    def __init__(self, lib, workers=1, cpu_budget=PROVISION_CPU_BUDGET, batch_size=PROVISION_BATCH_SIZE,
+                 default_role='user'):
+        self.lib = lib
+        self.workers = max(1, workers)
+        self.cpu_budget = cpu_budget
+        self.batch_size = batch_size
+        self.default_role = default_role
+        self.stats = Counter()
+        self.elapsed = self.cpu_seconds = self.slept = 0.0
+
+    def _batches(self, rows):
+        """دفعات (نتائج مرفوضة، صفوف صالحة) مع أرقام الأسطر في الملف"""
+        seen = set()
+        rejected, valid = [], []
+        # السطر 1 هو العناوين
+        for line, row in enumerate(rows, 2):
+            user, message = validate(row, self.default_role)
+            if user is None:
+                rejected.append((line, (row.get('username') or '').strip(), 'invalid', None, message))
+            elif user[0] in seen:
+                rejected.append((line, user[0], 'duplicate', None, "username appears earlier in the file"))
+            else:
+                seen.add(user[0])
+                valid.append((line, user))
+            if len(valid) >= self.batch_size:
+                yield rejected, valid
+                rejected, valid = [], []
+        if rejected or valid:
+            yield rejected, valid
+
+    def _insert(self, valid, hashes):
+        users = [(username, password_hash, role, full_name, email)
+                 for (_, (username, _, role, full_name, email)), password_hash in zip(valid, hashes)]
+        try:
+            with self.lib.get_cursor() as cursor:
+                created = self.lib.create_users(cursor, users)
+        except self.lib.Error as e:
+            logger.error(f"❌ Provisioning batch starting at line {valid[0][0]} failed: {e}")
+            return [(line, user[0], 'error', None, str(e)) for line, user in valid]
+        results = []
+        for line, user in valid:
+            user_id = created.get(user[0])
+            if user_id is None:
+                results.append((line, user[0], 'exists', None, "username already exists"))
+            else:
+                results.append((line, user[0], 'created', user_id, ''))
+        return results
+
+    def run(self, rows):
+        """يولد نتيجة لكل سطر بترتيب الملف (دفعة بدفعة)؛ الإحصاءات في self.stats بعد الانتهاء"""
+        budget = CpuBudget(self.cpu_budget)
+        started = time.monotonic()
+        pool = Pool(self.workers) if self.workers > 1 else None
+        # دفعة أو أكثر تُجزأ في الخلفية أثناء إدراج الدفعة الحالية
+        pending = deque()
+        done = 0
+        try:
+            batches = self._batches(rows)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) <= self.workers:
+                    batch = next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                        break
+                    rejected, valid = batch
+                    passwords = [user[1] for _, user in valid]
+                    if pool is not None:
+                        size = max(1, math.ceil(len(passwords) / self.workers))
+                        jobs = [pool.apply_async(hash_chunk, (passwords[i:i + size],))
+                                for i in range(0, len(passwords), size)]
+                    else:
+                        jobs = [hash_chunk(passwords)]
+                    pending.append((rejected, valid, jobs))
+                if not pending:
+                    break
+
+                rejected, valid, jobs = pending.popleft()
+                hashes = []
+                for job in jobs:
+                    chunk, cpu = job.get() if pool is not None else job
+                    hashes.extend(chunk)
+                    if pool is not None:
+                        budget.worker_seconds += cpu
+                results = sorted(rejected + (self._insert(valid, hashes) if valid else []))
+                for result in results:
+                    self.stats[result[2]] += 1
+                    yield result
+                budget.throttle()
+                self.elapsed = time.monotonic() - started
+                done += 1
+                if done % 10 == 0:
+                    logger.info(f"   ... {sum(self.stats.values()):,} row(s), {self.rate:,.0f} rows/s")
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            self.elapsed = time.monotonic() - started
+            self.cpu_seconds = budget.cpu_seconds
+            self.slept = budget.slept
+
+    @property
+    def rate(self):
+        return sum(self.stats.values()) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return {
+            'rows': sum(self.stats.values()),
+            **{status: self.stats[status] for status in ('created', 'exists', 'duplicate', 'invalid', 'error')},
+            'seconds': round(self.elapsed, 2),
+            'rows_per_second': round(self.rate, 1),
+            'cpu_seconds': round(self.cpu_seconds, 2),
+            'throttled_seconds': round(self.slept, 2),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create accounts in bulk from a CSV (username,password,role,full_name,email)")
+    parser.add_argument('csv', help="input CSV with a header row")
+    parser.add_argument('--database-url', help="database to provision (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--results', help="per-row result CSV (default: <csv>.results.csv)")
+    parser.add_argument('--cpu-budget', type=float, default=PROVISION_CPU_BUDGET,
+                        help="average CPU cores to use; 0 for no limit")
+    parser.add_argument('--workers', type=int,
+                        help="hashing processes (default: the CPU budget rounded up, at most the core count)")
+    parser.add_argument('--batch-size', type=int, default=PROVISION_BATCH_SIZE, help="accounts per transaction")
+    parser.add_argument('--default-role', choices=ROLES, default='user', help="role for rows without one")
+    args = parser.parse_args(argv)
+
+    workers = args.workers
+    if workers is None:
+        cores = os.cpu_count() or 1
+        workers = min(cores, math.ceil(args.cpu_budget)) if args.cpu_budget else cores
+    lib = backends.create_library_system(database_url=args.database_url)
+    lib.init_db()
+    provisioner = Provisioner(lib, workers, args.cpu_budget, args.batch_size, args.default_role)
+
+    results_path = args.results or f"{args.csv}.results.csv"
+    with open(args.csv, newline='', encoding='utf-8-sig') as source, \
+            open(results_path, 'w', newline='', encoding='utf-8') as target:
+        writer = csv.writer(target)
+        writer.writerow(RESULT_COLUMNS)
+        writer.writerows(provisioner.run(csv.DictReader(source)))
+
+    summary = provisioner.summary()
+    logger.info(f"✅ Provisioned {summary['created']:,} account(s) from {summary['rows']:,} row(s) "
+                f"({summary['exists']:,} existing, {summary['duplicate']:,} duplicate, "
+                f"{summary['invalid']:,} invalid, {summary['error']:,} failed) in {summary['seconds']}s, "
+                f"{summary['rows_per_second']:,} rows/s; results in {results_path}")
+    return 1 if summary['error'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
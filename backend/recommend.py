@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+توصيات "استُعير معه": تكرار الاستعارة المشترك بين الكتب من مصفوفة مستخدم×كتاب متفرقة
+
+المصفوفة X ثنائية (هل استعار المستخدم الكتاب)، و X.T @ X يعطي لكل زوج كتب عدد المستخدمين
+الذين استعاروهما معاً. الحساب على دفعات من الكتب، ويُحفظ أعلى k جار لكل كتاب في book_neighbours.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from scipy import sparse
+
+import backends
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RECOMMEND_NEIGHBOURS = int(os.getenv('RECOMMEND_NEIGHBOURS', 20))
+# أقل عدد مستخدمين مشتركين حتى يُعتبر الكتابان جارين
+RECOMMEND_MIN_TOGETHER = int(os.getenv('RECOMMEND_MIN_TOGETHER', 2))
+# المصفوفة محفوظة بين التشغيلات حتى يقرأ التحديث التزايدي الإعارات الجديدة فقط
+RECOMMEND_MATRIX = os.getenv('RECOMMEND_MATRIX', 'loan_matrix.npz')
+CURSOR_STATE = 'recommend_loan_cursor'
+BLOCK_SIZE = 2000
+
+
+def load_pairs(lib, since=0):
+    """(users، books، آخر id) للإعارات بعد since"""
+    users, books = [], []
+    last_id = since
+    for rows in lib.iter_loan_pairs(since):
+        users.append(np.fromiter((row['user_id'] for row in rows), dtype=np.int32, count=len(rows)))
+        books.append(np.fromiter((row['book_id'] for row in rows), dtype=np.int32, count=len(rows)))
+        last_id = max(last_id, max(row['id'] for row in rows))
+    if not users:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), last_id
+    return np.concatenate(users), np.concatenate(books), last_id
+
+
+def build_matrix(users, books, shape=(0, 0)):
+    """مصفوفة CSR ثنائية: تكرار استعارة نفس الكتاب من نفس المستخدم يُحسب مرة واحدة"""
+    shape = (max(shape[0], int(users.max()) + 1 if len(users) else 0),
+             max(shape[1], int(books.max()) + 1 if len(books) else 0))
+    matrix = sparse.csr_matrix((np.ones(len(users), dtype=np.int32), (users, books)), shape=shape)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+def load_matrix(path):
+    with np.load(path) as data:
+        matrix = sparse.csr_matrix((np.ones(len(data['indices']), dtype=np.int32), data['indices'], data['indptr']),
+                                   shape=tuple(data['shape']))
+        return matrix, int(data['cursor'][0])
+
+
+def save_matrix(path, matrix, cursor):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        np.savez(f, indptr=matrix.indptr, indices=matrix.indices, shape=np.array(matrix.shape),
+                 cursor=np.array([cursor], dtype=np.int64))
+    os.replace(tmp, path)
+
+
+def top_neighbours(matrix, book_ids, k=RECOMMEND_NEIGHBOURS, min_together=RECOMMEND_MIN_TOGETHER, columns=None):
+    """أعلى k جار لكل كتاب في book_ids
+
+    الترتيب حسب تشابه cosine: together / sqrt(readers_i * readers_j)، حتى لا تتصدر الكتب الأكثر شعبية كل القوائم.
+    """
+    columns = matrix.tocsc() if columns is None else columns
+    readers = np.diff(columns.indptr).astype(np.float64)
+    result = {}
+    for start in range(0, len(book_ids), BLOCK_SIZE):
+        block = book_ids[start:start + BLOCK_SIZE]
+        # (كتب الدفعة × المستخدمين) @ (المستخدمين × الكتب)
+        together = (columns[:, block].T.tocsr() @ matrix).tocsr()
+        for row, book_id in enumerate(block):
+            begin, end = together.indptr[row], together.indptr[row + 1]
+            neighbours = together.indices[begin:end]
+            counts = together.data[begin:end]
+            keep = (neighbours != book_id) & (counts >= min_together)
+            neighbours, counts = neighbours[keep], counts[keep]
+            if len(neighbours) == 0:
+                result[int(book_id)] = []
+                continue
+            scores = counts / np.sqrt(readers[book_id] * readers[neighbours])
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+            else:
+                top = np.arange(len(scores))
+            top = top[np.lexsort((neighbours[top], -scores[top]))]
+            result[int(book_id)] = [(int(neighbours[i]), round(float(scores[i]), 6), int(counts[i])) for i in top]
+    return result
+
+
+def run(lib, k=RECOMMEND_NEIGHBOURS, full=False, matrix_path=RECOMMEND_MATRIX, should_stop=None):
+    """تحديث الجيران؛ التزايدي يعيد حساب الكتب التي استعارها مستخدمون لهم إعارات جديدة فقط"""
+    started = time.time()
+    with lib.get_cursor() as cursor:
+        state = lib.get_job_state(cursor, CURSOR_STATE)
+
+    matrix = None
+    if not full and state and matrix_path and os.path.exists(matrix_path):
+        matrix, saved = load_matrix(matrix_path)
+        if saved != state:
+            # المصفوفة من تشغيل آخر (نسخة أخرى أو تشغيل فشل قبل الحفظ)
+            logger.warning(f"⚠️  {matrix_path} is at loan {saved:,}, expected {state:,}; rebuilding")
+            matrix = None
+
+    if matrix is None:
+        users, books, cursor_id = load_pairs(lib)
+        matrix = build_matrix(users, books)
+        affected = None
+        mode = 'full'
+    else:
+        users, books, cursor_id = load_pairs(lib, state)
+        if len(users) == 0:
+            logger.info("✅ Recommendations: no new loans since the last run")
+            return {'mode': 'incremental', 'loans': 0, 'books': 0}
+        matrix = build_matrix(np.concatenate([matrix.tocoo().row.astype(np.int32), users]),
+                              np.concatenate([matrix.indices, books]), matrix.shape)
+        # كل أزواج الكتب التي تغيرت تقع في تاريخ المستخدمين أصحاب الإعارات الجديدة
+        affected = np.unique(matrix[np.unique(users)].indices)
+        mode = 'incremental'
+    loans = len(users)
+    del users, books
+
+    columns = matrix.tocsc()
+    if affected is None:
+        # كل كتاب له قارئ واحد على الأقل
+        affected = np.flatnonzero(np.diff(columns.indptr))
+    written = 0
+    for start in range(0, len(affected), BLOCK_SIZE * 5):
+        neighbours = top_neighbours(matrix, affected[start:start + BLOCK_SIZE * 5], k, columns=columns)
+        with lib.get_cursor() as cursor:
+            lib.save_book_neighbours(cursor, neighbours)
+        written += len(neighbours)
+        if should_stop and should_stop():
+            # المؤشر لا يتقدم: التشغيل التالي يعيد حساب نفس الكتب
+            logger.warning(f"⚠️  Recommendations stopped early after {written:,} book(s)")
+            return {'mode': mode, 'loans': loans, 'books': written, 'stopped': True}
+
+    if matrix_path:
+        save_matrix(matrix_path, matrix, cursor_id)
+    with lib.get_cursor() as cursor:
+        lib.set_job_state(cursor, CURSOR_STATE, cursor_id)
+
+    logger.info(f"✅ Recommendations ({mode}): {loans:,} loan(s) read, {written:,} book(s) updated "
+                f"in {time.time() - started:.1f}s")
+    return {'mode': mode, 'loans': loans, 'books': written}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute 'borrowed together' neighbours from loan co-occurrence")
+    parser.add_argument('--database-url', help="database to update (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--neighbours', type=int, default=RECOMMEND_NEIGHBOURS, help="neighbours kept per book")
+    parser.add_argument('--full', action='store_true', help="ignore the saved matrix and recompute every book")
+    parser.add_argument('--matrix', default=RECOMMEND_MATRIX, help="user x book matrix kept between runs")
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    lib.init_db()
+    run(lib, args.neighbours, args.full, args.matrix)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
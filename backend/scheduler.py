@@ -0,0 +1,392 @@
+"""
+مجدول مهام خفيف داخل عملية التطبيق، مع انتخاب نسخة قائدة لكل مهمة عبر أقفال قاعدة البيانات
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import heapq
+import logging
+import random
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HISTORY_SIZE = 20
+# بعد انتهاء المهلة: انتظار المهمة هذه المدة ثم تركها تكمل وحدها حتى لا تحجز عامل الـ pool
+ABANDON_AFTER_SECONDS = 30
+
+
+class CronSchedule:
+    """جدول بصيغة cron من خمسة حقول: دقيقة ساعة يوم شهر يوم-أسبوع (0 = الأحد)"""
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(part, low, high) for part, (low, high) in zip(parts, self.FIELDS)
+        )
+        # مثل cron: إذا تحدد اليوم ويوم الأسبوع معاً يكفي أن يطابق أحدهما
+        self.either_day = parts[2] != '*' and parts[4] != '*'
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for item in field.split(','):
+            step = 1
+            if '/' in item:
+                item, step = item.split('/', 1)
+                step = int(step)
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start, end = (int(value) for value in item.split('-', 1))
+            else:
+                start = int(item)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"cron field {field!r} is out of range {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        return (day or weekday) if self.either_day else (day and weekday)
+
+    def next_after(self, moment):
+        """أول دقيقة بعد moment تطابق الجدول"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year, month = divmod(candidate.month, 12)
+                candidate = candidate.replace(year=candidate.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"cron expression never matches: {self.expression!r}")
+
+
+class JobContext:
+    """يُمرر للمهمة: المهام الطويلة تفحص expired() بين الدفعات وتتوقف عند انتهاء المهلة"""
+
+    def __init__(self, timeout):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.cancelled = threading.Event()
+
+    def expired(self):
+        return self.cancelled.is_set() or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+
+class LeaderConnection:
+    """اتصال واحد لكل نسخة تُحجز عليه أقفال قيادة كل المهام الحصرية
+
+    انقطاعه يحرر كل الأقفال على الخادم معاً، فيُفتح اتصال جديد برقم جيل جديد
+    وكل LeaderLock من جيل سابق يعيد الانتخاب.
+    """
+
+    def __init__(self, lib):
+        self.lib = lib
+        self.connection = None
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is not None:
+            if self.lib.advisory_lock_alive(self.connection):
+                return self.connection
+            self._close()
+        self.connection = self.lib.lock_connection()
+        self.generation += 1
+        return self.connection
+
+    def try_lock(self, name):
+        """(حُجز؟، الجيل)"""
+        with self._lock:
+            connection = self._connect()
+            return self.lib.try_advisory_lock(connection, name), self.generation
+
+    def alive(self, generation):
+        with self._lock:
+            return (self.connection is not None and self.generation == generation
+                    and self.lib.advisory_lock_alive(self.connection))
+
+    def unlock(self, name, generation):
+        with self._lock:
+            if self.connection is None or self.generation != generation:
+                return
+            try:
+                self.lib.release_advisory_lock(self.connection, name)
+            except self.lib.Error:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self.connection is not None:
+                self._close()
+
+    def _close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
+
+
+class LeaderLock:
+    """قفل قيادة لمهمة واحدة على اتصال القيادة المشترك
+
+    النسخة التي تحجزه تبقى القائدة حتى تتوقف أو ينقطع اتصالها، فيُحرر القفل على الخادم.
+    """
+
+    def __init__(self, leader, name):
+        self.leader = leader
+        self.name = name
+        self.generation = None
+
+    def acquire(self):
+        if self.generation is not None:
+            if self.leader.alive(self.generation):
+                return True
+            self.generation = None
+        try:
+            acquired, generation = self.leader.try_lock(self.name)
+        except self.leader.lib.Error as e:
+            logger.warning(f"⚠️  Leader election for {self.name} failed: {e}")
+            return False
+        if not acquired:
+            return False
+        self.generation = generation
+        logger.info(f"👑 This replica now leads job {self.name}")
+        return True
+
+    def release(self):
+        if self.generation is None:
+            return
+        self.leader.unlock(self.name, self.generation)
+        self.generation = None
+
+    @property
+    def held(self):
+        return self.generation is not None
+
+
+class Job:
+    def __init__(self, name, func, interval=None, cron=None, jitter=0, timeout=None, exclusive=True):
+        if (interval is None) == (cron is None):
+            raise ValueError(f"job {name} needs exactly one of interval or cron")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter = jitter
+        self.timeout = timeout
+        self.exclusive = exclusive
+        self.running = False
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.abandoned = 0
+        self.skipped = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_run = None
+        self.last_status = None
+        self.last_error = None
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+    def schedule_next(self, now):
+        """الموعد التالي كـ epoch، مع jitter عشوائي حتى لا تتزامن النسخ"""
+        if self.cron:
+            base = self.cron.next_after(datetime.fromtimestamp(now)).timestamp()
+        else:
+            base = now + self.interval
+        self.next_run = base + random.uniform(0, self.jitter)
+        return self.next_run
+
+    def record(self, started, duration, status, error=None):
+        self.runs += 1
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.last_run = started
+        self.last_status = status
+        self.last_error = error
+        if status == 'failed':
+            self.failures += 1
+        elif status == 'timeout':
+            self.timeouts += 1
+        elif status == 'abandoned':
+            self.timeouts += 1
+            self.abandoned += 1
+        self.history.append({
+            'started': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+            'duration_ms': round(duration * 1000, 1),
+            'status': status,
+            'error': error,
+        })
+
+    def snapshot(self, leader=None):
+        return {
+            'name': self.name,
+            'schedule': self.cron.expression if self.cron else f"every {self.interval}s",
+            'exclusive': self.exclusive,
+            'leader': leader,
+            'running': self.running,
+            'next_run': datetime.fromtimestamp(self.next_run).isoformat(timespec='seconds') if self.next_run else None,
+            'runs': self.runs,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'abandoned': self.abandoned,
+            'skipped': self.skipped,
+            'mean_duration_ms': round(self.total_duration / self.runs * 1000, 1) if self.runs else None,
+            'max_duration_ms': round(self.max_duration * 1000, 1),
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+            'history': list(self.history),
+        }
+
+
+class Scheduler:
+    """thread واحد يحسب المواعيد، والمهام تعمل في pool منفصل فلا تمس threads الطلبات"""
+
+    def __init__(self, lib, workers=2):
+        self.lib = lib
+        self.jobs = {}
+        self._locks = {}
+        self._leader = LeaderConnection(lib)
+        self._queue = []
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._thread = None
+        self._stopping = False
+
+    def add_job(self, name, func, interval=None, cron=None, jitter=0, timeout=None, exclusive=True):
+        """func(ctx) حيث ctx هو JobContext"""
+        job = Job(name, func, interval, cron, jitter, timeout, exclusive)
+        with self._condition:
+            self.jobs[name] = job
+            if exclusive:
+                self._locks[name] = LeaderLock(self._leader, f"job:{name}")
+            heapq.heappush(self._queue, (job.schedule_next(time.time()), name))
+            self._condition.notify()
+        return job
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+            self._thread.start()
+            logger.info(f"⏰ Scheduler started with {len(self.jobs)} job(s)")
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._executor.shutdown(wait=False)
+        for lock in self._locks.values():
+            lock.release()
+        self._leader.close()
+
+    def run_now(self, name):
+        """تشغيل مهمة خارج موعدها (للإدارة والاختبارات)"""
+        return self._executor.submit(self._execute, self.jobs[name])
+
+    def stats(self):
+        return [job.snapshot(self._locks[name].held if name in self._locks else None)
+                for name, job in sorted(self.jobs.items())]
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+                if not self._queue:
+                    self._condition.wait()
+                    continue
+                due, name = self._queue[0]
+                delay = due - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._queue)
+                job = self.jobs[name]
+                heapq.heappush(self._queue, (job.schedule_next(time.time()), name))
+
+            if job.running:
+                # لا تشغيل متداخل لنفس المهمة
+                job.skipped += 1
+                logger.warning(f"⚠️  Job {name} is still running, skipping this run")
+                continue
+            job.running = True
+            self._executor.submit(self._execute, job)
+
+    def _execute(self, job):
+        job.running = True
+        abandoned = False
+        try:
+            lock = self._locks.get(job.name)
+            if lock is not None and not lock.acquire():
+                # نسخة أخرى هي القائدة لهذه المهمة
+                return None
+
+            ctx = JobContext(job.timeout)
+            outcome = {}
+            state = {'finished': False, 'abandoned': False}
+            guard = threading.Lock()
+
+            def target():
+                try:
+                    outcome['result'] = job.func(ctx)
+                except Exception as e:
+                    outcome['error'] = e
+                finally:
+                    with guard:
+                        state['finished'] = True
+                        late = state['abandoned']
+                    if late:
+                        # التشغيل التالي ممكن فقط بعد انتهاء هذا فعلاً
+                        job.running = False
+                        logger.warning(f"⚠️  Abandoned job {job.name} finally finished")
+
+            started = time.time()
+            runner = threading.Thread(target=target, name=f"job-{job.name}", daemon=True)
+            runner.start()
+            runner.join(job.timeout)
+            timed_out = runner.is_alive()
+            if timed_out:
+                # المهمة تتوقف عند فحص ctx.expired() التالي، فإن لم تفعل تُترك وتُسجل متروكة
+                ctx.cancelled.set()
+                logger.error(f"❌ Job {job.name} exceeded its {job.timeout}s timeout")
+                runner.join(ABANDON_AFTER_SECONDS)
+                with guard:
+                    abandoned = state['abandoned'] = not state['finished']
+            duration = time.time() - started
+
+            if abandoned:
+                job.record(started, duration, 'abandoned', "did not stop after the timeout")
+                logger.error(f"❌ Job {job.name} did not stop {ABANDON_AFTER_SECONDS}s after its timeout; "
+                             f"abandoned and still marked running")
+            elif 'error' in outcome:
+                job.record(started, duration, 'failed', str(outcome['error']))
+                logger.error(f"❌ Job {job.name} failed after {duration:.1f}s: {outcome['error']}")
+            elif timed_out:
+                job.record(started, duration, 'timeout')
+            else:
+                job.record(started, duration, 'ok')
+                logger.info(f"✅ Job {job.name} finished in {duration:.1f}s")
+            return outcome.get('result')
+        finally:
+            if not abandoned:
+                job.running = False
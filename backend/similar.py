@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+"كتب مشابهة" حسب نص العنوان والمؤلف: متجهات TF-IDF متفرقة وبحث عن الأقرب بضرب مصفوفات
+
+الميزات كلمات العنوان، وثلاثيات أحرف العنوان، واسم المؤلف، مع hashing إلى مساحة ثابتة فلا يوجد
+قاموس يُحفظ، والكتب الجديدة تُحوّل بنفس الأوزان بدون إعادة بناء. المصفوفة تُحفظ كملفات .npy
+تُفتح بـ mmap، فتحميلها فوري والعمليات على نفس الجهاز تتشارك صفحاتها.
+"""
+
+import argparse
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+from dotenv import load_dotenv
+from scipy import sparse
+
+import backends
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SIMILAR_INDEX_DIR = os.getenv('SIMILAR_INDEX_DIR', 'similar_index')
+N_FEATURES = 1 << 20
+# ميزة في أكثر من هذه النسبة من الكتب لا تميز شيئاً
+MAX_DF_RATIO = 0.2
+# أثقل ميزات الكتاب المسؤول عنه فقط تُستخدم في البحث: قوائم الميزات الشائعة طويلة وقليلة الفائدة
+MAX_QUERY_FEATURES = 48
+AUTHOR_WEIGHT = 2.0
+BUILD_CHUNK = 50000
+KEEP_VERSIONS = 2
+
+_WORD = re.compile(r"\w+")
+
+
+def _hash(feature):
+    # crc32 ثابت بين العمليات بعكس hash()
+    return zlib.crc32(feature.encode('utf-8')) & (N_FEATURES - 1)
+
+
+def book_features(title, author):
+    """{رقم الميزة: الوزن الخام} لكتاب"""
+    counts = {}
+    words = _WORD.findall((title or '').casefold())
+    for word in words:
+        index = _hash(f"w:{word}")
+        counts[index] = counts.get(index, 0) + 1
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            index = _hash(f"c:{padded[i:i + 3]}")
+            counts[index] = counts.get(index, 0) + 1
+    if author:
+        index = _hash(f"a:{' '.join(_WORD.findall(author.casefold()))}")
+        counts[index] = counts.get(index, 0) + AUTHOR_WEIGHT
+    return counts
+
+
+def raw_matrix(rows):
+    """مصفوفة tf خام (كتب × ميزات) لدفعة كتب"""
+    indptr, indices, data = [0], [], []
+    for row in rows:
+        counts = book_features(row['title'], row['author'])
+        indices.extend(counts)
+        data.extend(counts.values())
+        indptr.append(len(indices))
+    return sparse.csr_matrix(
+        (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+        shape=(len(rows), N_FEATURES)
+    )
+
+
+def weight(matrix, idf):
+    """1 + log(tf) مضروبة في idf، ثم تطبيع L2 حتى يكون الضرب الداخلي هو cosine"""
+    matrix = matrix.tocsr(copy=True)
+    matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices]
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.diags(1 / norms).dot(matrix).tocsr()
+    matrix.data = matrix.data.astype(np.float32)
+    return matrix
+
+
+def top_k(scores, k):
+    """(المواضع، الدرجات) لأعلى k في متجه كثيف"""
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order], scores[candidates[order]]
+
+
+class SimilarIndex:
+    """نسخة مبنية من المصفوفة (ملفات mmap) + دلتا للكتب المضافة بعدها
+
+    rows: (كتب × ميزات) لقراءة متجه كتاب، و postings: (ميزات × كتب) حتى يلمس البحث قوائم ميزات
+    الكتاب المسؤول عنه فقط بدل كل المصفوفة.
+    """
+
+    def __init__(self, path, version, book_ids, rows, postings, idf, cursor):
+        self.path = path
+        self.version = version
+        self.book_ids = book_ids
+        self.rows = rows
+        self.postings = postings
+        self.idf = idf
+        self.cursor = cursor
+        self.delta_ids = np.empty(0, dtype=np.int64)
+        self.delta = sparse.csr_matrix((0, N_FEATURES), dtype=np.float32)
+        self._delta_mtime = None
+        self._lock = threading.Lock()
+
+    # البناء والتخزين
+
+    @classmethod
+    def build(cls, lib, path=SIMILAR_INDEX_DIR, chunk_size=BUILD_CHUNK):
+        """مرورين على books: حساب df ثم المتجهات الموزونة، وكتابة نسخة جديدة"""
+        started = time.time()
+        with lib.get_cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS last FROM books")
+            last = cursor.fetchone()['last']
+
+        df = np.zeros(N_FEATURES, dtype=np.int32)
+        books = 0
+        for rows in lib.iter_books(until=last, batch_size=chunk_size):
+            matrix = raw_matrix(rows)
+            df += np.bincount(matrix.indices, minlength=N_FEATURES).astype(np.int32)
+            books += len(rows)
+
+        # ميزة في كتاب واحد لا تربطه بأي كتاب آخر، والشائعة جداً لا تميز
+        idf = np.log((1 + books) / (1 + df)).astype(np.float32) + 1
+        idf[(df < 2) | (df > max(2, MAX_DF_RATIO * books))] = 0
+
+        chunks, ids = [], []
+        for rows in lib.iter_books(until=last, batch_size=chunk_size):
+            chunks.append(weight(raw_matrix(rows), idf))
+            ids.append(np.fromiter((row['id'] for row in rows), dtype=np.int64, count=len(rows)))
+        rows = sparse.vstack(chunks, format='csr') if chunks else sparse.csr_matrix((0, N_FEATURES), dtype=np.float32)
+        book_ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        del chunks, ids
+
+        version = cls._write(path, book_ids, rows, idf, last)
+        logger.info(f"✅ Similar-books index built: {books:,} book(s), {rows.nnz:,} weights, "
+                    f"{int((idf > 0).sum()):,} features in {time.time() - started:.1f}s")
+        return cls.open(path, version)
+
+    @staticmethod
+    def _write(path, book_ids, rows, idf, cursor):
+        """نسخة جديدة في مجلد خاص ثم تحديث CURRENT؛ من فتح نسخة قديمة يكمل عليها"""
+        version = f"v{int(time.time() * 1000)}"
+        target = os.path.join(path, version)
+        os.makedirs(target)
+        postings = rows.T.tocsr()
+        # indptr و indices بنفس النوع، وإلا تنسخ scipy الملفات إلى الذاكرة عند الفتح
+        index_dtype = np.int64 if rows.nnz >= np.iinfo(np.int32).max else np.int32
+        arrays = {
+            'book_ids': book_ids, 'idf': idf, 'cursor': np.array([cursor], dtype=np.int64),
+            'rows_indptr': rows.indptr.astype(index_dtype), 'rows_indices': rows.indices.astype(index_dtype),
+            'rows_data': rows.data,
+            'postings_indptr': postings.indptr.astype(index_dtype),
+            'postings_indices': postings.indices.astype(index_dtype),
+            'postings_data': postings.data,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(target, f"{name}.npy"), array)
+        tmp = os.path.join(path, 'CURRENT.tmp')
+        with open(tmp, 'w') as f:
+            f.write(version)
+        os.replace(tmp, os.path.join(path, 'CURRENT'))
+
+        versions = sorted(name for name in os.listdir(path) if name.startswith('v'))
+        for old in versions[:-KEEP_VERSIONS]:
+            shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+        return version
+
+    @classmethod
+    def current_version(cls, path=SIMILAR_INDEX_DIR):
+        try:
+            with open(os.path.join(path, 'CURRENT')) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    @classmethod
+    def open(cls, path=SIMILAR_INDEX_DIR, version=None):
+        """فتح نسخة بـ mmap: لا قراءة للملفات حتى يلمسها البحث"""
+        version = version or cls.current_version(path)
+        if version is None:
+            return None
+        target = os.path.join(path, version)
+
+        def load(name):
+            return np.load(os.path.join(target, f"{name}.npy"), mmap_mode='r')
+
+        book_ids = load('book_ids')
+        rows = sparse.csr_matrix((load('rows_data'), load('rows_indices'), load('rows_indptr')),
+                                 shape=(len(book_ids), N_FEATURES), copy=False)
+        postings = sparse.csr_matrix((load('postings_data'), load('postings_indices'), load('postings_indptr')),
+                                     shape=(N_FEATURES, len(book_ids)), copy=False)
+        index = cls(path, version, book_ids, rows, postings, load('idf'), int(load('cursor')[0]))
+        index._load_delta()
+        return index
+
+    def _delta_path(self):
+        return os.path.join(self.path, self.version, 'delta.npz')
+
+    def _load_delta(self):
+        try:
+            mtime = os.stat(self._delta_path()).st_mtime
+        except OSError:
+            return
+        if mtime == self._delta_mtime:
+            return
+        with np.load(self._delta_path()) as data:
+            self.delta = sparse.csr_matrix((data['data'], data['indices'], data['indptr']),
+                                           shape=(len(data['book_ids']), N_FEATURES))
+            self.delta_ids = data['book_ids']
+            self.cursor = max(self.cursor, int(data['cursor'][0]))
+        self._delta_mtime = mtime
+
+    def update(self, lib):
+        """تحويل الكتب المضافة بعد cursor بنفس idf وإضافتها للدلتا، بدون إعادة بناء"""
+        with self._lock:
+            self._load_delta()
+            added_ids, added = [], []
+            cursor = self.cursor
+            for rows in lib.iter_books(since=cursor):
+                added.append(weight(raw_matrix(rows), self.idf))
+                added_ids.append(np.fromiter((row['id'] for row in rows), dtype=np.int64, count=len(rows)))
+                cursor = int(added_ids[-1][-1])
+            if not added:
+                return 0
+            delta = sparse.vstack([self.delta] + added, format='csr')
+            delta_ids = np.concatenate([self.delta_ids] + added_ids)
+            tmp = f"{self._delta_path()}.tmp"
+            with open(tmp, 'wb') as f:
+                np.savez(f, data=delta.data, indices=delta.indices, indptr=delta.indptr,
+                         book_ids=delta_ids, cursor=np.array([cursor], dtype=np.int64))
+            os.replace(tmp, self._delta_path())
+            self.delta, self.delta_ids, self.cursor = delta, delta_ids, cursor
+            self._delta_mtime = os.stat(self._delta_path()).st_mtime
+            count = sum(len(ids) for ids in added_ids)
+        logger.info(f"✅ Similar-books index: {count:,} new book(s) vectorized")
+        return count
+
+    def refresh(self):
+        """قراءة دلتا كتبتها عملية أخرى؛ يعيد False إذا ظهرت نسخة أحدث ويجب فتحها"""
+        if self.current_version(self.path) != self.version:
+            return False
+        self._load_delta()
+        return True
+
+    # البحث
+
+    def vector(self, book_id):
+        """متجه كتاب من النسخة أو الدلتا، أو None"""
+        position = np.searchsorted(self.book_ids, book_id)
+        if position < len(self.book_ids) and self.book_ids[position] == book_id:
+            return self.rows[position]
+        found = np.flatnonzero(self.delta_ids == book_id)
+        if len(found):
+            return self.delta[found[-1]]
+        return None
+
+    def similar_many(self, book_ids, k=10):
+        """{book_id: [(similar_id, score), ...]} لعدة كتب بضرب مصفوفتين متفرقتين دفعة واحدة"""
+        vectors, found = [], []
+        for book_id in book_ids:
+            vector = self.vector(book_id)
+            if vector is not None and vector.nnz:
+                vectors.append(self._prune(vector))
+                found.append(book_id)
+        result = {book_id: [] for book_id in book_ids}
+        if not found:
+            return result
+
+        queries = sparse.vstack(vectors, format='csr')
+        # (استعلامات × ميزات) @ (ميزات × كتب): فقط قوائم ميزات الاستعلامات تُقرأ من الملفات
+        scores = (queries @ self.postings).toarray()
+        delta_scores = (queries @ self.delta.T).toarray() if self.delta.shape[0] else None
+        for row, book_id in enumerate(found):
+            candidates = [
+                (int(self.book_ids[i]), float(score))
+                for i, score in zip(*top_k(scores[row], k + 1))
+            ]
+            if delta_scores is not None:
+                candidates += [
+                    (int(self.delta_ids[i]), float(score))
+                    for i, score in zip(*top_k(delta_scores[row], k + 1))
+                ]
+            candidates.sort(key=lambda item: (-item[1], item[0]))
+            result[book_id] = [(other, round(score, 4)) for other, score in candidates if other != book_id][:k]
+        return result
+
+    def similar(self, book_id, k=10):
+        return self.similar_many([book_id], k)[book_id]
+
+    @staticmethod
+    def _prune(vector):
+        if vector.nnz <= MAX_QUERY_FEATURES:
+            return sparse.csr_matrix(vector)
+        keep = np.argpartition(-vector.data, MAX_QUERY_FEATURES)[:MAX_QUERY_FEATURES]
+        return sparse.csr_matrix((vector.data[keep], (np.zeros(len(keep), dtype=np.int32), vector.indices[keep])),
+                                 shape=vector.shape)
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'books': len(self.book_ids) + len(self.delta_ids),
+            'delta': len(self.delta_ids),
+            'cursor': self.cursor,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or update the TF-IDF similar-books index")
+    parser.add_argument('--database-url', help="database to index (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--path', default=SIMILAR_INDEX_DIR, help="index directory")
+    parser.add_argument('--update', action='store_true', help="only vectorize books added since the last build")
+    parser.add_argument('--query', type=int, help="print books similar to this book id")
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    index = SimilarIndex.open(args.path) if args.update else None
+    if index is None:
+        index = SimilarIndex.build(lib, args.path)
+    else:
+        index.update(lib)
+    if args.query:
+        for book_id, score in index.similar(args.query):
+            book = lib.get_book(book_id)
+            print(f"{score:.3f}  {book['title']} — {book['author']}" if book else f"{score:.3f}  #{book_id}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
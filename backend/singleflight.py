@@ -0,0 +1,80 @@
+"""
+دمج القراءات المتطابقة المتزامنة (single-flight) داخل العملية
+
+الطلب الأول لمفتاح ينفذ الاستعلام، والطلبات المتطابقة التي تصل أثناء تنفيذه تنتظر نفس النتيجة
+(أو نفس الاستثناء) بدل استعلام خاص بكل منها. لا يوجد تخزين بعد انتهاء الاستعلام، فالنتيجة
+ليست أقدم من استعلام كان سيبدأ على أي حال.
+"""
+
+import logging
+import os
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# أقصى انتظار لاستعلام جارٍ قبل أن ينفذ المنتظر استعلامه بنفسه
+COALESCE_TIMEOUT_SECONDS = float(os.getenv('COALESCE_TIMEOUT_SECONDS', 10))
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """استعلام واحد جارٍ لكل مفتاح؛ النتائج مشتركة بين المنتظرين فلا تُعدل"""
+
+    def __init__(self, timeout=COALESCE_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._counters = Counter()
+
+    def do(self, key, func, timeout=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._counters['misses'] += 1
+            else:
+                flight.waiters += 1
+                self._counters['coalesced'] += 1
+
+        if leader:
+            try:
+                flight.result = func()
+                return flight.result
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+        timeout = self.timeout if timeout is None else timeout
+        if not flight.done.wait(timeout):
+            with self._lock:
+                self._counters['timeouts'] += 1
+            logger.warning(f"⚠️  Coalesced read {key[0]} still running after {timeout}s; querying directly")
+            return func()
+        with self._lock:
+            self._counters['errors' if flight.error is not None else 'hits'] += 1
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stats(self):
+        """misses: نفذت الاستعلام، coalesced: انضمت لاستعلام جارٍ، hits: منها حصلت على نتيجته"""
+        with self._lock:
+            return {
+                **{name: self._counters[name] for name in ('misses', 'coalesced', 'hits', 'errors', 'timeouts')},
+                'in_flight': len(self._flights),
+            }
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+فهرس بادئات مضغوط في الذاكرة للإكمال التلقائي لعناوين الكتب والمؤلفين
+
+النصوص مرتبة حسب المفتاح الموحد ومخزنة في كتلة UTF-8 واحدة مع مصفوفات NumPy للإزاحات والأوزان،
+فلا يوجد كائن Python لكل نص ويبقى الفهرس صغيراً لملايين العناوين. البحث عن بادئة هو بحث ثنائي
+يعطي نطاقاً متصلاً، ثم أعلى k حسب عدد الإعارات داخل النطاق.
+"""
+
+import argparse
+from array import array
+from bisect import bisect_left, insort
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+import backends
+
+# تحميل متغيرات البيئة
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TITLE, AUTHOR = 0, 1
+KIND_NAMES = ('title', 'author')
+
+SUGGEST_SNAPSHOT = os.getenv('SUGGEST_SNAPSHOT', 'suggest_index.npz')
+# كل كم ثانية يُطبق سجل تغييرات الكتالوج على الفهرس عند الطلب
+SUGGEST_SYNC_SECONDS = float(os.getenv('SUGGEST_SYNC_SECONDS', 5))
+# الإدخالات الجديدة تبقى في قائمة صغيرة حتى هذا الحد ثم تُدمج في المصفوفات
+SUGGEST_MERGE_THRESHOLD = int(os.getenv('SUGGEST_MERGE_THRESHOLD', 2000))
+# الكتب في كل جزء مرتب أثناء البناء: يحد ذروة الذاكرة
+BUILD_CHUNK = 100000
+
+# أكبر من أي حرف يمكن أن يلي البادئة
+_PREFIX_END = '\U0010ffff'
+
+
+def normalize(text):
+    """مفتاح المقارنة: بدون حالة الأحرف ومسافات موحدة"""
+    return ' '.join(text.casefold().split()) if text else ''
+
+
+class Segment:
+    """مجموعة إدخالات مرتبة حسب (المفتاح، النوع) لا تتغير بعد إنشائها"""
+
+    def __init__(self, blob, offsets, kinds, book_ids, weights):
+        self.blob = blob
+        self.offsets = offsets
+        self.kinds = kinds
+        self.book_ids = book_ids
+        self.weights = weights
+
+    @classmethod
+    def from_entries(cls, entries):
+        """entries مرتبة: (المفتاح، النوع، النص، book_id، الوزن) بدون تكرار"""
+        blob = bytearray()
+        # array بدل list: لا كائن int لكل إدخال أثناء البناء
+        offsets, kinds, book_ids, weights = array('q', [0]), array('b'), array('i'), array('i')
+        for _, kind, text, book_id, weight in entries:
+            blob += text.encode('utf-8')
+            offsets.append(len(blob))
+            kinds.append(kind)
+            book_ids.append(book_id)
+            weights.append(weight)
+        return cls(bytes(blob), np.frombuffer(offsets, dtype=np.int64), np.frombuffer(kinds, dtype=np.int8),
+                   np.frombuffer(book_ids, dtype=np.int32), np.frombuffer(weights, dtype=np.int32))
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def nbytes(self):
+        return len(self.blob) + self.offsets.nbytes + self.kinds.nbytes + self.book_ids.nbytes + self.weights.nbytes
+
+    def text(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def key(self, i):
+        return normalize(self.text(i))
+
+    def lower_bound(self, key, lo=0):
+        """أول موضع مفتاحه >= key"""
+        hi = len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix_range(self, prefix):
+        lo = self.lower_bound(prefix)
+        return lo, self.lower_bound(prefix + _PREFIX_END, lo)
+
+    def contains(self, key, kind):
+        i = self.lower_bound(key)
+        while i < len(self) and self.key(i) == key:
+            if self.kinds[i] == kind:
+                return True
+            i += 1
+        return False
+
+    def entries(self):
+        for i in range(len(self)):
+            text = self.text(i)
+            yield normalize(text), int(self.kinds[i]), text, int(self.book_ids[i]), int(self.weights[i])
+
+
+def merge_entries(*sources):
+    """دمج مصادر مرتبة، وجمع أوزان المفتاح المكرر (نفس العنوان لأكثر من كتاب)"""
+    current = None
+    for entry in heapq.merge(*sources):
+        if current is not None and entry[:2] == current[:2]:
+            current[4] += entry[4]
+            current[3] = current[3] or entry[3]
+            continue
+        if current is not None:
+            yield tuple(current)
+        current = list(entry)
+    if current is not None:
+        yield tuple(current)
+
+
+def book_entries(book_id, title, author, loans):
+    if title and normalize(title):
+        yield normalize(title), TITLE, title, book_id, loans
+    if author and normalize(author):
+        yield normalize(author), AUTHOR, author, 0, loans
+
+
+class SuggestIndex:
+    """الفهرس الرئيسي + قائمة صغيرة للإضافات منذ آخر دمج
+
+    المؤشر cursor هو موضع سجل catalog_changes الذي يعكسه الفهرس؛ sync() يطبق ما بعده.
+    الكتب الجديدة والعناوين المعدلة تُضاف فوراً، أما الحذف والأوزان فتُحدث عند إعادة البناء.
+    """
+
+    def __init__(self, segment=None, cursor=0):
+        self.segment = segment or Segment.from_entries([])
+        self.extra = []
+        self.cursor = cursor
+        self.built_at = time.time()
+        self._lock = threading.Lock()
+        self._merging = threading.Lock()
+        self._last_sync = 0.0
+
+    @classmethod
+    def build(cls, lib, chunk_size=BUILD_CHUNK):
+        """بناء من قاعدة البيانات على أجزاء مرتبة تُدمج في النهاية"""
+        started = time.time()
+        # المؤشر قبل القراءة: ما يتغير أثناء البناء يُعاد تطبيقه في أول sync
+        cursor = lib.get_change_cursor()
+        segments = []
+        pending = {}
+        books = 0
+        for row in lib.iter_book_popularity():
+            books += 1
+            for entry in book_entries(row['id'], row['title'], row['author'], int(row['loans'])):
+                found = pending.get(entry[:2])
+                if found is None:
+                    pending[entry[:2]] = list(entry)
+                else:
+                    found[4] += entry[4]
+            if len(pending) >= chunk_size:
+                segments.append(Segment.from_entries(sorted(tuple(e) for e in pending.values())))
+                pending = {}
+        segments.append(Segment.from_entries(sorted(tuple(e) for e in pending.values())))
+        del pending
+
+        segment = Segment.from_entries(merge_entries(*(s.entries() for s in segments)))
+        index = cls(segment, cursor)
+        logger.info(f"✅ Suggest index built: {books:,} book(s), {len(segment):,} entries, "
+                    f"{segment.nbytes / 1024 / 1024:.1f} MiB in {time.time() - started:.1f}s")
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            segment = Segment(data['blob'].tobytes(), data['offsets'], data['kinds'],
+                              data['book_ids'], data['weights'])
+            index = cls(segment, int(data['cursor'][0]))
+            index.built_at = float(data['built_at'][0])
+        logger.info(f"✅ Suggest index loaded from {path}: {len(segment):,} entries")
+        return index
+
+    @classmethod
+    def load_or_build(cls, lib, path=SUGGEST_SNAPSHOT):
+        if path and os.path.exists(path):
+            try:
+                return cls.load(path)
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning(f"⚠️  Ignoring unreadable suggest snapshot {path}: {e}")
+        index = cls.build(lib)
+        if path:
+            index.save(path)
+        return index
+
+    def save(self, path=SUGGEST_SNAPSHOT):
+        """كتابة لقطة للتحميل السريع؛ الكتابة لملف مؤقت ثم استبدال حتى لا تُقرأ لقطة ناقصة"""
+        self.merge()
+        with self._lock:
+            segment, cursor = self.segment, self.cursor
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, blob=np.frombuffer(segment.blob, dtype=np.uint8), offsets=segment.offsets,
+                     kinds=segment.kinds, book_ids=segment.book_ids, weights=segment.weights,
+                     cursor=np.array([cursor], dtype=np.int64),
+                     built_at=np.array([self.built_at], dtype=np.float64))
+        os.replace(tmp, path)
+        logger.info(f"💾 Suggest snapshot saved to {path}")
+
+    def add(self, book_id, title, author, loans=0):
+        """إضافة عنوان ومؤلف كتاب إذا لم يكونا موجودين"""
+        with self._lock:
+            self._add(book_entries(book_id, title, author, loans))
+        if len(self.extra) >= SUGGEST_MERGE_THRESHOLD:
+            self.merge()
+
+    def _add(self, entries):
+        extra = list(self.extra)
+        for entry in entries:
+            key, kind = entry[:2]
+            position = bisect_left(extra, (key, kind))
+            if position < len(extra) and extra[position][:2] == (key, kind):
+                continue
+            if not self.segment.contains(key, kind):
+                insort(extra, entry)
+        # استبدال القائمة كاملة: البحث المتزامن يرى القديمة أو الجديدة فقط
+        self.extra = extra
+
+    def merge(self):
+        """دمج الإضافات في جزء جديد يُبنى خارج القفل ثم يُستبدل تحته؛ دمج واحد في نفس الوقت"""
+        if not self._merging.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                segment, extra = self.segment, self.extra
+            if not extra:
+                return
+            merged = Segment.from_entries(merge_entries(segment.entries(), iter(extra)))
+            with self._lock:
+                # ما أُضيف أثناء البناء يبقى في القائمة (_add يستبدلها ولا يحذف منها)
+                merged_keys = {entry[:2] for entry in extra}
+                self.segment = merged
+                self.extra = [entry for entry in self.extra if entry[:2] not in merged_keys]
+        finally:
+            self._merging.release()
+
+    def sync_due(self):
+        return time.monotonic() - self._last_sync >= SUGGEST_SYNC_SECONDS
+
+    def sync(self, lib, force=False):
+        """تطبيق سجل التغييرات منذ cursor ثم الدمج عند الحد؛ يعيد False إذا كان السجل قد حُذف ويلزم إعادة البناء
+
+        تستدعيه app.py في خيط خلفي، لا داخل طلب الإكمال.
+        """
+        now = time.monotonic()
+        if not force and not self.sync_due():
+            return True
+        if not self._lock.acquire(blocking=force):
+            # thread آخر يطبق التغييرات الآن
+            return True
+        try:
+            self._last_sync = now
+            while True:
+                result = lib.get_changes(self.cursor, 1000)
+                if result is None:
+                    logger.warning("⚠️  Suggest index is older than the change log, rebuild needed")
+                    return False
+                changes, self.cursor, more = result
+                self._add(entry for change in changes if change['op'] != 'delete'
+                          for entry in book_entries(change['book_id'], change['title'], change['author'], 0))
+                if not more:
+                    break
+        finally:
+            self._lock.release()
+        if len(self.extra) >= SUGGEST_MERGE_THRESHOLD:
+            self.merge()
+        return True
+
+    def suggest(self, prefix, limit=10):
+        """أعلى limit إكمالات للبادئة، الأكثر إعارة أولاً"""
+        key = normalize(prefix)
+        if not key:
+            return []
+        segment, extra = self.segment, self.extra
+
+        candidates = []
+        lo, hi = segment.prefix_range(key)
+        if hi > lo:
+            weights = segment.weights[lo:hi]
+            if hi - lo > limit:
+                # argpartition على النطاق فقط: O(حجم النطاق) بدون فرز كامل
+                top = np.argpartition(-weights, limit)[:limit]
+            else:
+                top = np.arange(hi - lo)
+            for i in top:
+                position = lo + int(i)
+                candidates.append((int(segment.weights[position]), segment.text(position),
+                                   int(segment.kinds[position]), int(segment.book_ids[position])))
+        start = bisect_left(extra, (key,))
+        for entry in extra[start:]:
+            if not entry[0].startswith(key):
+                break
+            candidates.append((entry[4], entry[2], entry[1], entry[3]))
+
+        candidates.sort(key=lambda c: (-c[0], normalize(c[1])))
+        return [
+            {'text': text, 'kind': KIND_NAMES[kind], 'book_id': book_id or None, 'loans': weight}
+            for weight, text, kind, book_id in candidates[:limit]
+        ]
+
+    def stats(self):
+        return {
+            'entries': len(self.segment) + len(self.extra),
+            'pending': len(self.extra),
+            'bytes': self.segment.nbytes,
+            'cursor': self.cursor,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.built_at)),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the type-ahead suggest index and write its snapshot file")
+    parser.add_argument('--database-url', help="database to index (default: DATABASE_URL / DB_BACKEND)")
+    parser.add_argument('--output', default=SUGGEST_SNAPSHOT, help="snapshot file to write")
+    parser.add_argument('--query', help="print suggestions for this prefix after building")
+    args = parser.parse_args(argv)
+
+    lib = backends.create_library_system(database_url=args.database_url)
+    index = SuggestIndex.build(lib)
+    index.save(args.output)
+    if args.query:
+        for suggestion in index.suggest(args.query):
+            print(f"{suggestion['loans']:>8}  {suggestion['kind']:<6}  {suggestion['text']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())